@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Decodificación de varias señales morse a distintas frecuencias dentro de una
+misma grabación de banda ancha (por ejemplo, la salida de audio de un SDR).
+
+Se calcula una única STFT sobre toda la pista, se detectan en su espectro
+medio las portadoras activas y la magnitud de cada una a lo largo del tiempo
+se trata como la envolvente de un canal independiente, que pasa por la
+clasificación de tonos y pausas habitual.
+
+Uso: python banco_filtros_morse.py archivo.wav [--resolucion 50] [--json]
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import decodificador_morse_v2 as dm
+
+# Resolución en frecuencia (Hz) de la STFT: fija la longitud de la ventana
+# (1/resolución segundos). Las portadoras deben estar separadas al menos
+# unas 3 veces esta resolución.
+RESOLUCION = 50
+
+# Avance entre ventanas consecutivas, en fracciones de ventana. La duración
+# de los tonos se mide en múltiplos de este avance, y la clasificación
+# admite un 10% de diferencia entre tonos del mismo tipo: con 1/8 de
+# ventana (2.5 ms a 50 Hz de resolución) cabe hasta unas 30 wpm.
+SOLAPE = 0.125
+
+# Rango de frecuencias en el que se buscan portadoras.
+FRECUENCIA_MINIMA = 200
+FRECUENCIA_MAXIMA = 3000
+
+# Una portadora es activa si su potencia media supera en este número de
+# decibelios a la mediana del espectro (el nivel de ruido).
+UMBRAL_DB = 10
+
+# Umbral sobre la magnitud de cada canal, relativa a su nivel de tono.
+UMBRAL_CANAL = 0.5
+
+# Número de ventanas de la STFT que se calculan a la vez.
+VENTANAS_POR_BLOQUE = 4096
+
+###### STFT ######
+
+# Recorre la pista por bloques de ventanas y devuelve, para cada bin dentro
+# del rango de interés, su magnitud en cada ventana (bins x ventanas, en
+# float16 para acotar la memoria) y la potencia media de cada bin.
+def espectrograma(data, sample_rate, resolucion=RESOLUCION,
+                  frecuencia_minima=FRECUENCIA_MINIMA, frecuencia_maxima=FRECUENCIA_MAXIMA):
+    longitud = int(round(sample_rate / resolucion))
+    avance = max(1, int(longitud * SOLAPE))
+    frecuencias = np.fft.rfftfreq(longitud, 1 / sample_rate)
+    bins = np.flatnonzero((frecuencias >= frecuencia_minima) & (frecuencias <= frecuencia_maxima))
+    hann = np.hanning(longitud).astype(np.float32)
+
+    total = max(0, (len(data) - longitud) // avance + 1)
+    magnitudes = np.empty((len(bins), total), dtype=np.float16)
+    potencia = np.zeros(len(bins))
+    for k0 in range(0, total, VENTANAS_POR_BLOQUE):
+        k1 = min(total, k0 + VENTANAS_POR_BLOQUE)
+        muestras = dm.a_float32(np.ascontiguousarray(data[k0 * avance:(k1 - 1) * avance + longitud]))
+        ventanas = sliding_window_view(muestras, longitud)[::avance] * hann
+        espectro = np.abs(np.fft.rfft(ventanas, axis=1)[:, bins])
+        # Escalamos para que una senoide de amplitud 1 dé magnitud 1.
+        espectro *= 2 / hann.sum()
+        magnitudes[:, k0:k1] = espectro.T
+        potencia += np.square(espectro, dtype=np.float64).sum(axis=0)
+
+    if total:
+        potencia /= total
+    return magnitudes, potencia, frecuencias[bins], avance
+
+###### DETECCIÓN DE CANALES ######
+
+# Las portadoras activas son los máximos locales del espectro medio que
+# superan en umbral_db al nivel de ruido.
+def detectar_portadoras(potencia, umbral_db=UMBRAL_DB):
+    if len(potencia) < 3:
+        return np.empty(0, dtype=int)
+    ruido = np.median(potencia)
+    minimo = ruido * 10 ** (umbral_db / 10)
+    centro = potencia[1:-1]
+    maximos = (centro > potencia[:-2]) & (centro >= potencia[2:]) & (centro > minimo)
+    return np.flatnonzero(maximos) + 1
+
+###### DECODIFICACIÓN DE CADA CANAL ######
+
+# La magnitud de un canal hace de envolvente: la normalizamos respecto al
+# nivel de sus tonos (percentil 99) y la pasamos por envolvente_a_tonos.
+# Con clasificador='adaptativo' se clasifica con dm.clasificacion_adaptativa,
+# que no depende de que todos los tonos del canal midan lo mismo.
+def decodificar_canal(magnitud, avance, sample_rate, umbral=UMBRAL_CANAL,
+                      silencio=dm.SILENCIO_ENVOLVENTE, clasificador='global'):
+    magnitud = magnitud.astype(np.float32)
+    nivel = np.percentile(magnitud, 99)
+    if nivel <= 0:
+        raise ValueError('Canal sin señal')
+    silencio_ventanas = max(1, round(silencio * sample_rate / avance))
+    tonos_morse = dm.envolvente_a_tonos(magnitud / nivel, avance, umbral, silencio_ventanas)
+    if len(tonos_morse) == 0:
+        raise ValueError('No se han detectado tonos en el canal')
+    if clasificador == 'adaptativo':
+        tonos_y_silencios_clasificados = dm.clasificacion_adaptativa(tonos_morse)
+    else:
+        tonos_y_silencios_clasificados = dm.clasificacion_tonos_y_silencios(tonos_morse)
+    return {
+        'morse': dm.a_morse_escrito(tonos_y_silencios_clasificados),
+        'texto': dm.tonos_a_latino(tonos_y_silencios_clasificados),
+        'tonos': len(tonos_morse),
+    }
+
+# Decodifica todas las portadoras de la pista con una sola pasada por los
+# datos. Devuelve una lista con un resultado por canal, ordenada por
+# frecuencia.
+def decodificar_banco(fuente, sample_rate=None, resolucion=RESOLUCION,
+                      frecuencia_minima=FRECUENCIA_MINIMA, frecuencia_maxima=FRECUENCIA_MAXIMA,
+                      umbral_db=UMBRAL_DB, umbral=UMBRAL_CANAL, verboso=False, clasificador='global'):
+    with dm.verbosidad(verboso):
+        sample_rate, data = dm.cargar_fuente(fuente, sample_rate)
+
+        magnitudes, potencia, frecuencias, avance = espectrograma(
+            data, sample_rate, resolucion, frecuencia_minima, frecuencia_maxima)
+        portadoras = detectar_portadoras(potencia, umbral_db)
+        dm.informar(f'Detectadas {len(portadoras)} portadoras: {frecuencias[portadoras]} Hz')
+
+        canales = []
+        for bin_portadora in portadoras:
+            resultado = {'frecuencia': float(frecuencias[bin_portadora])}
+            try:
+                resultado.update(decodificar_canal(magnitudes[bin_portadora], avance, sample_rate, umbral,
+                                                 clasificador=clasificador))
+            except ValueError as error:
+                resultado['error'] = str(error)
+            canales.append(resultado)
+    return canales
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decodifica todas las señales morse de una grabación de banda ancha.')
+    parser.add_argument('archivo')
+    parser.add_argument('--resolucion', type=float, default=RESOLUCION, help='resolución en Hz de la STFT')
+    parser.add_argument('--fmin', type=float, default=FRECUENCIA_MINIMA)
+    parser.add_argument('--fmax', type=float, default=FRECUENCIA_MAXIMA)
+    parser.add_argument('--umbral-db', type=float, default=UMBRAL_DB,
+                        help='margen sobre el ruido para considerar activa una portadora')
+    parser.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global',
+                        help='clasificación de tonos y pausas (adaptativo sigue los cambios de velocidad)')
+    parser.add_argument('--json', action='store_true', help='un objeto JSON por canal')
+    args = parser.parse_args(argv)
+
+    canales = decodificar_banco(args.archivo, resolucion=args.resolucion, frecuencia_minima=args.fmin,
+                                frecuencia_maxima=args.fmax, umbral_db=args.umbral_db,
+                                clasificador=args.clasificador)
+    for canal in canales:
+        if args.json:
+            print(json.dumps(canal, ensure_ascii=False))
+        else:
+            print(f"{canal['frecuencia']:7.1f} Hz: {canal.get('texto', 'ERROR ' + canal.get('error', ''))}")
+    return 1 if any('error' in canal for canal in canales) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
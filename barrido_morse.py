@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Barrido de umbrales y silencios intratono con elección automática.
+
+Con grabaciones ruidosas el umbral de amplitud y el silencio que se une
+dentro de un tono fijos no siempre sirven, y probar valores a mano obliga a
+decodificar la pista entera una vez por combinación. Aquí se prueban todas
+las combinaciones en una sola pasada: en cada bloque se buscan una sola vez
+los cambios de actividad de cada umbral distinto (los bajos de la histéresis
+suelen coincidir con otros altos), cada par de umbrales los combina en
+pulsos y los pulsos se agrupan antes de unirlos en tonos con cada silencio
+candidato. El resultado de cada candidato es el mismo que decodificando por
+separado. Cada candidato se puntúa por la regularidad de sus tiempos y la
+fracción de letras desconocidas ('#'), y se devuelve el mejor.
+
+Uso: python barrido_morse.py archivo.wav [--umbrales 0.1,0.2,0.3] [--histeresis 1,0.5]
+                             [--silencios 0.001,0.004] [--candidatos N] [--comparar] [--json]
+"""
+import argparse
+import itertools
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+
+# Umbrales de amplitud normalizada que se prueban por defecto.
+UMBRALES = (0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6)
+
+# Umbral bajo de la histéresis como fracción del alto: una muestra por
+# encima del alto activa el sonido y no se desactiva hasta bajar del bajo.
+# Con 1 no hay histéresis y el resultado es el de onda_a_pulsos.
+HISTERESIS = (1, 0.5)
+
+# Silencios intratono (en segundos) que se prueban por defecto.
+SILENCIOS = (0.001, 0.002, 0.004, 0.008)
+
+# Con menos tonos que estos un candidato no se tiene en cuenta: un único
+# tono, por ejemplo un chasquido, tiene unos tiempos perfectos.
+TONOS_MINIMOS = 4
+
+# Duración ideal de cada clase, en puntos (en el orden de dm.CLASES).
+UNIDADES_CLASES = np.array([1, 3, 1, 3, 7])
+
+###### DETECCIÓN CON TODOS LOS CANDIDATOS ######
+
+# Cambios de la actividad de un bloque respecto a un umbral: posiciones de
+# las subidas y bajadas dentro del bloque y actividad de la primera y la
+# última muestra. Se calculan una vez por umbral distinto y bloque y los
+# comparten todas las columnas que lo usan, como umbral alto o bajo.
+def cambios_umbral(bloque, umbral):
+    actividad = dm.actividad_umbral(bloque, umbral)
+    diferencias = np.diff(actividad.view(np.int8))
+    return (np.flatnonzero(diferencias == 1) + 1, np.flatnonzero(diferencias == -1) + 1,
+            bool(actividad[0]), bool(actividad[-1]))
+
+# Subidas y bajadas de unos cambios para una columna cuya última muestra
+# del bloque anterior tenía la actividad previo.
+def cambios_con_previo(cambios, previo):
+    subidas, bajadas, primera, _ = cambios
+    if primera and not previo:
+        subidas = np.concatenate(([0], subidas))
+    elif previo and not primera:
+        bajadas = np.concatenate(([0], bajadas))
+    return subidas, bajadas
+
+# Pulsos de un bloque de longitud muestras con histéresis: una muestra por
+# encima del umbral alto activa el sonido y no se desactiva hasta bajar del
+# bajo (sin histéresis, cambios_bajo es None). Se trabaja con los cambios de
+# los dos umbrales y no muestra a muestra: cada tramo por encima del bajo se
+# activa en su primera subida por encima del alto (o desde su comienzo, si
+# venía activo del bloque anterior) y se apaga donde acaba el tramo.
+def pulsos_histeresis(cambios_alto, cambios_bajo, longitud, estado):
+    if estado['activo'] is None:
+        estado['activo'] = cambios_alto[2]
+    subidas, bajadas = cambios_con_previo(cambios_alto, estado['activo'])
+    if cambios_bajo is None:
+        return dm.pulsos_de_cambios(subidas, bajadas, cambios_alto[3], longitud, estado)
+    comienzos, finales = cambios_con_previo(cambios_bajo, estado['activo'])
+
+    # El tramo que venía activo se apaga en el primer final; el resto de
+    # finales cierran, en orden, los tramos que empiezan en este bloque, y
+    # el último puede seguir abierto.
+    arrastrado, finales = (finales[:1], finales[1:]) if estado['activo'] else (finales[:0], finales)
+    cierres = np.append(finales, longitud)[:len(comienzos)]
+    primeras = np.searchsorted(subidas, comienzos)
+    activos = primeras < len(subidas)
+    activos[activos] = subidas[primeras[activos]] < cierres[activos]
+
+    if len(comienzos) > len(finales):
+        activo_final = bool(activos[-1])
+    else:
+        activo_final = estado['activo'] and len(arrastrado) == 0
+    return dm.pulsos_de_cambios(subidas[primeras[activos]],
+                                np.concatenate((arrastrado, finales[activos[:len(finales)]])),
+                                activo_final, longitud, estado)
+
+# Une los pulsos separados por menos de silencio (el menor de los
+# candidatos), que cualquier candidato uniría igualmente, para que la fusión
+# de cada candidato reciba unos pocos pulsos por tono en lugar de uno por
+# semiciclo de la portadora. Un grupo de varios pulsos sale como dos pulsos
+# pegados, (inicio, fin) y (fin, fin), que dan el mismo tono y los mismos
+# silencios con los vecinos; un pulso suelto sale tal cual, porque los
+# aislados se descartan. El último grupo espera al bloque siguiente.
+def agrupar_pulsos(pulsos, estado, silencio, final=False):
+    inicios, finales = pulsos['inicio'], pulsos['fin']
+    if estado['grupo'] is not None:
+        inicio, fin, varios_previo = estado['grupo']
+        inicios = np.concatenate(([inicio], inicios))
+        finales = np.concatenate(([fin], finales))
+    if len(inicios) == 0:
+        return np.empty(0, dtype=dm.TIPO_TONO)
+
+    cortes = np.flatnonzero(inicios[1:] - finales[:-1] >= silencio)
+    primeros = np.concatenate(([0], cortes + 1))
+    ultimos = np.append(cortes, len(inicios) - 1)
+    inicios, finales, varios = inicios[primeros], finales[ultimos], ultimos > primeros
+    if estado['grupo'] is not None:
+        varios[0] |= varios_previo
+    estado['grupo'] = None
+    if not final:
+        estado['grupo'] = (int(inicios[-1]), int(finales[-1]), bool(varios[-1]))
+        inicios, finales, varios = inicios[:-1], finales[:-1], varios[:-1]
+
+    indices = np.repeat(np.arange(len(inicios)), varios + 1)
+    inicios, finales = inicios[indices], finales[indices]
+    segundos = np.flatnonzero(np.diff(indices, prepend=-1) == 0)
+    inicios[segundos] = finales[segundos]
+    return dm.tonos_de_columnas(inicios, finales)
+
+# Tonos de cada candidato. Devuelve un diccionario {(umbral, histeresis,
+# silencio_segundos): tonos}. La pista se recorre una sola vez: cada par de
+# umbrales lleva su estado de pulsos y de agrupación y cada candidato el de
+# su fusión en tonos, como en iterar_tonos_bloques. Los pulsos agrupados se
+# acumulan hasta tener un bloque antes de fusionarlos con cada silencio.
+def tonos_candidatos(data, sample_rate, umbrales=UMBRALES, histeresis=HISTERESIS, silencios=SILENCIOS,
+                     tam_bloque=dm.TAM_BLOQUE):
+    pares = list(itertools.product(umbrales, histeresis))
+    limites = [(umbral, umbral * proporcion if proporcion < 1 else None) for umbral, proporcion in pares]
+    distintos = {limite for par in limites for limite in par if limite is not None}
+    muestras = [max(1, round(silencio * sample_rate)) for silencio in silencios]
+    estados = [dict(dm.estado_inicial(), grupo=None) for _ in pares]
+    fusiones = [[dm.estado_inicial() for _ in silencios] for _ in pares]
+    pendientes = [[] for _ in pares]
+    bloques = [[[] for _ in silencios] for _ in pares]
+
+    # Cerramos la pista con el indicador de final, como en onda_a_pulsos.
+    trozos = [data[i:i + tam_bloque] for i in range(0, len(data), tam_bloque)] + [dm.INDICADOR]
+    for n, bloque in enumerate(trozos):
+        final = n == len(trozos) - 1
+        with dm.etapa('cambios_barrido', ('muestras', 'umbrales')) as registro:
+            cambios = {umbral: cambios_umbral(bloque, umbral) for umbral in distintos}
+            registro['entrada'] = len(bloque)
+            registro['salida'] = len(cambios)
+        for (alto, bajo), estado, fusiones_par, pendientes_par, bloques_par in zip(
+                limites, estados, fusiones, pendientes, bloques):
+            with dm.etapa('onda_a_pulsos_barrido', ('muestras', 'pulsos')) as registro:
+                pulsos = pulsos_histeresis(cambios[alto], cambios.get(bajo), len(bloque), estado)
+                pendientes_par.append(agrupar_pulsos(pulsos, estado, min(muestras), final))
+                registro['entrada'] = len(bloque)
+                registro['salida'] = len(pulsos)
+            if not final and sum(map(len, pendientes_par)) < tam_bloque:
+                continue
+            with dm.etapa('pulsos_a_tonos_barrido', ('pulsos', 'tonos')) as registro:
+                pulsos = dm.unir_tonos(pendientes_par)
+                pendientes_par.clear()
+                for fusion, silencio, bloques_candidato in zip(fusiones_par, muestras, bloques_par):
+                    bloques_candidato.append(dm.pulsos_a_tonos_incremental(pulsos, fusion, silencio, final))
+                registro['entrada'] = len(pulsos) * len(silencios)
+                registro['salida'] = sum(len(bloques_candidato[-1]) for bloques_candidato in bloques_par)
+
+    return {(umbral, proporcion, silencio): dm.unir_tonos(bloques[i][j])
+            for i, (umbral, proporcion) in enumerate(pares) for j, silencio in enumerate(silencios)}
+
+###### PUNTUACIÓN ######
+
+# Desviación media de cada elemento respecto a su duración ideal en puntos
+# (1 o 3 para los tonos, 1, 3 o 7 para las pausas), en tanto por uno y
+# limitada a 1 para que una pausa muy larga entre transmisiones no pese más
+# que un tono mal medido. El punto es la mediana de lo que mide cada
+# elemento dividido por sus unidades.
+def error_temporal(elementos):
+    unidades = UNIDADES_CLASES[elementos['clase']]
+    puntos = elementos['duracion'] / unidades
+    punto = np.median(puntos)
+    if punto <= 0:
+        return 1.0
+    return float(np.mean(np.minimum(np.abs(puntos / punto - 1), 1)))
+
+# Fracción de letras que no existen en morse.
+def fraccion_desconocidas(texto):
+    letras = texto.replace(' ', '')
+    return letras.count('#') / len(letras) if letras else 1.0
+
+# Clasifica y traduce los tonos de un candidato y lo puntúa: la suma del
+# error temporal y la fracción de desconocidas (menos es mejor). Los
+# candidatos con muy pocos tonos no se puntúan (puntuacion None).
+def puntuar(tonos_morse, clasificador='global'):
+    if len(tonos_morse) < TONOS_MINIMOS:
+        return {'tonos': len(tonos_morse), 'puntuacion': None}
+    numero_tonos, elementos, mensaje, traduccion = dm.tonos_a_mensaje(tonos_morse, clasificador, False)
+    error = error_temporal(elementos)
+    desconocidas = fraccion_desconocidas(traduccion)
+    return {
+        'texto': traduccion,
+        'tonos': numero_tonos,
+        'error_temporal': round(error, 4),
+        'desconocidas': round(desconocidas, 4),
+        'puntuacion': round(error + desconocidas, 4),
+    }
+
+# Orden de los candidatos: por puntuación y, entre puntuaciones iguales (en
+# una pista limpia muchas lo son), el más cercano a los valores por defecto.
+# Los candidatos sin puntuar van al final.
+def clave_candidato(candidato):
+    puntuacion = candidato['puntuacion']
+    return (math.inf if puntuacion is None else round(puntuacion, 3),
+            abs(math.log(candidato['umbral'] / dm.UMBRAL)),
+            candidato['histeresis'] != 1,
+            abs(math.log(candidato['silencio_segundos'] / dm.SILENCIO_INTRATONO_SEGUNDOS)))
+
+###### DECODIFICACIÓN CON BARRIDO ######
+
+# Misma interfaz y resultado que dm.decodificar (sin envolvente ni
+# diezmado), pero eligiendo el umbral, la histéresis y el silencio
+# intratono entre todas las combinaciones de umbrales, histeresis y
+# silencios. Añade los valores elegidos, su puntuación y en 'candidatos'
+# todos los candidatos, del mejor al peor.
+def decodificar_barrido(fuente, sample_rate=None, umbrales=UMBRALES, histeresis=HISTERESIS, silencios=SILENCIOS,
+                        tam_bloque=dm.TAM_BLOQUE, morse_escrito=True, verboso=False, clasificador='global'):
+    if clasificador not in ('global', 'adaptativo'):
+        raise ValueError(f'Clasificador desconocido: {clasificador}')
+    with dm.verbosidad(verboso):
+        sample_rate, data = dm.cargar_fuente(fuente, sample_rate)
+        tonos = tonos_candidatos(data, sample_rate, umbrales, histeresis, silencios, tam_bloque)
+
+        candidatos = []
+        with dm.verbosidad(False), dm.etapa('puntuacion_barrido', ('candidatos', 'candidatos')) as registro:
+            for (umbral, proporcion, silencio), tonos_morse in tonos.items():
+                candidato = {'umbral': umbral, 'histeresis': proporcion, 'silencio_segundos': silencio}
+                candidato.update(puntuar(tonos_morse, clasificador))
+                candidatos.append(candidato)
+            candidatos.sort(key=clave_candidato)
+            registro['entrada'] = registro['salida'] = len(candidatos)
+
+        mejor = candidatos[0]
+        if mejor['puntuacion'] is None:
+            raise ValueError('No se han detectado tonos en la pista')
+        clave = (mejor['umbral'], mejor['histeresis'], mejor['silencio_segundos'])
+        numero_tonos, _, mensaje, traduccion = dm.tonos_a_mensaje(tonos[clave], clasificador, morse_escrito)
+        dm.informar(f"Umbral {mejor['umbral']}, histéresis {mejor['histeresis']}, "
+                    f"silencio {mejor['silencio_segundos']} s: {numero_tonos} pulsos")
+
+    return {
+        'morse': mensaje,
+        'texto': traduccion,
+        'tonos': numero_tonos,
+        'sample_rate': sample_rate,
+        'duracion': round(len(data) / sample_rate, 4),
+        'umbral': mejor['umbral'],
+        'histeresis': mejor['histeresis'],
+        'silencio_segundos': mejor['silencio_segundos'],
+        'puntuacion': mejor['puntuacion'],
+        'candidatos': candidatos,
+    }
+
+# Lista de números separados por comas.
+def lista_numeros(texto):
+    return tuple(float(valor) for valor in texto.split(','))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decodifica probando varios umbrales y silencios a la vez.')
+    parser.add_argument('archivo')
+    parser.add_argument('--umbrales', type=lista_numeros, default=UMBRALES, metavar='U1,U2,...')
+    parser.add_argument('--histeresis', type=lista_numeros, default=HISTERESIS, metavar='H1,H2,...',
+                        help='umbral bajo como fracción del alto (1 = sin histéresis)')
+    parser.add_argument('--silencios', type=lista_numeros, default=SILENCIOS, metavar='S1,S2,...',
+                        help='silencios intratono en segundos')
+    parser.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global')
+    parser.add_argument('--candidatos', type=int, default=5, help='número de candidatos que se muestran')
+    parser.add_argument('--comparar', action='store_true',
+                        help='decodificar también cada combinación sin histéresis por separado y comparar tiempos')
+    parser.add_argument('--json', action='store_true', help='resultado completo en JSON')
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    resultado = decodificar_barrido(args.archivo, umbrales=args.umbrales, histeresis=args.histeresis,
+                                    silencios=args.silencios, clasificador=args.clasificador)
+    resultado['segundos'] = round(time.perf_counter() - inicio, 4)
+    if args.comparar:
+        inicio = time.perf_counter()
+        for umbral, silencio in itertools.product(args.umbrales, args.silencios):
+            try:
+                dm.decodificar(args.archivo, umbral=umbral, silencio_segundos=silencio,
+                               clasificador=args.clasificador, morse_escrito=False)
+            except ValueError:
+                pass
+        resultado['segundos_por_separado'] = round(time.perf_counter() - inicio, 4)
+
+    if args.json:
+        print(json.dumps(resultado, ensure_ascii=False))
+        return 0
+    print(resultado['texto'])
+    print(f"Elegido: umbral {resultado['umbral']}, histéresis {resultado['histeresis']}, "
+          f"silencio {resultado['silencio_segundos']} s (puntuación {resultado['puntuacion']}); "
+          f"{len(resultado['candidatos'])} candidatos en {resultado['segundos']} s", file=sys.stderr)
+    if args.comparar:
+        sin_histeresis = len(args.umbrales) * len(args.silencios)
+        print(f"{sin_histeresis} decodificaciones por separado (sin histéresis): "
+              f"{resultado['segundos_por_separado']} s", file=sys.stderr)
+    print(f"  {'Umbral':>7} {'Histéresis':>10} {'Silencio':>9} {'Tonos':>7} {'Error':>7} {'#':>7} {'Total':>7}",
+          file=sys.stderr)
+    for candidato in resultado['candidatos'][:args.candidatos]:
+        if candidato['puntuacion'] is None:
+            break
+        print(f"  {candidato['umbral']:>7} {candidato['histeresis']:>10} {candidato['silencio_segundos']:>9} "
+              f"{candidato['tonos']:>7} {candidato['error_temporal']:>7.3f} {candidato['desconocidas']:>7.3f} "
+              f"{candidato['puntuacion']:>7.3f}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de rendimiento del decodificador morse.
+
+Genera pistas sintéticas con transcripción conocida (ver sintetizador_morse)
+y mide cada etapa del pipeline: muestras de audio por segundo, pico de
+memoria y precisión de la decodificación. Los resultados pueden guardarse en
+JSON y compararse con una ejecución anterior para detectar regresiones.
+
+Uso:
+    python benchmark_morse.py [duración ...] [--wpm 20] [--dtype int16] [--snr 20]
+    python benchmark_morse.py 1 60 2h --guardar base.json
+    python benchmark_morse.py 1 60 2h --comparar base.json
+    python benchmark_morse.py --referencia
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+import sintetizador_morse as sm
+
+# Duraciones (en segundos) de las pistas sintéticas que se miden por defecto
+# en las comparaciones con las implementaciones de referencia.
+DURACIONES = (10, 60, 300)
+
+# Duraciones por defecto de la prueba por etapas, desde clips de un segundo
+# hasta una hora.
+DURACIONES_ETAPAS = (1, 60, 600, 3600)
+
+# Texto que se repite en las pistas sintéticas.
+TEXTO = 'CQ CQ DE EA1ABC PARIS 73 K'
+
+# Una etapa es una regresión si su rendimiento cae más de esta fracción
+# respecto a la ejecución de referencia.
+TOLERANCIA = 0.3
+
+# Tiempo mínimo (en segundos) que se mide cada etapa repitiéndola, para que
+# el tiempo de los clips cortos no dependa del ruido del sistema.
+MINIMO_MEDICION = 0.2
+
+# Número de letras de los mensajes con que se mide la traducción.
+LETRAS = (1_000, 10_000, 100_000)
+
+# Veces que se lanza el decodificador en un proceso nuevo para medir el
+# arranque en frío (se toma la mediana).
+REPETICIONES_ARRANQUE = 5
+
+###### SEÑAL SINTÉTICA ######
+
+# Portadora de 700 Hz manipulada con 'PARIS' repetido hasta cubrir la
+# duración pedida. Es suficiente para reproducir la explosión de
+# micro-pulsos de una grabación real.
+def senal_sintetica(duracion, sample_rate=44100, frecuencia=700, wpm=20):
+    _, data = sm.sintetizar('PARIS', wpm=wpm, frecuencia=frecuencia, sample_rate=sample_rate,
+                            dtype=np.float32, duracion=duracion)
+    return data
+
+###### IMPLEMENTACIÓN DE REFERENCIA ######
+
+# Versión original de pulsos_a_tonos, recorriendo los pulsos en un bucle de
+# Python. Se conserva para comparar resultados y tiempos.
+def pulsos_a_tonos_bucle(pulsos, silencio_intratono=dm.SILENCIO_INTRATONO):
+    nuevo_pulso = [None, None]
+    pulsos_limpios = []
+    for i in range(len(pulsos)-1):
+        inicio_pulso_actual = pulsos[i][0]
+        inicio_pulso_siguiente = pulsos[i + 1][0]
+        fin_pulso_actual = pulsos[i][1]
+        fin_pulso_siguiente = pulsos[i + 1][1]
+        if (inicio_pulso_siguiente - fin_pulso_actual) < silencio_intratono:
+            if nuevo_pulso[0] is None:
+                nuevo_pulso[0] = inicio_pulso_actual
+                nuevo_pulso[1] = fin_pulso_siguiente
+            else:
+                nuevo_pulso[1] = fin_pulso_siguiente
+        elif (inicio_pulso_siguiente - fin_pulso_actual) > silencio_intratono:
+            if nuevo_pulso[0] is not None:
+                pulsos_limpios.append(nuevo_pulso)
+                nuevo_pulso = [None, None]
+    if nuevo_pulso[0] is not None:
+        pulsos_limpios.append(nuevo_pulso)
+    return pulsos_limpios
+
+# Versión original de a_morse_escrito seguida de morse_a_latino, construyendo
+# las cadenas con +=.
+def traduccion_cadenas(tonos_y_silencios_clasificados):
+    letra = ''
+    palabra = ''
+    mensaje = ''
+    for n in tonos_y_silencios_clasificados:
+        tipo = n[1]
+        if tipo == 'Tono corto':
+            letra += '.'
+        elif tipo == 'Tono largo':
+            letra += '-'
+        elif tipo == 'Pausa media':
+            if letra:
+                letra += ' '
+                palabra += letra
+                letra = ''
+        elif tipo == 'Pausa larga':
+            if letra:
+                letra += ' '
+                palabra += letra
+                letra = ''
+            if palabra:
+                mensaje += palabra + ' / '
+                palabra = ''
+    if letra:
+        palabra += letra
+    if palabra:
+        mensaje += palabra
+    traduccion = ''
+    for palabra in mensaje.split("  / "):
+        for letra in palabra.split(' '):
+            traduccion += dm.morse_to_char.get(letra, '#')
+        traduccion += ' '
+    return traduccion
+
+# Clasificación sintética de un mensaje de n letras al azar, con una pausa
+# larga cada cinco letras, en el formato original de [valor, etiqueta].
+def clasificacion_sintetica(letras, semilla=0):
+    rng = np.random.default_rng(semilla)
+    codigos = list(dm.morse_to_char)
+    clasificados = []
+    for i, indice in enumerate(rng.integers(len(codigos), size=letras)):
+        if i:
+            clasificados.append([0, 'Pausa larga' if i % 5 == 0 else 'Pausa media'])
+        for j, simbolo in enumerate(codigos[indice]):
+            if j:
+                clasificados.append([0, 'Pausa corta'])
+            clasificados.append([0, 'Tono corto' if simbolo == '.' else 'Tono largo'])
+    return clasificados
+
+###### MEDICIONES ######
+
+# Devuelve el resultado de la función y el mejor tiempo de varias ejecuciones
+# silenciando los print del pipeline.
+def cronometrar(funcion, *args, repeticiones=3):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        with contextlib.redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            resultado = funcion(*args)
+            mejor = min(mejor, time.perf_counter() - inicio)
+    return resultado, mejor
+
+def benchmark_pulsos_a_tonos(duraciones=DURACIONES):
+    print(f"{'Duración':>10} {'Pulsos':>10} {'Bucle (s)':>10} {'Vector (s)':>11} {'Mejora':>8}")
+    for duracion in duraciones:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pulsos = dm.onda_a_pulsos(senal_sintetica(duracion))
+        # El bucle de referencia se mide sobre la lista de tuplas original.
+        lista_pulsos = pulsos.tolist()
+        tonos_bucle, t_bucle = cronometrar(pulsos_a_tonos_bucle, lista_pulsos, repeticiones=1)
+        tonos_vector, t_vector = cronometrar(dm.pulsos_a_tonos, pulsos)
+        if tonos_vector.tolist() != list(map(tuple, tonos_bucle)):
+            print(f'ERROR: LOS TONOS NO COINCIDEN PARA {duracion}s')
+        print(f'{duracion:>9}s {len(pulsos):>10} {t_bucle:>10.4f} {t_vector:>11.4f} {t_bucle / t_vector:>7.1f}x')
+
+# Compara la traducción con cadenas con la de códigos enteros, tanto desde
+# la lista de etiquetas (incluye convertirlas) como desde los elementos
+# clasificados.
+def benchmark_traduccion(letras=LETRAS):
+    print(f"{'Letras':>10} {'Cadenas (s)':>12} {'Etiquetas (s)':>14} {'Clases (s)':>11} {'Mejora':>8}")
+    for n in letras:
+        clasificados = clasificacion_sintetica(n)
+        clases = dm.a_elementos(clasificados)
+        texto_cadenas, t_cadenas = cronometrar(traduccion_cadenas, clasificados)
+        texto_etiquetas, t_etiquetas = cronometrar(dm.tonos_a_latino, clasificados)
+        texto_clases, t_clases = cronometrar(dm.tonos_a_latino, clases)
+        if not texto_cadenas == texto_etiquetas == texto_clases:
+            print(f'ERROR: LAS TRADUCCIONES NO COINCIDEN PARA {n} LETRAS')
+        print(f'{n:>10} {t_cadenas:>12.4f} {t_etiquetas:>14.4f} {t_clases:>11.4f} {t_cadenas / t_clases:>7.1f}x')
+
+
+###### PRUEBA POR ETAPAS ######
+
+# Distancia de edición entre dos secuencias (de palabras), vectorizada por
+# filas: la inserción dentro de una fila se resuelve con un mínimo acumulado.
+def distancia_edicion(a, b):
+    vocabulario = {}
+    a = np.array([vocabulario.setdefault(x, len(vocabulario)) for x in a], dtype=np.int64)
+    b = np.array([vocabulario.setdefault(x, len(vocabulario)) for x in b], dtype=np.int64)
+    columnas = np.arange(len(b) + 1)
+    fila = columnas.copy()
+    for i, x in enumerate(a, start=1):
+        candidatos = np.empty_like(fila)
+        candidatos[0] = i
+        candidatos[1:] = np.minimum(fila[1:] + 1, fila[:-1] + (b != x))
+        fila = np.minimum.accumulate(candidatos - columnas) + columnas
+    return int(fila[-1])
+
+# Fracción de palabras bien decodificadas (1 - tasa de error de palabra).
+def precision(esperado, obtenido):
+    esperado, obtenido = esperado.split(), obtenido.split()
+    if not esperado:
+        return float(not obtenido)
+    return max(0.0, 1 - distancia_edicion(esperado, obtenido) / len(esperado))
+
+# Ejecuta una etapa y devuelve su resultado, el mejor tiempo y, si se pide,
+# el pico de memoria reservada durante la etapa (en una ejecución aparte,
+# porque tracemalloc ralentiza el código que observa). Las etapas rápidas
+# se repiten hasta sumar al menos MINIMO_MEDICION segundos.
+def medir(funcion, *args, memoria=True):
+    resultado, segundos = cronometrar(funcion, *args, repeticiones=1)
+    repeticiones = min(1000, int(MINIMO_MEDICION / max(segundos, 1e-6)))
+    if repeticiones > 1:
+        _, segundos = cronometrar(funcion, *args, repeticiones=repeticiones)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pico = None
+        if memoria:
+            tracemalloc.start()
+            funcion(*args)
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return resultado, segundos, pico
+
+# Mediana del tiempo de reloj de una orden lanzada en un proceso nuevo cada
+# vez, importaciones incluidas: es lo que paga cada llamada desde un script
+# de shell y, en los clips cortos, pesa más que la propia decodificación.
+def medir_arranque(orden, repeticiones=REPETICIONES_ARRANQUE):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        subprocess.run(orden, cwd=os.path.dirname(os.path.abspath(dm.__file__)), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        tiempos.append(time.perf_counter() - inicio)
+    return float(np.median(tiempos))
+
+def tonos_diezmados(data, sample_rate):
+    return dm.unir_tonos(dm.iterar_tonos_diezmados(data, sample_rate))
+
+# Numba es opcional: sin él solo se mide el motor de NumPy.
+def numba_disponible():
+    try:
+        import compilado_morse  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def tonos_numba(data):
+    with dm.usar_motor('numba'):
+        return dm.onda_a_tonos(data)
+
+# Aceleración del motor compilado respecto a NumPy en las etapas que tienen
+# las dos versiones, o None si no se ha medido.
+def aceleracion_motor(filas):
+    segundos = {fila['etapa']: fila['segundos'] for fila in filas}
+    if 'tonos_numba' not in segundos:
+        return None
+    return {'motor': 'numba',
+            'tonos': segundos['tonos'] / segundos['tonos_numba'],
+            'total': segundos['total_muestra'] / segundos['total_muestra_numba']}
+
+# Mide todas las etapas sobre una pista ya escrita en disco. El rendimiento
+# de cada etapa se expresa en muestras de audio por segundo para poder
+# compararlas entre sí aunque trabajen sobre tonos y no sobre muestras.
+def medir_etapas(ruta_archivo, esperado, memoria=True, arranque=True):
+    filas = []
+
+    def anotar(etapa, funcion, *args, elementos=None):
+        resultado, segundos, pico = medir(funcion, *args, memoria=memoria)
+        filas.append({
+            'etapa': etapa,
+            'segundos': segundos,
+            'muestras_por_segundo': muestras / segundos if segundos else float('inf'),
+            'pico_bytes': pico,
+            'elementos': elementos(resultado) if elementos else None,
+        })
+        return resultado
+
+    sample_rate, data = dm.carga_audio_mmap(ruta_archivo)
+    muestras = len(data)
+    # Arranque en frío: solo la importación y la línea de comandos completa.
+    if arranque:
+        for nombre, orden in (('importacion', [sys.executable, '-c', 'import decodificador_morse_v2']),
+                              ('linea_de_comandos', [sys.executable, dm.__file__, ruta_archivo])):
+            segundos = medir_arranque(orden)
+            filas.append({'etapa': nombre, 'segundos': segundos, 'muestras_por_segundo': muestras / segundos,
+                          'pico_bytes': None, 'elementos': None})
+    tonos = anotar('tonos', dm.onda_a_tonos, data, elementos=len)
+    compilado = numba_disponible()
+    if compilado:
+        # La primera llamada compila (o carga de la caché de Numba) el
+        # núcleo; no debe contar en la medición.
+        cronometrar(tonos_numba, data[:dm.TAM_BLOQUE], repeticiones=1)
+        if anotar('tonos_numba', tonos_numba, data, elementos=len).tobytes() != tonos.tobytes():
+            print(f'ERROR: LOS TONOS DE NUMBA NO COINCIDEN CON LOS DE NUMPY ({ruta_archivo})')
+    anotar('tonos_envolvente', dm.onda_a_tonos_envolvente, data, sample_rate, elementos=len)
+    anotar('tonos_diezmado', tonos_diezmados, data, sample_rate, elementos=len)
+    clasificados = anotar('clasificacion', dm.clasificacion_tonos_y_silencios, tonos, elementos=len)
+    anotar('clasificacion_adaptativa', dm.clasificacion_adaptativa, tonos, elementos=len)
+    anotar('traduccion', dm.tonos_a_latino, clasificados, elementos=len)
+
+    precisiones = {}
+    for variante, parametros in (('muestra', {}), ('envolvente', {'envolvente': 'rms'}),
+                                 ('diezmado', {'frecuencia_trabajo': dm.FRECUENCIA_TRABAJO}),
+                                 ('adaptativa', {'clasificador': 'adaptativo'})):
+        try:
+            decodificar = functools.partial(dm.decodificar, morse_escrito=False, **parametros)
+            resultado = anotar(f'total_{variante}', decodificar, ruta_archivo)
+            precisiones[variante] = precision(esperado, resultado['texto'])
+        except ValueError:
+            precisiones[variante] = 0.0
+    if compilado:
+        anotar('total_muestra_numba', functools.partial(dm.decodificar, morse_escrito=False, motor='numba'),
+               ruta_archivo)
+    return {'muestras': muestras, 'sample_rate': sample_rate, 'etapas': filas, 'precision': precisiones,
+            'motor_compilado': aceleracion_motor(filas)}
+
+# Sintetiza una pista de cada duración en un directorio temporal y mide sus
+# etapas. Devuelve una lista de resultados, uno por duración.
+def benchmark_etapas(duraciones=DURACIONES_ETAPAS, texto=TEXTO, wpm=20, frecuencia=700,
+                     sample_rate=8000, dtype='int16', snr=None, memoria=True, arranque=True, salida=sys.stdout):
+    resultados = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for duracion in duraciones:
+            ruta_archivo = os.path.join(directorio, f'{duracion:g}s.wav')
+            esperado, _ = sm.escribir_wav(ruta_archivo, texto, sample_rate, dtype, wpm=wpm,
+                                          frecuencia=frecuencia, snr=snr, duracion=duracion)
+            resultado = medir_etapas(ruta_archivo, esperado, memoria, arranque)
+            os.remove(ruta_archivo)
+            resultado.update({'duracion': duracion, 'wpm': wpm, 'frecuencia': frecuencia,
+                              'dtype': dtype, 'snr': snr})
+            resultados.append(resultado)
+            mostrar_etapas(resultado, salida)
+    return resultados
+
+def mostrar_etapas(resultado, salida=sys.stdout):
+    print(f"{resultado['duracion']:g} s, {resultado['muestras']} muestras a {resultado['sample_rate']} Hz "
+          f"({resultado['dtype']}, {resultado['wpm']:g} wpm, SNR {resultado['snr']} dB)", file=salida)
+    print(f"  {'Etapa':<26} {'Segundos':>10} {'Mmuestras/s':>12} {'Pico MiB':>9} {'Elementos':>10}", file=salida)
+    for fila in resultado['etapas']:
+        pico = '-' if fila['pico_bytes'] is None else f"{fila['pico_bytes'] / 2**20:.1f}"
+        elementos = '-' if fila['elementos'] is None else fila['elementos']
+        print(f"  {fila['etapa']:<26} {fila['segundos']:>10.4f} {fila['muestras_por_segundo'] / 1e6:>12.1f} "
+              f"{pico:>9} {elementos:>10}", file=salida)
+    precisiones = ', '.join(f'{k} {100 * v:.1f}%' for k, v in resultado['precision'].items())
+    print(f'  Precisión: {precisiones}', file=salida)
+    motor = resultado.get('motor_compilado')
+    if motor is None:
+        print('  Motor compilado: Numba no está instalado, solo se mide NumPy', file=salida)
+    else:
+        print(f"  Motor compilado ({motor['motor']}): tonos {motor['tonos']:.1f}x, "
+              f"total {motor['total']:.1f}x respecto a NumPy", file=salida)
+    print(file=salida)
+
+# Las ejecuciones se comparan pista a pista: misma duración y mismos
+# parámetros de síntesis.
+def clave_pista(resultado):
+    return tuple(resultado.get(k) for k in ('duracion', 'sample_rate', 'wpm', 'frecuencia', 'dtype', 'snr'))
+
+# Compara con una ejecución guardada y devuelve las regresiones encontradas:
+# etapas más lentas que la referencia más allá de la tolerancia y pérdidas
+# de precisión.
+def comparar(resultados, referencia, tolerancia=TOLERANCIA):
+    base = {clave_pista(r): r for r in referencia}
+    regresiones = []
+    for resultado in resultados:
+        anterior = base.get(clave_pista(resultado))
+        if anterior is None:
+            continue
+        rendimiento = {f['etapa']: f['muestras_por_segundo'] for f in anterior['etapas']}
+        for fila in resultado['etapas']:
+            previo = rendimiento.get(fila['etapa'])
+            if previo and fila['muestras_por_segundo'] < (1 - tolerancia) * previo:
+                regresiones.append(f"{resultado['duracion']:g} s {fila['etapa']}: "
+                                   f"{fila['muestras_por_segundo'] / previo:.2f}x la referencia")
+        for variante, valor in resultado['precision'].items():
+            previo = anterior['precision'].get(variante)
+            if previo is not None and valor < previo:
+                regresiones.append(f"{resultado['duracion']:g} s precisión {variante}: "
+                                   f"{100 * valor:.1f}% (antes {100 * previo:.1f}%)")
+    return regresiones
+
+# Admite segundos o un sufijo s, m o h (por ejemplo 90, 10m o 2h).
+def duracion_en_segundos(texto):
+    factores = {'s': 1, 'm': 60, 'h': 3600}
+    if texto[-1:] in factores:
+        return float(texto[:-1]) * factores[texto[-1]]
+    return float(texto)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pruebas de rendimiento del decodificador morse.')
+    parser.add_argument('duraciones', nargs='*', type=duracion_en_segundos,
+                        help='duraciones de las pistas (segundos, o con sufijo m/h)')
+    parser.add_argument('--texto', default=TEXTO)
+    parser.add_argument('--wpm', type=float, default=20)
+    parser.add_argument('--frecuencia', type=float, default=700)
+    parser.add_argument('-r', '--sample-rate', type=int, default=8000)
+    parser.add_argument('--dtype', choices=('uint8', 'int16', 'int32', 'float32'), default='int16')
+    parser.add_argument('--snr', type=float, help='relación señal/ruido en dB (sin ruido si se omite)')
+    parser.add_argument('--sin-memoria', action='store_true', help='no medir el pico de memoria (más rápido)')
+    parser.add_argument('--sin-arranque', action='store_true',
+                        help='no medir el arranque en frío de la línea de comandos')
+    parser.add_argument('--guardar', help='escribir los resultados en este JSON')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior con el que comparar')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA,
+                        help='caída de rendimiento admitida antes de marcar una regresión')
+    parser.add_argument('--referencia', action='store_true',
+                        help='comparar con las implementaciones originales en lugar de medir etapas')
+    args = parser.parse_args(argv)
+
+    if args.referencia:
+        benchmark_pulsos_a_tonos(args.duraciones or DURACIONES)
+        print()
+        benchmark_traduccion()
+        return 0
+
+    resultados = benchmark_etapas(args.duraciones or DURACIONES_ETAPAS, args.texto, args.wpm, args.frecuencia,
+                                  args.sample_rate, args.dtype, args.snr, not args.sin_memoria,
+                                  not args.sin_arranque)
+    pico = dm.pico_rss()
+    if pico is not None:
+        print(f'Pico de memoria residente del proceso: {pico / 2**20:.1f} MiB')
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=1)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(resultados, json.load(archivo), args.tolerancia)
+        for regresion in regresiones:
+            print(f'REGRESIÓN: {regresion}')
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Caché en disco de decodificaciones, direccionada por el contenido del audio.
+
+Cada pista se identifica por un hash de sus bytes, de modo que un archivo
+renombrado o copiado sigue encontrándose y uno modificado no. Se guardan dos
+niveles:
+
+- los tonos detectados, con clave hash + parámetros de detección (umbral,
+  silencio_intratono, envolvente), y
+- el resultado final, con clave anterior + parámetros de clasificación.
+
+Así, al cambiar solo la clasificación se reutilizan los tonos y se repiten
+únicamente las etapas baratas. La caché tiene un tamaño máximo y, al
+superarlo, se borran las entradas usadas hace más tiempo (LRU, según la
+fecha de modificación, que se actualiza en cada acierto).
+
+Uso: python cache_morse.py [--directorio DIR] [--limpiar]
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+
+# Directorio y tamaño máximo (en bytes) por defecto.
+DIRECTORIO_CACHE = os.environ.get(
+    'MORSE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'decodificador_morse'))
+TAMANO_MAXIMO = 512 * 2**20
+
+# Se incluye en todas las claves: cambiarla invalida la caché entera cuando
+# cambie el comportamiento del pipeline.
+VERSION = 1
+
+# Bytes que se leen a la vez al calcular el hash de un archivo.
+TAM_LECTURA = 2**20
+
+# Los tonos se guardan en little-endian sea cual sea la máquina.
+TIPO_TONO_ARCHIVO = dm.TIPO_TONO.newbyteorder('<')
+
+###### CLAVES ######
+
+# Hash del contenido de una pista. Los arrays se identifican por sus bytes,
+# su codificación y su sample_rate.
+def huella_audio(fuente, sample_rate=None):
+    if isinstance(fuente, (str, os.PathLike)):
+        estado = os.stat(fuente)
+        return huella_archivo(os.path.abspath(fuente), estado.st_size, estado.st_mtime_ns)
+    data = np.ascontiguousarray(fuente)
+    resumen = hashlib.blake2b(digest_size=16)
+    resumen.update(f'{data.dtype.str}{data.shape}{sample_rate}'.encode())
+    resumen.update(memoryview(data).cast('B'))
+    return resumen.hexdigest()
+
+# Dentro de un mismo proceso no se vuelve a leer un archivo que no ha
+# cambiado de tamaño ni de fecha desde la última vez.
+@functools.lru_cache(maxsize=1024)
+def huella_archivo(ruta, tamano, modificado):
+    resumen = hashlib.blake2b(digest_size=16)
+    with open(ruta, 'rb') as archivo:
+        while bloque := archivo.read(TAM_LECTURA):
+            resumen.update(bloque)
+    return resumen.hexdigest()
+
+def clave(*partes):
+    texto = json.dumps([VERSION, *partes], sort_keys=True)
+    return hashlib.blake2b(texto.encode(), digest_size=16).hexdigest()
+
+# Parámetros que cambian la lista de tonos y los que solo cambian su
+# clasificación. El tamaño de bloque no altera el resultado.
+def parametros_deteccion(umbral=dm.UMBRAL, silencio_intratono=dm.SILENCIO_INTRATONO, envolvente=None,
+                         frecuencia_trabajo=None, silencio_segundos=None):
+    parametros = {'umbral': umbral, 'silencio_intratono': silencio_intratono, 'envolvente': envolvente}
+    if envolvente is not None:
+        parametros.update(ventana=dm.VENTANA_ENVOLVENTE, silencio=dm.SILENCIO_ENVOLVENTE)
+    elif frecuencia_trabajo is not None or silencio_segundos is not None:
+        parametros.update(frecuencia_trabajo=frecuencia_trabajo, silencio_segundos=silencio_segundos)
+    return parametros
+
+def parametros_clasificacion(clasificador='global'):
+    parametros = {'clasificador': clasificador}
+    if clasificador == 'adaptativo':
+        parametros.update(adaptacion=dm.ADAPTACION, tonos_arranque=dm.TONOS_ARRANQUE)
+    return parametros
+
+###### ALMACENAMIENTO ######
+
+# Escritura atómica: varios procesos de un lote pueden escribir la misma
+# entrada a la vez sin dejar archivos a medias.
+def escribir_atomico(ruta, contenido):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+# Lee una entrada y la marca como usada. Devuelve None si no existe.
+def leer(ruta):
+    try:
+        with open(ruta, 'rb') as archivo:
+            contenido = archivo.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(ruta)
+    except FileNotFoundError:
+        pass
+    return contenido
+
+def ruta_tonos(directorio, clave_tonos):
+    return os.path.join(directorio, 'tonos', clave_tonos + '.bin')
+
+def ruta_resultado(directorio, clave_resultado):
+    return os.path.join(directorio, 'resultados', clave_resultado + '.json')
+
+# Los tonos se guardan tal cual (pares de enteros de 64 bits) precedidos de
+# un par (sample_rate, número de muestras) con los datos de la pista.
+# Devuelve (sample_rate, muestras, tonos) o None.
+def leer_tonos(directorio, clave_tonos):
+    contenido = leer(ruta_tonos(directorio, clave_tonos))
+    if contenido is None:
+        return None
+    tonos = np.frombuffer(contenido, dtype=TIPO_TONO_ARCHIVO)
+    return int(tonos[0]['inicio']), int(tonos[0]['fin']), tonos[1:].astype(dm.TIPO_TONO)
+
+def guardar_tonos(directorio, clave_tonos, sample_rate, muestras, tonos_morse):
+    cabecera = np.array([(sample_rate, muestras)], dtype=TIPO_TONO_ARCHIVO)
+    tonos = np.concatenate((cabecera, tonos_morse.astype(TIPO_TONO_ARCHIVO)))
+    escribir_atomico(ruta_tonos(directorio, clave_tonos), tonos.tobytes())
+
+# Todas las entradas de la caché como (ruta, tamaño, último uso).
+def entradas(directorio):
+    lista = []
+    for subdirectorio in ('tonos', 'resultados'):
+        carpeta = os.path.join(directorio, subdirectorio)
+        if not os.path.isdir(carpeta):
+            continue
+        for entrada in os.scandir(carpeta):
+            if entrada.name.endswith('.tmp'):
+                continue
+            try:
+                estado = entrada.stat()
+            except FileNotFoundError:
+                continue
+            lista.append((entrada.path, estado.st_size, estado.st_mtime))
+    return lista
+
+# Borra las entradas usadas hace más tiempo hasta quedar por debajo del
+# tamaño máximo. Devuelve el número de entradas borradas.
+def recortar(directorio, tamano_maximo=TAMANO_MAXIMO):
+    lista = entradas(directorio)
+    total = sum(tamano for _, tamano, _ in lista)
+    borradas = 0
+    for ruta, tamano, _ in sorted(lista, key=lambda entrada: entrada[2]):
+        if total <= tamano_maximo:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+        borradas += 1
+    return borradas
+
+###### DECODIFICACIÓN CON CACHÉ ######
+
+# Misma interfaz y resultado que dm.decodificar, con el campo 'cache' que
+# indica qué se ha reutilizado: 'resultado', 'tonos' o nada ('fallo').
+# Con grafica se decodifica sin caché, porque hace falta recorrer el audio.
+# Las posiciones no se guardan con el resultado: se calculan de los tonos
+# guardados, así que con posiciones=True solo se reutilizan los tonos. El
+# motor no entra en las claves porque todos detectan los mismos tonos.
+def decodificar_con_cache(fuente, sample_rate=None, directorio=DIRECTORIO_CACHE, tamano_maximo=TAMANO_MAXIMO,
+                          umbral=dm.UMBRAL, silencio_intratono=dm.SILENCIO_INTRATONO, tam_bloque=dm.TAM_BLOQUE,
+                          envolvente=None, morse_escrito=True, verboso=False, clasificador='global', grafica=None,
+                          frecuencia_trabajo=None, silencio_segundos=None, posiciones=False, motor=None):
+    if grafica is not None:
+        return dm.decodificar(fuente, sample_rate, umbral, silencio_intratono, tam_bloque, envolvente,
+                              morse_escrito, verboso, clasificador, grafica, frecuencia_trabajo,
+                              silencio_segundos, posiciones, motor)
+    huella = dm.medir_etapa('hash_audio', ('archivos', 'hashes'), huella_audio, fuente, sample_rate,
+                            contar_entrada=dm.contar_uno, contar_salida=dm.contar_uno)
+    clave_tonos = clave(huella, parametros_deteccion(umbral, silencio_intratono, envolvente,
+                                                     frecuencia_trabajo, silencio_segundos))
+    clave_resultado = clave(clave_tonos, parametros_clasificacion(clasificador))
+
+    contenido = None if posiciones else leer(ruta_resultado(directorio, clave_resultado))
+    if contenido is not None:
+        resultado = json.loads(contenido)
+        if not morse_escrito:
+            resultado['morse'] = None
+        resultado['cache'] = 'resultado'
+        return resultado
+
+    with dm.verbosidad(verboso), dm.usar_motor(motor or dm.MOTOR):
+        guardados = leer_tonos(directorio, clave_tonos)
+        if guardados is None:
+            sample_rate, data = dm.cargar_fuente(fuente, sample_rate)
+            muestras = len(data)
+            tonos_morse = dm.unir_tonos(dm.detectar_tonos(data, sample_rate, umbral, silencio_intratono,
+                                                          tam_bloque, envolvente, frecuencia_trabajo,
+                                                          silencio_segundos))
+            guardar_tonos(directorio, clave_tonos, sample_rate, muestras, tonos_morse)
+            acierto = 'fallo'
+        else:
+            sample_rate, muestras, tonos_morse = guardados
+            acierto = 'tonos'
+        # Una pista sin tonos también se guarda, pero el error se propaga
+        # como en dm.decodificar.
+        numero_tonos, tonos_y_silencios_clasificados, mensaje, traduccion = dm.tonos_a_mensaje(
+            tonos_morse, clasificador)
+
+    resultado = {
+        'morse': mensaje,
+        'texto': traduccion,
+        'tonos': numero_tonos,
+        'sample_rate': sample_rate,
+        'duracion': round(muestras / sample_rate, 4),
+    }
+    escribir_atomico(ruta_resultado(directorio, clave_resultado), json.dumps(resultado).encode())
+    recortar(directorio, tamano_maximo)
+    if not morse_escrito:
+        resultado['morse'] = None
+    if posiciones:
+        resultado['posiciones'] = dm.posiciones_caracteres(tonos_y_silencios_clasificados, tonos_morse)
+    resultado['cache'] = acierto
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Estado y limpieza de la caché de decodificaciones.')
+    parser.add_argument('--directorio', default=DIRECTORIO_CACHE)
+    parser.add_argument('--limpiar', action='store_true', help='borrar todas las entradas')
+    parser.add_argument('--maximo', type=float, help='recortar la caché a este tamaño en MiB')
+    args = parser.parse_args(argv)
+
+    if args.limpiar:
+        recortar(args.directorio, 0)
+    elif args.maximo is not None:
+        recortar(args.directorio, int(args.maximo * 2**20))
+    lista = entradas(args.directorio)
+    total = sum(tamano for _, tamano, _ in lista)
+    tonos = sum(1 for ruta, _, _ in lista if ruta.endswith('.bin'))
+    print(f'{args.directorio}: {tonos} listas de tonos, {len(lista) - tonos} resultados, '
+          f'{total / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
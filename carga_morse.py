@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Generador de carga para servicio_morse: lanza peticiones concurrentes de
+decodificación y mide el rendimiento (peticiones por segundo), la latencia
+hasta el resultado y hasta la primera respuesta, y cuántas se rechazan por
+cola llena.
+
+Uso: python carga_morse.py pista.wav [--destino 127.0.0.1:8765] [-n 200] [-c 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+import servicio_morse as sv
+
+###### CLIENTE ######
+
+# Con host:puerto se conecta por TCP; si no, es la ruta de un socket Unix
+# (el mismo convenio que tiempo_real_morse).
+async def conectar(destino):
+    if ':' in destino:
+        host, puerto = destino.rsplit(':', 1)
+        return await asyncio.open_connection(host, int(puerto))
+    return await asyncio.open_unix_connection(destino)
+
+# Lee una respuesta chunked como una lista de eventos JSON.
+async def leer_eventos(lector, al_recibir=None):
+    eventos = []
+    resto = b''
+    while True:
+        tamano = int((await lector.readline()).strip() or b'0', 16)
+        if tamano == 0:
+            break
+        resto += await lector.readexactly(tamano)
+        await lector.readexactly(2)
+        *lineas, resto = resto.split(b'\n')
+        for linea in lineas:
+            eventos.append(json.loads(linea))
+            if al_recibir is not None:
+                al_recibir(eventos[-1])
+    return eventos
+
+# Una petición de decodificación, subiendo el audio (cuerpo) o indicando la
+# ruta de un archivo local. Devuelve el código HTTP, los eventos recibidos
+# y los tiempos hasta la primera respuesta, la primera parcial y el final.
+async def peticion(destino, cuerpo=None, ruta_archivo=None, parametros=None):
+    consulta = dict(parametros or {})
+    if ruta_archivo is not None:
+        consulta['ruta'] = ruta_archivo
+    objetivo = '/decodificar?' + urllib.parse.urlencode(consulta)
+    cuerpo = cuerpo or b''
+
+    inicio = time.perf_counter()
+    tiempos = {}
+    lector, escritor = await conectar(destino)
+    try:
+        escritor.write(f'POST {objetivo} HTTP/1.1\r\nHost: morse\r\nContent-Length: {len(cuerpo)}\r\n'
+                       f'Connection: close\r\n\r\n'.encode() + cuerpo)
+        await escritor.drain()
+        codigo = int((await lector.readline()).split()[1])
+        tiempos['primera_respuesta'] = time.perf_counter() - inicio
+        cabeceras = {}
+        while (linea := await lector.readline()) not in (b'\r\n', b''):
+            nombre, _, valor = linea.decode('latin-1').partition(':')
+            cabeceras[nombre.strip().lower()] = valor.strip()
+
+        if cabeceras.get('transfer-encoding') == 'chunked':
+            def anotar(evento):
+                if 'parcial' in evento:
+                    tiempos.setdefault('primera_parcial', time.perf_counter() - inicio)
+            eventos = await leer_eventos(lector, anotar)
+        else:
+            eventos = [json.loads(await lector.readexactly(int(cabeceras['content-length'])))]
+    finally:
+        escritor.close()
+    tiempos['total'] = time.perf_counter() - inicio
+    return codigo, eventos, tiempos
+
+async def consultar(destino, ruta):
+    lector, escritor = await conectar(destino)
+    try:
+        escritor.write(f'GET {ruta} HTTP/1.1\r\nHost: morse\r\nConnection: close\r\n\r\n'.encode())
+        await escritor.drain()
+        respuesta = await lector.read()
+    finally:
+        escritor.close()
+    return respuesta.split(b'\r\n\r\n', 1)[1].decode()
+
+###### CARGA ######
+
+# Lanza n peticiones con como mucho concurrencia a la vez. Las rechazadas
+# (503) no se reintentan: cuentan como rechazos.
+async def generar_carga(destino, n, concurrencia, cuerpo=None, ruta_archivo=None, parametros=None):
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una():
+        async with semaforo:
+            try:
+                return await peticion(destino, cuerpo, ruta_archivo, parametros)
+            except (ConnectionError, asyncio.IncompleteReadError) as error:
+                return None, [{'error': str(error)}], {}
+
+    inicio = time.perf_counter()
+    respuestas = await asyncio.gather(*(una() for _ in range(n)))
+    segundos = time.perf_counter() - inicio
+    return resumen_carga(respuestas, segundos)
+
+def resumen_carga(respuestas, segundos):
+    completadas = [tiempos for codigo, eventos, tiempos in respuestas
+                   if codigo == 200 and 'resultado' in eventos[-1]]
+    resumen = {
+        'peticiones': len(respuestas),
+        'segundos': round(segundos, 3),
+        'completadas': len(completadas),
+        'rechazadas': sum(1 for codigo, _, _ in respuestas if codigo == 503),
+        'errores': len(respuestas) - len(completadas) - sum(1 for codigo, _, _ in respuestas if codigo == 503),
+        'por_segundo': round(len(completadas) / segundos, 2) if segundos else None,
+    }
+    for nombre in ('total', 'primera_respuesta', 'primera_parcial'):
+        resumen[f'latencia_{nombre}'] = sv.percentiles([t[nombre] for t in completadas if nombre in t])
+    return resumen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera carga concurrente contra servicio_morse.')
+    parser.add_argument('archivo')
+    parser.add_argument('--destino', default=f'127.0.0.1:{sv.PUERTO}', help='host:puerto o ruta de socket Unix')
+    parser.add_argument('-n', '--peticiones', type=int, default=100)
+    parser.add_argument('-c', '--concurrencia', type=int, default=8)
+    parser.add_argument('--ruta', action='store_true',
+                        help='enviar la ruta del archivo en lugar de subirlo (el servicio debe verlo)')
+    parser.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global')
+    parser.add_argument('--envolvente', choices=('rms', 'pico'))
+    args = parser.parse_args(argv)
+
+    parametros = {'clasificador': args.clasificador}
+    if args.envolvente:
+        parametros['envolvente'] = args.envolvente
+    if args.ruta:
+        cuerpo, ruta_archivo = None, os.path.abspath(args.archivo)
+    else:
+        with open(args.archivo, 'rb') as archivo:
+            cuerpo, ruta_archivo = archivo.read(), None
+
+    resumen = asyncio.run(generar_carga(args.destino, args.peticiones, args.concurrencia, cuerpo,
+                                        ruta_archivo, parametros))
+    print(json.dumps(resumen, ensure_ascii=False, indent=2))
+    print(asyncio.run(consultar(args.destino, '/salud')), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
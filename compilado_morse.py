@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Núcleo compilado con Numba de la detección de tonos muestra a muestra.
+
+El camino de NumPy recorre cada bloque varias veces (comparación con el
+umbral, diferencias, búsqueda de los cambios) y después fusiona los pulsos
+en tonos. Aquí las tres cosas se hacen en una sola pasada por las muestras,
+sin arrays intermedios, con el mismo resultado. decodificador_morse_v2 solo
+importa este módulo con el motor 'numba'; sin Numba instalado se queda con
+NumPy.
+"""
+import numpy as np
+from numba import njit
+
+# Posiciones del estado que se arrastra entre bloques, en un array de
+# enteros (el equivalente de dm.estado_inicial). Los pares hay_* indican si
+# el valor siguiente es válido.
+POSICION, ACTIVO, HAY_INICIO, INICIO, HAY_PREVIO, PREVIO_INICIO, PREVIO_FIN, HAY_TONO, TONO_INICIO, TONO_FIN = \
+    range(10)
+
+def estado_compilado(estado):
+    compilado = np.zeros(10, dtype=np.int64)
+    compilado[POSICION] = estado['posicion']
+    compilado[ACTIVO] = bool(estado['activo'])
+    if estado['inicio_abierto'] is not None:
+        compilado[HAY_INICIO] = 1
+        compilado[INICIO] = estado['inicio_abierto']
+    if estado['pulso_previo'] is not None:
+        compilado[HAY_PREVIO] = 1
+        compilado[PREVIO_INICIO:PREVIO_FIN + 1] = estado['pulso_previo']
+    if estado['nuevo_tono'] is not None:
+        compilado[HAY_TONO] = 1
+        compilado[TONO_INICIO:TONO_FIN + 1] = estado['nuevo_tono']
+    return compilado
+
+# Devuelve el estado al diccionario, para que el resto de funciones por
+# bloques (por ejemplo, dm.cerrar_tono_por_silencio) sigan funcionando.
+def actualizar_estado(estado, compilado):
+    estado['posicion'] = int(compilado[POSICION])
+    estado['activo'] = bool(compilado[ACTIVO])
+    estado['inicio_abierto'] = int(compilado[INICIO]) if compilado[HAY_INICIO] else None
+    estado['pulso_previo'] = ((int(compilado[PREVIO_INICIO]), int(compilado[PREVIO_FIN]))
+                              if compilado[HAY_PREVIO] else None)
+    estado['nuevo_tono'] = ((int(compilado[TONO_INICIO]), int(compilado[TONO_FIN]))
+                            if compilado[HAY_TONO] else None)
+
+# Recorre un bloque de muestras y escribe en salida (inicio, fin) los tonos
+# que se cierran en él; devuelve cuántos son. Hay sonido si la muestra
+# queda por encima de superior o por debajo de inferior, los límites que
+# calcula dm.limites_umbral en la codificación del bloque. Cada pulso se
+# fusiona con el anterior en cuanto se cierra, con las mismas reglas que
+# dm.fusionar_pulsos: un silencio menor que silencio_intratono une los
+# pulsos, uno mayor cierra el tono y uno igual no hace nada.
+@njit(cache=True, nogil=True)
+def tonos_bloque(bloque, superior, inferior, silencio_intratono, estado, salida):
+    posicion = estado[POSICION]
+    activo = estado[ACTIVO] != 0
+    hay_inicio = estado[HAY_INICIO] != 0
+    inicio = estado[INICIO]
+    hay_previo = estado[HAY_PREVIO] != 0
+    previo_inicio = estado[PREVIO_INICIO]
+    previo_fin = estado[PREVIO_FIN]
+    hay_tono = estado[HAY_TONO] != 0
+    tono_inicio = estado[TONO_INICIO]
+    tono_fin = estado[TONO_FIN]
+    tonos = 0
+    for j in range(bloque.shape[0]):
+        actual = bloque[j] > superior or bloque[j] < inferior
+        if actual == activo:
+            continue
+        activo = actual
+        # Como en dm.pulsos_de_cambios, el cambio cuenta en la muestra
+        # anterior a la primera con el nuevo estado.
+        cambio = posicion + j - 1
+        if actual:
+            hay_inicio = True
+            inicio = cambio
+            continue
+        # Si la pista empezó con sonido no conocemos el inicio de ese pulso.
+        if not hay_inicio:
+            continue
+        hay_inicio = False
+        if hay_previo:
+            silencio = inicio - previo_fin
+            if silencio < silencio_intratono:
+                if not hay_tono:
+                    hay_tono = True
+                    tono_inicio = previo_inicio
+                tono_fin = cambio
+            elif silencio > silencio_intratono and hay_tono:
+                salida[tonos, 0] = tono_inicio
+                salida[tonos, 1] = tono_fin
+                tonos += 1
+                hay_tono = False
+        hay_previo = True
+        previo_inicio = inicio
+        previo_fin = cambio
+
+    estado[POSICION] = posicion + bloque.shape[0]
+    estado[ACTIVO] = activo
+    estado[HAY_INICIO] = hay_inicio
+    estado[INICIO] = inicio
+    estado[HAY_PREVIO] = hay_previo
+    estado[PREVIO_INICIO] = previo_inicio
+    estado[PREVIO_FIN] = previo_fin
+    estado[HAY_TONO] = hay_tono
+    estado[TONO_INICIO] = tono_inicio
+    estado[TONO_FIN] = tono_fin
+    return tonos
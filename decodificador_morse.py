@@ -76,7 +76,8 @@ tiempo = np.linspace(0, duracion, num=len(data))
 # Graficamos.
 plt.figure(figsize=(10, 4))
 plt.plot(tiempo, data)
-plt.title(f"Onda sonora: {ruta_archivo.split('\\')[-1]}")
+nombre_archivo = ruta_archivo.split('\\')[-1]
+plt.title(f"Onda sonora: {nombre_archivo}")
 plt.xlabel("Tiempo (s)")
 plt.ylabel("Amplitud normalizada")
 plt.grid(True)
@@ -4,9 +4,27 @@ Created on Fri Aug  1 16:17:16 2025
 
 @author: pacoe
 """
-from scipy.io import wavfile
+import argparse
+import contextlib
+import io
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+from operator import itemgetter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+# scipy y matplotlib tardan en importarse bastante más que la decodificación
+# de un clip corto, así que solo se importan cuando hacen falta: scipy para
+# los WAV que no lee leer_wav y matplotlib para las gráficas.
 
 # Diccionario morse clave símbolos morse, valor letra latina.
 morse_to_char = {
@@ -23,28 +41,396 @@ morse_to_char = {
     '-.--.-': ')', '---...': ':'
 }
 
+# Parámetros de detección: umbral de amplitud normalizada a partir del cual
+# hay sonido y silencio máximo (en muestras) entre pulsos de un mismo tono.
+UMBRAL = 0.2
+SILENCIO_INTRATONO = 30
+
+# Parámetros de la envolvente (en segundos): anchura de cada ventana, que
+# debe cubrir al menos medio periodo de la portadora (2 ms sirven desde
+# 250 Hz), y silencio máximo dentro de un mismo tono.
+VENTANA_ENVOLVENTE = 0.002
+SILENCIO_ENVOLVENTE = 0.004
+
+# Indicador de final de pista (un valor elevado seguido de 0).
+INDICADOR = np.array([0.999, 0])
+
+# Número de muestras por bloque en la decodificación por bloques.
+TAM_BLOQUE = 2**16
+
+# Si es False, las etapas no informan por pantalla de lo que detectan. Al
+# usar el módulo como biblioteca se desactiva con decodificar(verboso=False).
+VERBOSO = True
+
+# Motor de la detección de tonos muestra a muestra: 'numpy' (por defecto) o
+# 'numba', que compila la detección en una sola pasada por las muestras
+# (ver compilado_morse). Se cambia con el bloque with de usar_motor() o con
+# decodificar(motor=...).
+MOTOR = 'numpy'
+MOTORES = ('numpy', 'numba')
+
+# Métricas por etapa de la ejecución en curso, o None si la instrumentación
+# está desactivada (por defecto). Se activa con el bloque with de
+# instrumentacion().
+METRICAS = None
+
+# Valor central y escala de cada codificación para llevarla a float32.
+ESCALAS_CODIFICACION = {
+    np.dtype(np.uint8): (128, 128),
+    np.dtype(np.int16): (0, 32768.0),
+    np.dtype(np.int32): (0, 2147483648.0),
+    np.dtype(np.float64): (0, 1),
+    np.dtype(np.float32): (0, 1),
+}
+
+# Valor central y escala de una codificación en cualquier orden de bytes
+# (scipy devuelve los WAV big-endian, RIFX, en su orden original).
+def escala_codificacion(tipo):
+    return ESCALAS_CODIFICACION[tipo.newbyteorder('=')]
+
+###### FORMATO DE LOS DATOS ENTRE ETAPAS ######
+
+# Pulsos y tonos viajan entre etapas como arrays estructurados de NumPy con
+# una fila (inicio, fin) por elemento, en muestras, y los tonos y pausas
+# clasificados como filas (duracion, clase), con la clase como un código
+# entero. Así cada elemento ocupa 16 y 9 bytes en lugar de una lista de
+# Python con sus escalares y su etiqueta, y cada etapa trabaja sobre
+# columnas enteras en lugar de recorrer los elementos uno a uno.
+TIPO_TONO = np.dtype([('inicio', np.int64), ('fin', np.int64)])
+TIPO_ELEMENTO = np.dtype([('duracion', np.int64), ('clase', np.int8)])
+
+# Códigos de clase (los tonos largos valen 1 para poder usarlos directamente
+# como bit de raya) y su etiqueta, que solo se usa para mostrarlos.
+TONO_CORTO, TONO_LARGO, PAUSA_CORTA, PAUSA_MEDIA, PAUSA_LARGA = range(5)
+CLASES = {
+    'Tono corto': TONO_CORTO,
+    'Tono largo': TONO_LARGO,
+    'Pausa corta': PAUSA_CORTA,
+    'Pausa media': PAUSA_MEDIA,
+    'Pausa larga': PAUSA_LARGA,
+}
+ETIQUETAS = tuple(CLASES)
+
+# Array de tonos a partir de sus columnas de inicios y finales.
+def tonos_de_columnas(inicios, finales):
+    tonos = np.empty(len(inicios), dtype=TIPO_TONO)
+    tonos['inicio'] = inicios
+    tonos['fin'] = finales
+    return tonos
+
+# Acepta también los formatos anteriores (lista de pares o array de dos
+# columnas), para las llamadas desde fuera del módulo.
+def a_tonos(tonos):
+    if isinstance(tonos, np.ndarray) and tonos.dtype == TIPO_TONO:
+        return tonos
+    pares = np.asarray(tonos, dtype=np.int64).reshape(-1, 2)
+    return tonos_de_columnas(pares[:, 0], pares[:, 1])
+
+# Los detectores devuelven los tonos por bloques; esto los une en un solo
+# array. Un array de tonos se devuelve tal cual.
+def unir_tonos(bloques):
+    if isinstance(bloques, np.ndarray):
+        return a_tonos(bloques)
+    bloques = [a_tonos(bloque) for bloque in bloques]
+    if not bloques:
+        return np.empty(0, dtype=TIPO_TONO)
+    return np.concatenate(bloques)
+
+# Elementos clasificados a partir de la lista de [valor, etiqueta] anterior.
+def a_elementos(tonos_y_silencios_clasificados):
+    if isinstance(tonos_y_silencios_clasificados, np.ndarray):
+        return tonos_y_silencios_clasificados
+    elementos = np.empty(len(tonos_y_silencios_clasificados), dtype=TIPO_ELEMENTO)
+    elementos['duracion'] = np.fromiter(map(itemgetter(0), tonos_y_silencios_clasificados),
+                                        dtype=np.int64, count=len(elementos))
+    etiquetas = map(itemgetter(1), tonos_y_silencios_clasificados)
+    elementos['clase'] = np.fromiter(map(CLASES.__getitem__, etiquetas), dtype=np.int8, count=len(elementos))
+    return elementos
+
+# Columna de códigos de clase. Acepta los elementos clasificados, un array
+# de códigos suelto o la lista de [valor, etiqueta].
+def clases_de_elementos(tonos_y_silencios_clasificados):
+    elementos = a_elementos(tonos_y_silencios_clasificados)
+    if elementos.dtype.names:
+        return elementos['clase']
+    return elementos
+
+def informar(mensaje=''):
+    if VERBOSO:
+        print(mensaje)
+
+# Activa o desactiva los mensajes por pantalla mientras dura el bloque with.
+@contextlib.contextmanager
+def verbosidad(activa):
+    global VERBOSO
+    anterior, VERBOSO = VERBOSO, activa
+    try:
+        yield
+    finally:
+        VERBOSO = anterior
+
+###### INSTRUMENTACIÓN ######
+
+# Para dimensionar equipos no bastan los mensajes por pantalla: cada etapa
+# del pipeline puede registrar su tiempo, cuántos elementos recibe y
+# produce (muestras, pulsos, tonos...), la memoria que reserva y el pico de
+# memoria residente del proceso. Con la instrumentación desactivada cada
+# etapa solo comprueba que METRICAS es None, una vez por llamada (por
+# bloque en la decodificación por bloques, nunca por muestra).
+
+# Pico de memoria residente del proceso en bytes (None si no se puede medir).
+def pico_rss():
+    if resource is None:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB y macOS en bytes.
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+# Activa la instrumentación mientras dura el bloque with y devuelve las
+# métricas, que se van rellenando. Con memoria=True se mide además la
+# memoria reservada por cada etapa con tracemalloc, que ralentiza el código
+# Python de forma apreciable.
+@contextlib.contextmanager
+def instrumentacion(memoria=False):
+    global METRICAS
+    anterior, METRICAS = METRICAS, {'etapas': {}, 'memoria': memoria, 'abiertas': []}
+    iniciar = memoria and not tracemalloc.is_tracing()
+    if iniciar:
+        tracemalloc.start()
+    try:
+        yield METRICAS
+    finally:
+        if iniciar:
+            tracemalloc.stop()
+        METRICAS = anterior
+
+# Registra una etapa mientras dura el bloque with. Quien la usa anota en el
+# diccionario que devuelve los elementos de 'entrada' y 'salida'. Las etapas
+# pueden anidarse: el tiempo de una etapa no incluye el de las que se
+# ejecutan dentro de ella.
+@contextlib.contextmanager
+def etapa(nombre, unidades):
+    metricas = METRICAS
+    abierta = {'entrada': 0, 'salida': 0, 'hijos': 0.0, 'pico_hijos': 0}
+    if metricas is None:
+        yield abierta
+        return
+
+    registro = metricas['etapas'].setdefault(nombre, {
+        'llamadas': 0, 'segundos': 0.0, 'entrada': 0, 'salida': 0,
+        'unidad_entrada': unidades[0], 'unidad_salida': unidades[1],
+        'bytes_reservados': None, 'pico_rss_bytes': None,
+    })
+    metricas['abiertas'].append(abierta)
+    if metricas['memoria']:
+        reservados = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    inicio = time.perf_counter()
+    try:
+        yield abierta
+    finally:
+        segundos = time.perf_counter() - inicio
+        metricas['abiertas'].pop()
+        padre = metricas['abiertas'][-1] if metricas['abiertas'] else None
+        if padre is not None:
+            padre['hijos'] += segundos
+        registro['llamadas'] += 1
+        registro['segundos'] += segundos - abierta['hijos']
+        registro['entrada'] += abierta['entrada']
+        registro['salida'] += abierta['salida']
+        if metricas['memoria']:
+            # reset_peak borra el pico de la etapa que nos contiene, así que
+            # se lo pasamos en valor absoluto.
+            pico = max(tracemalloc.get_traced_memory()[1], abierta['pico_hijos'])
+            registro['bytes_reservados'] = max(registro['bytes_reservados'] or 0, pico - reservados)
+            if padre is not None:
+                padre['pico_hijos'] = max(padre['pico_hijos'], pico)
+        registro['pico_rss_bytes'] = pico_rss()
+
+# Llama a funcion(*args, **kwargs) registrándola como etapa. Los elementos
+# de entrada se cuentan sobre el primer argumento y los de salida sobre el
+# resultado, con len salvo que se indique otra cosa (None = no contar).
+def medir_etapa(nombre, unidades, funcion, *args, contar_entrada=len, contar_salida=len, **kwargs):
+    if METRICAS is None:
+        return funcion(*args, **kwargs)
+    with etapa(nombre, unidades) as registro:
+        if contar_entrada is not None:
+            registro['entrada'] = contar_entrada(args[0])
+        resultado = funcion(*args, **kwargs)
+        registro['salida'] = contar_salida(resultado)
+    return resultado
+
+# Número de muestras de un par (sample_rate, data) y de la terna
+# (data, duracion, ruta_archivo) de carga_audio.
+def contar_muestras(audio):
+    return len(audio[1])
+
+def contar_muestras_pista(pista):
+    return len(pista[0])
+
+def contar_uno(_):
+    return 1
+
+# Tabla legible con una fila por etapa.
+def resumen_metricas(metricas):
+    lineas = [f"{'Etapa':<32} {'Segundos':>9} {'Entrada':>21} {'Salida':>21} {'Reservado':>10}"]
+    for nombre, registro in metricas['etapas'].items():
+        reservados = registro['bytes_reservados']
+        reservados = '-' if reservados is None else f'{reservados / 2**20:.1f} MiB'
+        lineas.append(f"{nombre:<32} {registro['segundos']:>9.4f} "
+                      f"{registro['entrada']:>10} {registro['unidad_entrada']:<10} "
+                      f"{registro['salida']:>10} {registro['unidad_salida']:<10} {reservados:>10}")
+    rss = pico_rss()
+    if rss is not None:
+        lineas.append(f'Pico de memoria residente: {rss / 2**20:.1f} MiB')
+    return '\n'.join(lineas)
+
+def metricas_a_json(metricas):
+    return json.dumps({'etapas': metricas['etapas']}, ensure_ascii=False)
+
+# Formato de texto de Prometheus, una serie por etapa para cada métrica.
+def metricas_a_prometheus(metricas, prefijo='morse'):
+    series = (
+        ('segundos_total', 'counter', 'Tiempo de reloj de la etapa', 'segundos', None),
+        ('llamadas_total', 'counter', 'Veces que se ha ejecutado la etapa', 'llamadas', None),
+        ('elementos_entrada_total', 'counter', 'Elementos recibidos', 'entrada', 'unidad_entrada'),
+        ('elementos_salida_total', 'counter', 'Elementos producidos', 'salida', 'unidad_salida'),
+        ('bytes_reservados', 'gauge', 'Pico de memoria reservada durante la etapa', 'bytes_reservados', None),
+        ('pico_rss_bytes', 'gauge', 'Pico de memoria residente del proceso al terminar la etapa',
+         'pico_rss_bytes', None),
+    )
+    lineas = []
+    for sufijo, tipo, ayuda, clave, unidad in series:
+        nombre = f'{prefijo}_etapa_{sufijo}'
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for nombre_etapa, registro in metricas['etapas'].items():
+            if registro[clave] is None:
+                continue
+            etiquetas = f'etapa="{nombre_etapa}"'
+            if unidad is not None:
+                etiquetas += f',unidad="{registro[unidad]}"'
+            lineas.append(f'{nombre}{{{etiquetas}}} {registro[clave]}')
+    return '\n'.join(lineas) + '\n'
+
 ###### CARGA DE ARCHIVO Y ANÁLISIS PRELIMINAR ######
 
-def carga_audio():
-    ruta_archivo = input('Introduce la ruta del archivo: ')
+# Si no se indica la ruta del archivo, se pide por teclado.
+def pedir_ruta():
+    return input('Introduce la ruta del archivo: ')
+
+# Codificaciones de la cabecera WAV que se leen directamente con NumPy:
+# (código de formato, bits por muestra) -> tipo de las muestras. El código 1
+# es PCM entero y el 3 coma flotante.
+TIPOS_WAV = {
+    (1, 8): np.dtype(np.uint8),
+    (1, 16): np.dtype('<i2'),
+    (1, 32): np.dtype('<i4'),
+    (3, 32): np.dtype('<f4'),
+    (3, 64): np.dtype('<f8'),
+}
+
+# Recorre los bloques de la cabecera de un WAV abierto en binario y lo deja
+# al principio de los datos. Devuelve el sample_rate, el tipo de las
+# muestras, los canales, la posición de los datos y su tamaño declarado en
+# bytes, o None si el archivo no es un WAV RIFF con una codificación de
+# TIPOS_WAV (en WAVE_FORMAT_EXTENSIBLE el código va en el subformato).
+def leer_cabecera_wav(archivo):
+    riff = archivo.read(12)
+    if riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        return None
+    formato = None
+    while True:
+        bloque = archivo.read(8)
+        if len(bloque) < 8:
+            return None
+        nombre, tamano = bloque[:4], struct.unpack('<I', bloque[4:])[0]
+        if nombre == b'data':
+            break
+        contenido = archivo.read(tamano + tamano % 2)
+        if nombre == b'fmt ' and len(contenido) >= 16:
+            codigo, canales, sample_rate = struct.unpack('<HHI', contenido[:8])
+            bits = struct.unpack('<H', contenido[14:16])[0]
+            if codigo == 0xFFFE and len(contenido) >= 26:
+                codigo = struct.unpack('<H', contenido[24:26])[0]
+            formato = (TIPOS_WAV.get((codigo, bits)), canales, sample_rate)
+    if formato is None or formato[0] is None:
+        return None
+    tipo, canales, sample_rate = formato
+    return {'sample_rate': sample_rate, 'tipo': tipo, 'canales': canales,
+            'inicio': archivo.tell(), 'bytes': tamano}
+
+# Forma del array de muestras de un WAV con su cabecera y los bytes que hay
+# realmente tras ella (un archivo cortado o aún abierto puede declarar más).
+def forma_wav(cabecera, disponibles):
+    muestras = min(cabecera['bytes'], disponibles) // (cabecera['tipo'].itemsize * cabecera['canales'])
+    return (muestras,) if cabecera['canales'] == 1 else (muestras, cabecera['canales'])
+
+# Lee un WAV como scipy.io.wavfile.read: devuelve el sample_rate y las
+# muestras, con una columna por canal si hay varios. Con mmap=True el
+# archivo se proyecta en memoria. Las codificaciones de TIPOS_WAV se leen
+# directamente con NumPy; el resto (24 bits, big-endian...) con scipy, que
+# las carga enteras en memoria porque no admite mmap para todas ellas (por
+# ejemplo, las de 3 bytes por muestra).
+def leer_wav(ruta_archivo, mmap=False):
+    with open(ruta_archivo, 'rb') as archivo:
+        cabecera = leer_cabecera_wav(archivo)
+        if cabecera is not None:
+            forma = forma_wav(cabecera, os.fstat(archivo.fileno()).st_size - cabecera['inicio'])
+            if not mmap or forma[0] == 0:
+                data = np.fromfile(archivo, dtype=cabecera['tipo'], count=int(np.prod(forma))).reshape(forma)
+    if cabecera is None:
+        from scipy.io import wavfile
+        return wavfile.read(ruta_archivo)
+    if mmap and forma[0]:
+        data = np.memmap(ruta_archivo, dtype=cabecera['tipo'], mode='c', offset=cabecera['inicio'], shape=forma)
+    return cabecera['sample_rate'], data
+
+# Lo mismo para un WAV ya leído en memoria (por ejemplo, desde stdin), sin
+# copiar las muestras.
+def leer_wav_bytes(contenido):
+    cabecera = leer_cabecera_wav(io.BytesIO(contenido))
+    if cabecera is None:
+        from scipy.io import wavfile
+        return wavfile.read(io.BytesIO(contenido))
+    forma = forma_wav(cabecera, len(contenido) - cabecera['inicio'])
+    data = np.frombuffer(contenido, dtype=cabecera['tipo'], count=int(np.prod(forma)), offset=cabecera['inicio'])
+    return cabecera['sample_rate'], data.reshape(forma)
+
+def carga_audio(ruta_archivo=None):
+    if ruta_archivo is None:
+        ruta_archivo = pedir_ruta()
     
     # Si la ruta comienza con " o ' los eliminamos.
     if ruta_archivo[0] in ("'", '"'):
         ruta_archivo = ruta_archivo[1:-1]
     
-    sample_rate, data = wavfile.read(ruta_archivo)
+    sample_rate, data = leer_wav(ruta_archivo)
     
     # Conocemos la duración de la pista gracias a que los Hz indican cuantos 
     # valores aparecen por segundo.
     duracion = round(1/(sample_rate/len(data)), 4)
     
-    print(f"Tasa de muestreo: {sample_rate} Hz")
-    print(f"Forma del array de datos: {data.shape}")
-    print(f"Tipo de datos: {data.dtype}")
-    print(f'Duración: {duracion}s')
-    print()
+    informar(f"Tasa de muestreo: {sample_rate} Hz")
+    informar(f"Forma del array de datos: {data.shape}")
+    informar(f"Tipo de datos: {data.dtype}")
+    informar(f'Duración: {duracion}s')
+    informar()
     return data, duracion, ruta_archivo
 
+# Para archivos grandes proyectamos el archivo en memoria en lugar de leerlo:
+# el sistema operativo trae del disco solo las páginas que se van recorriendo,
+# así que pueden decodificarse pistas mayores que la RAM disponible.
+def carga_audio_mmap(ruta_archivo):
+    sample_rate, data = leer_wav(ruta_archivo, mmap=True)
+    return sample_rate, canal_izquierdo(data)
+
+# Vista (sin copia) de la pista L si hay varios canales.
+def canal_izquierdo(data):
+    if data.ndim == 2:
+        return data[:, 0]
+    return data
+
 ###### NORMALIZAMOS LOS DATOS A FLOAT32 ######
 
 def normalizar_codificacion(data):
@@ -56,226 +442,277 @@ def normalizar_codificacion(data):
         
     # Si los datos están en estéreo, seleccionamos solo la pista L.
     if len(data.shape) == 2 and data.shape[1] == 2:
-        print('STEREO DETECTED. L CHANNEL SELECTED.')
+        informar('STEREO DETECTED. L CHANNEL SELECTED.')
         data = data[:, 0]
     else:
-        print('MONO DETECTED.')
+        informar('MONO DETECTED.')
 
     # Para representaciones gráficas, usamos la forma float32.
     tipo = data.dtype
-    if tipo == np.uint8:
-        print('UINT8 DETECTED')
-        data = data.astype(np.float32)
-        data = (data - 128) / 128
-    elif tipo == np.int16:
-        print('INT16 DETECTED')
-        data = data.astype(np.float32) / 32768.0
-    elif tipo == np.int32:
-        print('INT32 DETECTED')
-        data = data.astype(np.float32) / 2147483648.0
-    elif tipo == np.float64:
-        print('FLOAT64 DETECTED')
-        data = data.astype(np.float32)
-    elif tipo == np.float32:
-        print('FLOAT32 DETECTED')
+    if tipo.newbyteorder('=') in ESCALAS_CODIFICACION:
+        informar(f'{tipo.name.upper()} DETECTED')
+        data = a_float32(data)
     else:
-        print(f'INVALID FORMAT: {tipo}')
+        informar(f'INVALID FORMAT: {tipo}')
+    return data
+
+# Conversión silenciosa a float32 en [-1, 1] según la codificación original.
+# Se usa también bloque a bloque en la decodificación por bloques.
+def a_float32(data):
+    if data.dtype == np.float32:
+        return data
+    centro, escala = escala_codificacion(data.dtype)
+    data = data.astype(np.float32)
+    if centro:
+        data -= centro
+    if escala != 1:
+        data /= escala
     return data
 
 ###### REPRESENTACIÓN GRÁFICA DE LA ONDA SONORA ######
 
-def representacion_grafica(duracion, data, ruta_archivo):
-    # Comenzamos la represntación gráfica definiendo un vector tiempo que va 
-    # desde  0 hasta la duración de la pista.
+# Tamaño por defecto de las gráficas, en píxeles.
+ANCHO_GRAFICA = 1200
+ALTO_GRAFICA = 400
+PUNTOS_POR_PULGADA = 100
+
+# Colores de los tonos y pausas superpuestos a la onda. Las pausas entre
+# símbolos no se marcan.
+COLORES_CLASES = {
+    'Tono corto': 'tab:green',
+    'Tono largo': 'tab:blue',
+    'Pausa media': 'tab:orange',
+    'Pausa larga': 'tab:red',
+}
+
+# Una pantalla no puede mostrar más de un valor por píxel, así que en lugar
+# de dibujar todas las muestras dividimos la pista en tantas columnas como
+# píxeles de ancho y dibujamos el mínimo y el máximo de cada una. Devuelve
+# las muestras por columna y los mínimos y máximos normalizados a [-1, 1].
+# Se recorre por bloques para no copiar la pista si es una vista con saltos
+# (por ejemplo, un canal de una pista estéreo proyectada en memoria).
+def envolvente_min_max(data, columnas=ANCHO_GRAFICA, tam_bloque=TAM_BLOQUE):
+    paso = max(1, -(-len(data) // columnas))
+    completas, resto = divmod(len(data), paso)
+    minimos = np.empty(completas + bool(resto), dtype=data.dtype)
+    maximos = np.empty_like(minimos)
+    filas = max(1, tam_bloque // paso)
+    for f in range(0, completas, filas):
+        bloque = np.asarray(data[f * paso:min(completas, f + filas) * paso]).reshape(-1, paso)
+        minimos[f:f + len(bloque)] = bloque.min(axis=1)
+        maximos[f:f + len(bloque)] = bloque.max(axis=1)
+    if resto:
+        minimos[-1] = data[completas * paso:].min()
+        maximos[-1] = data[completas * paso:].max()
+    return paso, a_float32(minimos), a_float32(maximos)
+
+# Dibuja la onda con su envolvente de mínimos y máximos, de modo que el
+# número de puntos depende del ancho en píxeles y no de la duración. Con
+# tonos (array de TIPO_TONO, en muestras) se marcan encima de la onda y,
+# si además se pasan los tonos y pausas clasificados, se colorean según su
+# clase y se marcan también las pausas entre letras y entre palabras.
+# Con salida (ruta .png o .svg) la gráfica se guarda sin abrir ninguna
+# ventana, lo que permite generarla en servidores sin pantalla.
+def representacion_grafica(duracion, data, ruta_archivo, salida=None, tonos=None,
+                           tonos_y_silencios_clasificados=None, ancho=ANCHO_GRAFICA, alto=ALTO_GRAFICA):
+    tamano = (ancho / PUNTOS_POR_PULGADA, alto / PUNTOS_POR_PULGADA)
+    if salida is None:
+        import matplotlib.pyplot as plt
+        figura = plt.figure(figsize=tamano, dpi=PUNTOS_POR_PULGADA)
+    else:
+        from matplotlib.figure import Figure
+        figura = Figure(figsize=tamano, dpi=PUNTOS_POR_PULGADA)
+    ejes = figura.add_subplot()
+
+    # Segundos por muestra, para pasar las muestras a tiempo.
+    segundos = duracion / max(1, len(data))
+    paso, minimos, maximos = envolvente_min_max(data, ancho)
+    tiempo = np.arange(len(minimos)) * paso * segundos
+    ejes.fill_between(tiempo, minimos, maximos, step='post', linewidth=0.5)
 
-    tiempo = np.linspace(0, duracion, num=len(data))
+    if tonos is not None:
+        superponer_tonos(ejes, tonos, tonos_y_silencios_clasificados, segundos)
+
+    nombre_archivo = os.path.basename(ruta_archivo.split('\\')[-1])
+    ejes.set_title(f"Onda sonora: {nombre_archivo}")
+    ejes.set_xlabel("Tiempo (s)")
+    ejes.set_ylabel("Amplitud normalizada")
+    ejes.set_xlim(0, duracion)
+    ejes.grid(True)
+    figura.tight_layout()
+    if salida is None:
+        plt.show()
+    else:
+        figura.savefig(salida)
 
-    # Graficamos con mathplotlib.
-    plt.figure(figsize=(10, 4))
-    plt.plot(tiempo, data)
-    plt.title(f"Onda sonora: {ruta_archivo.split('\\')[-1]}")
-    plt.xlabel("Tiempo (s)")
-    plt.ylabel("Amplitud normalizada")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+# Marca los tonos como barras sobre la onda y las pausas entre letras y
+# palabras como barras debajo, una colección por clase.
+def superponer_tonos(ejes, tonos, tonos_y_silencios_clasificados, segundos):
+    tonos = a_tonos(tonos)
+    inicios = tonos['inicio'] * segundos
+    finales = tonos['fin'] * segundos
+    if tonos_y_silencios_clasificados is None:
+        ejes.broken_barh(list(zip(inicios, finales - inicios)), (1.05, 0.1), facecolors='tab:green')
+        return
+
+    # Los clasificados alternan tono y pausa: la pausa i va del final del
+    # tono i al inicio del tono i + 1.
+    clases = clases_de_elementos(tonos_y_silencios_clasificados)
+    clases_tonos, clases_pausas = clases[0::2], clases[1::2]
+    for etiqueta, color in COLORES_CLASES.items():
+        clase = CLASES[etiqueta]
+        if clase <= TONO_LARGO:
+            i = np.flatnonzero(clases_tonos == clase)
+            barras = list(zip(inicios[i], finales[i] - inicios[i]))
+            posicion = (1.05, 0.1)
+        else:
+            i = np.flatnonzero(clases_pausas == clase)
+            barras = list(zip(finales[i], inicios[i + 1] - finales[i]))
+            posicion = (-1.15, 0.1)
+        if barras:
+            ejes.broken_barh(barras, posicion, facecolors=color, label=etiqueta)
+    # Dejamos sitio encima de los tonos para la leyenda.
+    ejes.set_ylim(-1.2, 1.6)
+    ejes.legend(loc='upper right', fontsize='small', ncol=len(COLORES_CLASES))
 
 ###### TRANSFORMACIÓN DE ONDA A CÓDIGO MORSE ######
 
 # El primer paso es transformar el conjunto de puntos de amplitud que 
-# conforman la onda en una lista de tuplas que indican los pulsos que la 
-# componen. Un pulso es (inicio_sonido, fin_sonido). Como la amplitud de la 
+# conforman la onda en un array con los pulsos que la componen, una fila
+# (inicio_sonido, fin_sonido) por pulso. Como la amplitud de la 
 # onda fluctúa entre valores positivo y negativos, los tonos del código morse
 # se descomponen en multitud de pequeños pulsos.
 
-def onda_a_pulsos(data):
+def onda_a_pulsos(data, umbral=UMBRAL, tam_ventana=TAM_BLOQUE):
+    # Recorremos la onda por ventanas arrastrando el estado de una a la
+    # siguiente, así no creamos copias de la pista completa (valor absoluto,
+    # booleanos, diferencias...). Admite tanto los datos normalizados como
+    # los originales (por ejemplo, proyectados con carga_audio_mmap).
+    estado = estado_inicial()
+    bloques = []
+    for i in range(0, len(data), tam_ventana):
+        bloques.append(onda_a_pulsos_incremental(data[i:i + tam_ventana], estado, umbral))
+
     # Introducimos un indicador de final de pista (un valor elevado al final
     # segudo de 0)
-    indicador = np.array([0.999, 0])
-    data = np.concatenate((data, indicador))
-    # Calculamos la amplitud absoluta y establecemos un umbral de sonido.
-    amplitud = np.abs(data)
-    umbral = 0.2
-
-    # Comparamos la amplitud absoluta al umbral para generar una lista booleana.
-    actividad = amplitud > umbral
-
-    # Cambiamos los booleanos a 0 - 1 con astype(int) y calculamos
-    # la diferencia b - a entre los valores consecutivos del vector para
-    # identificar cuando comienza (1) y cuando acaba (-1) el sonido.
-    cambios = np.diff(actividad.astype(int))
-
-    # Extraemos listas que contienen los índices donde comienza y finaliza
-    # el sonido np.where devuelve una tupla de la que solo nos interesa
-    # el primer elemento.
-    inicios = np.where(cambios == 1)[0]
-    finales = np.where(cambios == -1)[0]
-
-    if inicios[0] < finales[0]:
-        # Creamos una lista de tuplas de pulsos (inicio, fin)
-        pulsos = list(zip(inicios, finales))
-        for pulso in pulsos:
-            if pulso[0] > pulso[1]:
-                print('ERROR EN EL ORDEN DE TUPLA PULSO')
+    bloques.append(onda_a_pulsos_incremental(INDICADOR, estado, umbral))
+    pulsos = np.concatenate(bloques)
+    if np.any(pulsos['inicio'] > pulsos['fin']):
+        informar('ERROR EN EL ORDEN DE TUPLA PULSO')
     return pulsos
     
 # El siguiente paso es agrupar los pulsos que estén muy juntos entre sí
 # para formar los tonos (cortos y largos) que componen el mensaje en morse.
-def pulsos_a_tonos(pulsos):
-    # Recorremos la lista de pulsos. Si la distancia entre el final de uno 
-    # y el comienzo de otro es pequeña, los fusionamos.
-    contador = 0
-    silencio_intratono = 30
-    nuevo_pulso = [None, None]
-    pulsos_limpios = []
-    for i in range(len(pulsos)-1):
-        inicio_pulso_actual = pulsos[i][0]
-        inicio_pulso_siguiente = pulsos[i + 1][0]
-        
-        fin_pulso_actual = pulsos[i][1]
-        fin_pulso_siguiente = pulsos[i + 1][1]
-        
-        # Si la diferencia entre un pulso y el siguient es muy pequeña
-        if (inicio_pulso_siguiente - fin_pulso_actual) < silencio_intratono:
-            # y si no hay un nuevo pulso en construcción
-            if nuevo_pulso[0] is None:
-                # El nuevo pulso es el inicio del primero y el fin del segundo.
-                nuevo_pulso[0] = inicio_pulso_actual
-                nuevo_pulso[1] = fin_pulso_siguiente
-            # Pero si hay un nuevo pulso en construcción:    
-            else:
-                # Solo actualizamos el final del pulso.
-                nuevo_pulso[1] = fin_pulso_siguiente
-        # Si la diferencia entre un pulso y el siguiente es grande
-        elif (inicio_pulso_siguiente - fin_pulso_actual) > silencio_intratono:
-            # Si hay un pulso en construcción:
-            if nuevo_pulso[0] is not None:
-                # Introducimos el nuevo pulso en la lista buena y lo reseteamos.
-                pulsos_limpios.append(nuevo_pulso)
-                contador += 1
-                nuevo_pulso = [None, None]
-    # Si se ha quedado un último pulso pendiente, lo metemos también.
-    if nuevo_pulso[0] is not None:
-        pulsos_limpios.append(nuevo_pulso)
-        contador += 1
-
-    print(f'Detectados {contador} pulsos')
-    return pulsos_limpios
-
-# El siguiente paso es transformar la lista de tonos, que solo indica 
-# el comienzo y el final de cada tono, en una lista de tuplas que calcule 
-# también los silencios e indique si se trata de un tono (corto o largo)
-# o de una pausa (corta entre tonos de una letra, media entre letras y larga
-# entre palabras). 
-def clasificacion_tonos_y_silencios(tonos_morse):
-    # Creamos una lista con tuplas (longitud, tipo) que intercala los tonos con
-    # los silencios indicando la duración de cada uno para diferenciar entre 
-    # tonos cortos y largos y pausas intra-letra, inter-letra y inter-palabra.
-    tonos_y_pausas = []
+def pulsos_a_tonos(pulsos, silencio_intratono=SILENCIO_INTRATONO):
+    # Si la distancia entre el final de un pulso y el comienzo del siguiente
+    # es pequeña, los fusionamos. Al acabar la pista cerramos el tono que
+    # haya quedado en construcción.
+    pulsos = a_tonos(pulsos)
+    tonos, nuevo_pulso = fusionar_pulsos(pulsos['inicio'], pulsos['fin'], silencio_intratono)
+    if nuevo_pulso is not None:
+        tonos = np.append(tonos, np.array([nuevo_pulso], dtype=TIPO_TONO))
 
-    for index in range(len(tonos_morse)):
-        tono = tonos_morse[index]
-        duracion_tono = tono[1] - tono[0]
-        tonos_y_pausas.append((duracion_tono, 'tono'))
+    informar(f'Detectados {len(tonos)} pulsos')
+    return tonos
 
-        # Añadimos pausa si existe un siguiente tono
-        if index < len(tonos_morse) - 1:
-            tono_siguiente = tonos_morse[index + 1]
-            duracion_pausa = tono_siguiente[0] - tono[1]
-            tonos_y_pausas.append((duracion_pausa, 'pausa'))
+# Fusión vectorizada de pulsos en tonos. Equivale a recorrer los pulsos uno a
+# uno con un tono en construcción:
+#   - si el silencio hasta el siguiente pulso es menor que silencio_intratono,
+#     el siguiente pulso se une al tono en construcción (o lo empieza);
+#   - si es mayor, el tono en construcción se cierra;
+#   - si es exactamente igual, no se hace nada.
+# Por tanto cada tono va desde el primer pulso que se fusiona hasta el último
+# antes de un corte, y los pulsos aislados se descartan. Recibe el tono que
+# viniera en construcción, como un par (inicio, fin), y devuelve los tonos
+# cerrados y el que siga abierto.
+def fusionar_pulsos(inicios, finales, silencio_intratono, nuevo_pulso=None):
+    silencios = inicios[1:] - finales[:-1]
+    cortes = silencios > silencio_intratono
+    fusiones = np.flatnonzero(silencios < silencio_intratono)
 
-    # Calculamos el valor máximo y el mínimo entre los tonos y las pausas.
-    max_tono = max([x[0] for x in tonos_y_pausas if x[1] == "tono"])
-    min_tono = min([x[0] for x in tonos_y_pausas if x[1] == "tono"])
+    # Numeramos los tramos entre cortes; las fusiones de un mismo tramo
+    # forman un único tono.
+    tramos = np.cumsum(cortes)
+    total_cortes = int(tramos[-1]) if len(tramos) else 0
+    tramo_fusion = tramos[fusiones]
+    primeras = np.flatnonzero(np.diff(tramo_fusion, prepend=-1))
+    ultimas = np.append(primeras[1:] - 1, len(fusiones) - 1)[:len(primeras)]
 
-    max_pausa = max([x[0] for x in tonos_y_pausas if x[1] == "pausa"])
-    min_pausa = min([x[0] for x in tonos_y_pausas if x[1] == "pausa"])
+    tonos_inicio = inicios[fusiones[primeras]]
+    tonos_fin = finales[fusiones[ultimas] + 1]
+    tonos_tramo = tramo_fusion[primeras]
 
+    # El tono que venía en construcción continúa en el primer tramo o, si
+    # hay un corte antes de cualquier fusión, se cierra tal cual.
+    if nuevo_pulso is not None:
+        if len(tonos_tramo) and tonos_tramo[0] == 0:
+            tonos_inicio[0] = nuevo_pulso[0]
+        elif total_cortes:
+            tonos_inicio = np.concatenate(([nuevo_pulso[0]], tonos_inicio))
+            tonos_fin = np.concatenate(([nuevo_pulso[1]], tonos_fin))
+            tonos_tramo = np.concatenate(([0], tonos_tramo))
+        else:
+            return np.empty(0, dtype=TIPO_TONO), nuevo_pulso
 
+    # El último tono sigue abierto si no hay ningún corte después de él.
+    tonos = tonos_de_columnas(tonos_inicio, tonos_fin)
+    if len(tonos) and tonos_tramo[-1] == total_cortes:
+        return tonos[:-1], (int(tonos_inicio[-1]), int(tonos_fin[-1]))
+    return tonos, None
+
+# El siguiente paso es transformar los tonos, que solo indican el comienzo y
+# el final de cada tono, en un array de elementos que calcule 
+# también los silencios e indique si se trata de un tono (corto o largo)
+# o de una pausa (corta entre tonos de una letra, media entre letras y larga
+# entre palabras). 
+def clasificacion_tonos_y_silencios(tonos_morse):
+    # Creamos un array de elementos (duracion, clase) que intercala los tonos
+    # con los silencios indicando la duración de cada uno para diferenciar
+    # entre tonos cortos y largos y pausas intra-letra, inter-letra y
+    # inter-palabra.
+    tonos = a_tonos(tonos_morse)
+    elementos = np.empty(max(0, 2 * len(tonos) - 1), dtype=TIPO_ELEMENTO)
+    if len(tonos) == 0:
+        return elementos
+    duraciones = tonos['fin'] - tonos['inicio']
+    pausas = tonos['inicio'][1:] - tonos['fin'][:-1]
 
     # Clasificación de tonos y pausas en corta, media o larga atendiendo a 
     # su longitud relativa a los máximos y los mínimos.
-    tonos_y_silencios_clasificados = []
-    for valor, etiqueta in tonos_y_pausas:
-        if etiqueta == 'tono':
-            if abs(valor - min_tono) < (min_tono/10):
-                clasificacion = 'Tono corto'
-            else:
-                clasificacion = 'Tono largo'
-            tonos_y_silencios_clasificados.append([valor, clasificacion])
-        
-        else:
-            if abs(valor - min_pausa) < (min_pausa/10):
-                clasificacion = 'Pausa corta'
-            elif abs(valor - max_pausa) < (max_pausa/10):
-                clasificacion = 'Pausa larga'
-            else:
-                clasificacion = 'Pausa media'
-            tonos_y_silencios_clasificados.append([valor, clasificacion])
+    min_tono = duraciones.min()
+    clases_tonos = np.where(np.abs(duraciones - min_tono) < min_tono / 10, TONO_CORTO, TONO_LARGO)
+    clases_pausas = np.full(len(pausas), PAUSA_MEDIA)
+    if len(pausas):
+        min_pausa, max_pausa = pausas.min(), pausas.max()
+        clases_pausas[np.abs(pausas - max_pausa) < max_pausa / 10] = PAUSA_LARGA
+        clases_pausas[np.abs(pausas - min_pausa) < min_pausa / 10] = PAUSA_CORTA
 
     # Si solo tenemos una palabra, las pausas inter-letra se interpretan como
     # inter- palabra. Lo corregimos tal que: si no hay "Pausas medias", las
     # pausas largas se sustituyen por pausas medias.
-    hay_medios = any(x[1] == "Pausa media" for x in tonos_y_silencios_clasificados)
+    if not np.any(clases_pausas == PAUSA_MEDIA):
+        informar('JUST ONE WORD DETECTED.')
+        clases_pausas[clases_pausas == PAUSA_LARGA] = PAUSA_MEDIA
 
-    if not hay_medios:
-        print('JUST ONE WORD DETECTED.')
-        tonos_y_silencios_clasificados = [[x[0], "Pausa media" if x[1] == "Pausa larga" else x[1]] for x in tonos_y_silencios_clasificados]
-    
-    return tonos_y_silencios_clasificados
+    elementos['duracion'][0::2] = duraciones
+    elementos['duracion'][1::2] = pausas
+    elementos['clase'][0::2] = clases_tonos
+    elementos['clase'][1::2] = clases_pausas
+    return elementos
 
-# El siguiente paso es transformar la lista de tonos y silencios en su 
+# Fragmento de morse escrito que aporta cada clase. Como los elementos
+# alternan tono y pausa, cada pausa media o larga cierra una letra no vacía.
+SIMBOLOS_CLASES = np.array(['.', '-', '', ' ', '  / '])
+
+# El siguiente paso es transformar los tonos y silencios clasificados en su 
 # equivalente en morse escrito.
 def a_morse_escrito(tonos_y_silencios_clasificados):
-    letra = ''
-    palabra = ''
-    mensaje = ''
-    for n in tonos_y_silencios_clasificados:
-        tipo = n[1]
-        
-        if tipo == 'Tono corto':
-            letra += '.'
-        elif tipo == 'Tono largo':
-            letra += '-'
-        elif tipo == 'Pausa media':
-            if letra:
-                letra += ' '
-                palabra += letra
-                letra = ''
-        elif tipo == 'Pausa larga':
-            if letra:
-                letra += ' '
-                palabra += letra
-                letra = ''
-            if palabra:
-                mensaje += palabra + ' / '
-                palabra = ''
-    if letra:
-        palabra += letra
-    if palabra:
-        mensaje += palabra
+    # Unimos los fragmentos de todas las clases de una vez, para que el
+    # coste sea lineal en la longitud del mensaje.
+    clases = clases_de_elementos(tonos_y_silencios_clasificados)
+    mensaje = ''.join(SIMBOLOS_CLASES[clases].tolist())
         
-    print(f'El audio corresponde al mensaje en morse: {mensaje}')
+    informar(f'El audio corresponde al mensaje en morse: {mensaje}')
     return mensaje
     
 # El último paso es transformar el mensaje de morse escrito a su equivalente
@@ -283,43 +720,970 @@ def a_morse_escrito(tonos_y_silencios_clasificados):
 def morse_a_latino(mensaje):
     # Transformamos el mensaje en una lista de palabras separadas por espacios.
     mensaje = mensaje.split("  / ") 
-    traduccion = ''
+    traduccion = []
     for palabra in mensaje:
         letras = palabra.split(' ')
         for letra in letras:
-            if letra in morse_to_char:
-                traduccion += morse_to_char[letra]
-            else:
-                traduccion += '#'
-        traduccion += ' '
+            traduccion.append(morse_to_char.get(letra, '#'))
+        traduccion.append(' ')
+    traduccion = ''.join(traduccion)
         
-    print(f'El mensaje en morse se traduce a: {traduccion}')
+    informar(f'El mensaje en morse se traduce a: {traduccion}')
     return(traduccion)
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-data, duracion, ruta_archivo = carga_audio()  
-data = normalizar_codificacion(data)
-representacion_grafica(duracion, data, ruta_archivo)
-pulsos = onda_a_pulsos(data)
-tonos_morse = pulsos_a_tonos(pulsos)
-tonos_y_silencios_clasificados = clasificacion_tonos_y_silencios(tonos_morse)
-mensaje = a_morse_escrito(tonos_y_silencios_clasificados)
-traduccion = morse_a_latino(mensaje)
+
+###### DECODIFICACIÓN DIRECTA CON CÓDIGOS ENTEROS ######
+
+# En lugar de escribir el morse con puntos y rayas y volver a partirlo para
+# buscar cada letra en morse_to_char, codificamos cada letra como un entero:
+# un 1 inicial seguido de un bit por símbolo (0 = punto, 1 = raya). Así
+# '.-' es 0b101 = 5 y '-' es 0b11 = 3. Todas las letras del diccionario
+# tienen como mucho 6 símbolos, de modo que sus códigos caben en una tabla
+# de 128 posiciones; las posiciones sin letra contienen '#'.
+LONGITUD_MAXIMA_LETRA = 6
+
+def codigo_morse(simbolos):
+    codigo = 1
+    for simbolo in simbolos:
+        codigo = (codigo << 1) | (simbolo == '-')
+    return codigo
+
+TABLA_MORSE = np.full(2 ** (LONGITUD_MAXIMA_LETRA + 1), '#')
+for simbolos, caracter in morse_to_char.items():
+    TABLA_MORSE[codigo_morse(simbolos)] = caracter
+
+# Agrupa los tonos en letras a partir de los códigos CLASES. Devuelve los
+# caracteres, el índice del primer tono de cada letra y su número de tonos,
+# si cada letra cierra una palabra y la posición de cada letra en el texto
+# (detrás de cada palabra va un espacio), o None si no hay tonos. Todo el
+# cálculo es vectorizado y lineal en el número de elementos.
+def agrupar_letras(clases):
+    posicion_tonos = np.flatnonzero(clases <= TONO_LARGO)
+    if len(posicion_tonos) == 0:
+        return None
+
+    # Cada pausa media o larga cierra una letra y cada pausa larga, además,
+    # una palabra. Numeramos a qué letra y a qué palabra pertenece cada tono.
+    letra_tono = np.cumsum(clases >= PAUSA_MEDIA)[posicion_tonos]
+    palabra_tono = np.cumsum(clases == PAUSA_LARGA)[posicion_tonos]
+    inicios_letra = np.flatnonzero(np.diff(letra_tono, prepend=-1))
+    longitudes = np.diff(np.append(inicios_letra, len(posicion_tonos)))
+
+    # El bit de cada tono se desplaza según las posiciones que faltan hasta
+    # el final de su letra; la suma de la letra más el 1 inicial es el código.
+    longitud_tono = np.repeat(longitudes, longitudes)
+    orden_tono = np.arange(len(posicion_tonos)) - np.repeat(inicios_letra, longitudes)
+    desplazamiento = np.minimum(longitud_tono - 1 - orden_tono, LONGITUD_MAXIMA_LETRA)
+    bits = clases[posicion_tonos].astype(np.int64) << desplazamiento
+    codigos = np.add.reduceat(bits, inicios_letra) + (np.int64(1) << np.minimum(longitudes, LONGITUD_MAXIMA_LETRA))
+    # Las letras demasiado largas no existen: apuntan a la posición 0 ('#').
+    codigos[longitudes > LONGITUD_MAXIMA_LETRA] = 0
+    caracteres = TABLA_MORSE[codigos]
+
+    # Cada letra se desplaza tantas posiciones como palabras hayan terminado
+    # antes que ella.
+    palabra_letra = palabra_tono[inicios_letra]
+    fin_palabra = np.append(palabra_letra[1:] != palabra_letra[:-1], True)
+    posiciones = np.arange(len(caracteres)) + np.cumsum(fin_palabra) - fin_palabra
+    return caracteres, inicios_letra, longitudes, fin_palabra, posiciones
+
+# Traduce los tonos y silencios clasificados directamente a texto latino,
+# con el mismo resultado que morse_a_latino(a_morse_escrito(...)) pero sin
+# construir ni volver a partir el morse escrito. Acepta los elementos
+# clasificados o directamente el array de códigos CLASES.
+def tonos_a_latino(tonos_y_silencios_clasificados):
+    letras = agrupar_letras(clases_de_elementos(tonos_y_silencios_clasificados))
+    if letras is None:
+        # Un mensaje vacío se traduce como una letra desconocida.
+        traduccion = '# '
+        informar(f'El mensaje en morse se traduce a: {traduccion}')
+        return traduccion
+
+    caracteres, _, _, fin_palabra, posiciones = letras
+    salida = np.full(len(caracteres) + np.count_nonzero(fin_palabra), ' ')
+    salida[posiciones] = caracteres
+    traduccion = salida.tobytes().decode('utf-32-le')
+
+    informar(f'El mensaje en morse se traduce a: {traduccion}')
+    return traduccion
+
+# Posición en la pista de cada carácter de tonos_a_latino: un array de
+# TIPO_TONO del mismo largo que el texto, con las muestras del inicio del
+# primer tono y del final del último tono de cada letra. Los espacios
+# ocupan la pausa hasta la palabra siguiente (el último, ninguna muestra).
+# tonos son los tonos que se clasificaron, uno por cada tono clasificado.
+def posiciones_caracteres(tonos_y_silencios_clasificados, tonos):
+    letras = agrupar_letras(clases_de_elementos(tonos_y_silencios_clasificados))
+    tonos = a_tonos(tonos)
+    if letras is None:
+        return np.zeros(2, dtype=TIPO_TONO)
+    caracteres, inicios_letra, longitudes, fin_palabra, posiciones = letras
+    if inicios_letra[-1] + longitudes[-1] != len(tonos):
+        raise ValueError('Los tonos no corresponden a los tonos clasificados')
+
+    inicios = tonos['inicio'][inicios_letra]
+    finales = tonos['fin'][inicios_letra + longitudes - 1]
+    salida = np.empty(len(caracteres) + np.count_nonzero(fin_palabra), dtype=TIPO_TONO)
+    salida['inicio'][posiciones] = inicios
+    salida['fin'][posiciones] = finales
+    espacios = posiciones[fin_palabra] + 1
+    salida['inicio'][espacios] = finales[fin_palabra]
+    salida['fin'][espacios] = np.append(inicios[1:], finales[-1])[fin_palabra]
+    return salida
+
+###### DECODIFICACIÓN POR BLOQUES ######
+
+# Para grabaciones muy largas no cargamos la pista entera: la leemos en
+# bloques de tamaño fijo y arrastramos de un bloque al siguiente el estado de
+# la detección de pulsos y de la fusión en tonos. Así la memoria depende del
+# tamaño del bloque y no de la duración de la pista (solo se acumulan los
+# tonos, que son unos pocos miles).
+
+def leer_bloques(ruta_archivo, tam_bloque=TAM_BLOQUE):
+    # Cada bloque es una vista de la pista proyectada en memoria, en su
+    # codificación original: no se crea ninguna copia en float32.
+    sample_rate, data = carga_audio_mmap(ruta_archivo)
+    for i in range(0, len(data), tam_bloque):
+        yield data[i:i + tam_bloque]
+
+# Compara la amplitud con el umbral en la codificación original de los datos.
+# Para enteros, |(x - centro) / escala| > umbral equivale a que x quede fuera
+# del intervalo [centro - umbral*escala, centro + umbral*escala], así que no
+# hace falta convertir a float ni calcular el valor absoluto.
+def actividad_umbral(data, umbral=UMBRAL):
+    if data.dtype.kind == 'f':
+        return np.abs(data) > umbral
+    superior, inferior = limites_umbral(data.dtype, umbral)
+    actividad = data > superior
+    actividad |= data < inferior
+    return actividad
+
+# Límites fuera de los cuales hay sonido, en la codificación de los datos.
+# Para float el umbral se toma en la precisión de los datos, como hace
+# NumPy al comparar np.abs(data) > umbral.
+def limites_umbral(tipo, umbral=UMBRAL):
+    if tipo.kind == 'f':
+        return tipo.type(umbral), -tipo.type(umbral)
+    centro, escala = escala_codificacion(tipo)
+    limites = np.iinfo(tipo)
+    superior = min(int(np.floor(centro + umbral * escala)), limites.max)
+    inferior = max(int(np.ceil(centro - umbral * escala)), limites.min)
+    return superior, inferior
+
+# El estado que se arrastra entre bloques: posición absoluta del bloque,
+# actividad de la última muestra, inicio de un pulso que sigue abierto,
+# último pulso recibido y tono en construcción.
+def estado_inicial():
+    return {
+        'posicion': 0,
+        'activo': None,
+        'inicio_abierto': None,
+        'pulso_previo': None,
+        'nuevo_tono': None,
+    }
+
+# Versión por bloques de onda_a_pulsos. Devuelve los pulsos (en posiciones
+# absolutas) que se cierran dentro del bloque.
+def onda_a_pulsos_incremental(bloque, estado, umbral=UMBRAL):
+    if len(bloque) == 0:
+        return np.empty(0, dtype=TIPO_TONO)
+
+    # Comparamos la amplitud absoluta al umbral para generar una lista booleana.
+    actividad = actividad_umbral(bloque, umbral)
+    if estado['activo'] is None:
+        estado['activo'] = bool(actividad[0])
+
+    # Anteponemos la actividad de la última muestra del bloque anterior para
+    # no perder los cambios que caen justo en la frontera entre bloques, y
+    # calculamos la diferencia entre valores consecutivos para identificar
+    # cuándo comienza (1) y cuándo acaba (-1) el sonido.
+    previo = np.array([estado['activo']])
+    cambios = np.diff(np.concatenate((previo, actividad)).astype(np.int8))
+    return pulsos_de_cambios(np.flatnonzero(cambios == 1), np.flatnonzero(cambios == -1),
+                             bool(actividad[-1]), len(bloque), estado)
+
+# Convierte las posiciones de los cambios de un bloque en pulsos con
+# posiciones absolutas, resolviendo los que cruzan la frontera con el
+# bloque anterior o el siguiente, y avanza el estado.
+def pulsos_de_cambios(inicios, finales, activo_final, longitud, estado):
+    # El cambio j ocurre entre las muestras posicion + j - 1 y posicion + j.
+    desplazamiento = estado['posicion'] - 1
+    inicios = inicios + desplazamiento
+    finales = finales + desplazamiento
+
+    # Si veníamos con sonido, el primer final cierra el pulso abierto. Si la
+    # pista empezó con sonido no conocemos su inicio y descartamos ese pulso.
+    if estado['activo']:
+        if estado['inicio_abierto'] is not None:
+            inicios = np.concatenate(([estado['inicio_abierto']], inicios))
+        else:
+            finales = finales[1:]
+
+    # Si el bloque termina con sonido, el último inicio queda abierto.
+    if len(inicios) > len(finales):
+        estado['inicio_abierto'] = int(inicios[-1])
+        inicios = inicios[:-1]
+    else:
+        estado['inicio_abierto'] = None
+
+    estado['activo'] = activo_final
+    estado['posicion'] += longitud
+    return tonos_de_columnas(inicios, finales)
+
+# Versión por bloques de pulsos_a_tonos. El último pulso de cada bloque se
+# guarda porque su distancia al siguiente no se conoce hasta el bloque
+# siguiente. Con final=True se cierra el tono que quede en construcción.
+def pulsos_a_tonos_incremental(pulsos, estado, silencio_intratono=SILENCIO_INTRATONO, final=False):
+    inicios, finales = pulsos['inicio'], pulsos['fin']
+    if estado['pulso_previo'] is not None:
+        inicios = np.concatenate(([estado['pulso_previo'][0]], inicios))
+        finales = np.concatenate(([estado['pulso_previo'][1]], finales))
+
+    tonos, nuevo_pulso = fusionar_pulsos(inicios, finales, silencio_intratono, estado['nuevo_tono'])
+
+    if len(inicios):
+        estado['pulso_previo'] = (int(inicios[-1]), int(finales[-1]))
+    if final and nuevo_pulso is not None:
+        tonos = np.append(tonos, np.array([nuevo_pulso], dtype=TIPO_TONO))
+        nuevo_pulso = None
+    estado['nuevo_tono'] = nuevo_pulso
+    return tonos
+
+# En tiempo real no podemos esperar al siguiente pulso para saber que un tono
+# ha terminado: si el silencio acumulado desde el último pulso ya supera
+# silencio_intratono, cualquier pulso futuro quedará separado por un corte,
+# así que el tono en construcción puede cerrarse ya.
+def cerrar_tono_por_silencio(estado, silencio_intratono=SILENCIO_INTRATONO):
+    if estado['nuevo_tono'] is None or estado['inicio_abierto'] is not None:
+        return np.empty(0, dtype=TIPO_TONO)
+    # El siguiente inicio será, como pronto, la última muestra ya recibida.
+    silencio_minimo = estado['posicion'] - 1 - estado['pulso_previo'][1]
+    if silencio_minimo > silencio_intratono:
+        tono = estado['nuevo_tono']
+        estado['nuevo_tono'] = None
+        return np.array([tono], dtype=TIPO_TONO)
+    return np.empty(0, dtype=TIPO_TONO)
+
+# Recorre la onda por bloques y va devolviendo (como generador) un array con
+# los tonos que se cierran en cada bloque.
+def iterar_tonos(data, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO, tam_bloque=TAM_BLOQUE):
+    bloques = (data[i:i + tam_bloque] for i in range(0, len(data), tam_bloque))
+    yield from iterar_tonos_bloques(bloques, umbral, silencio_intratono)
+
+# Lo mismo a partir de cualquier secuencia de bloques consecutivos. Con el
+# motor 'numba' cada bloque pasa de muestras a tonos en una sola etapa.
+def iterar_tonos_bloques(bloques, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO):
+    estado = estado_inicial()
+    compilado = motor_compilado()
+    if compilado is not None:
+        for bloque in bloques:
+            yield medir_etapa('onda_a_tonos', ('muestras', 'tonos'), tonos_bloque_compilado,
+                              compilado, bloque, estado, umbral, silencio_intratono)
+        yield tonos_bloque_compilado(compilado, INDICADOR, estado, umbral, silencio_intratono, True)
+        return
+    for bloque in bloques:
+        pulsos = medir_etapa('onda_a_pulsos', ('muestras', 'pulsos'), onda_a_pulsos_incremental,
+                             bloque, estado, umbral)
+        yield medir_etapa('pulsos_a_tonos', ('pulsos', 'tonos'), pulsos_a_tonos_incremental,
+                          pulsos, estado, silencio_intratono)
+
+    # Cerramos la pista con el indicador de final, como en onda_a_pulsos.
+    pulsos = onda_a_pulsos_incremental(INDICADOR, estado, umbral)
+    yield medir_etapa('pulsos_a_tonos', ('pulsos', 'tonos'), pulsos_a_tonos_incremental,
+                      pulsos, estado, silencio_intratono, True)
+
+# Pasa de la onda a los tonos recorriéndola por bloques. Equivale a
+# pulsos_a_tonos(onda_a_pulsos(data)) sin guardar todos los micro-pulsos.
+def onda_a_tonos(data, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO, tam_bloque=TAM_BLOQUE):
+    tonos_morse = unir_tonos(iterar_tonos(data, umbral, silencio_intratono, tam_bloque))
+    informar(f'Detectados {len(tonos_morse)} pulsos')
+    return tonos_morse
+
+# Decodificación completa por bloques: mismo resultado que la cadena
+# onda_a_pulsos -> morse_a_latino pero con memoria acotada.
+def decodificar_por_bloques(ruta_archivo, tam_bloque=TAM_BLOQUE):
+    return decodificar(ruta_archivo, tam_bloque=tam_bloque, verboso=VERBOSO)['texto']
+
+###### MOTOR COMPILADO ######
+
+# Cambia el motor de detección mientras dura el bloque with.
+@contextlib.contextmanager
+def usar_motor(nombre):
+    global MOTOR
+    if nombre not in MOTORES:
+        raise ValueError(f'Motor desconocido: {nombre}')
+    anterior, MOTOR = MOTOR, nombre
+    try:
+        yield
+    finally:
+        MOTOR = anterior
+
+# Módulo con el núcleo compilado si el motor es 'numba', o None para usar
+# NumPy. Numba es opcional: si no está instalado se avisa y se sigue con
+# NumPy, que da el mismo resultado.
+def motor_compilado():
+    if MOTOR != 'numba':
+        return None
+    try:
+        import compilado_morse
+    except ImportError:
+        informar('Numba no está instalado: se usa el motor de NumPy')
+        return None
+    return compilado_morse
+
+# Versión compilada de onda_a_pulsos_incremental seguida de
+# pulsos_a_tonos_incremental, con el mismo estado. Los bloques en una
+# codificación que Numba no admite (por ejemplo, con otro orden de bytes)
+# pasan por NumPy, así que pueden mezclarse ambos caminos en una pista.
+def tonos_bloque_compilado(compilado, bloque, estado, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO,
+                           final=False):
+    bloque = np.asarray(bloque)
+    if not bloque.dtype.isnative:
+        pulsos = onda_a_pulsos_incremental(bloque, estado, umbral)
+        return pulsos_a_tonos_incremental(pulsos, estado, silencio_intratono, final)
+    tonos = np.empty(0, dtype=TIPO_TONO)
+    if len(bloque):
+        if estado['activo'] is None:
+            estado['activo'] = bool(actividad_umbral(bloque[:1], umbral)[0])
+        superior, inferior = limites_umbral(bloque.dtype, umbral)
+        salida = np.empty((len(bloque) // 2 + 1, 2), dtype=np.int64)
+        estado_numba = compilado.estado_compilado(estado)
+        n = compilado.tonos_bloque(bloque, superior, inferior, silencio_intratono, estado_numba, salida)
+        compilado.actualizar_estado(estado, estado_numba)
+        tonos = tonos_de_columnas(salida[:n, 0], salida[:n, 1])
+    if final and estado['nuevo_tono'] is not None:
+        tonos = np.append(tonos, np.array([estado['nuevo_tono']], dtype=TIPO_TONO))
+        estado['nuevo_tono'] = None
+    return tonos
+
+###### DIEZMADO A UNA FRECUENCIA DE TRABAJO ######
+
+# silencio_intratono está en muestras, así que su significado cambia con la
+# frecuencia de muestreo, y una pista a 192 kHz cuesta 24 veces más que a
+# 8 kHz sin llevar más información en morse. Como alternativa, reducimos
+# primero la pista a una frecuencia de trabajo baja y fija, y expresamos el
+# silencio intratono en segundos. Las posiciones de los tonos se devuelven
+# en muestras de la pista original, así que el resto de la cadena (y la
+# clasificación, que ya trabaja en múltiplos del punto) no cambia.
+
+# Frecuencia de trabajo por defecto, en Hz. La portadora debe quedar por
+# debajo de un cuarto de la frecuencia de trabajo (2 kHz por defecto) para
+# que el filtro apenas la atenúe.
+FRECUENCIA_TRABAJO = 8000
+
+# Silencio intratono en segundos: por encima del hueco entre semiciclos de
+# la portadora (menos de 1 ms desde unos 300 Hz) y muy por debajo del punto
+# (24 ms a 50 wpm).
+SILENCIO_INTRATONO_SEGUNDOS = 0.002
+
+# Factor entero de diezmado: la frecuencia de trabajo real es sample_rate /
+# factor, la más cercana por encima de la pedida.
+def factor_diezmado(sample_rate, frecuencia_trabajo=FRECUENCIA_TRABAJO):
+    return max(1, int(sample_rate // frecuencia_trabajo))
+
+def estado_diezmado():
+    return {'pendiente': np.empty(0, dtype=np.float32), 'rampa_anterior': np.float32(0)}
+
+# Cada muestra de trabajo k es la media, con pesos en triángulo, de las
+# muestras originales entre (k - 1) * factor y (k + 1) * factor, centrada en
+# k * factor. Es un filtro CIC de orden 2 (respuesta sinc al cuadrado, con
+# ceros en todos los múltiplos de la frecuencia de trabajo) que evita que el
+# ruido de alta frecuencia se repliegue sobre la banda de la portadora. Se
+# calcula con un solo producto matricial por bloque, que da para cada grupo
+# de factor muestras su suma y su suma con pesos crecientes de 0 a 1 (la
+# rampa): el triángulo es la rampa del grupo anterior más la rampa
+# descendente (suma - rampa) del grupo actual. Las muestras que no completan
+# un grupo pasan al bloque siguiente.
+def diezmar_bloque(bloque, estado, factor):
+    x = a_float32(bloque)
+    if len(estado['pendiente']):
+        x = np.concatenate((estado['pendiente'], x))
+    grupos = len(x) // factor
+    estado['pendiente'] = x[grupos * factor:]
+    if grupos == 0:
+        return np.empty(0, dtype=np.float32)
+    pesos = np.empty((factor, 2), dtype=np.float32)
+    pesos[:, 0] = 1
+    pesos[:, 1] = (np.arange(factor) + 0.5) / factor
+    sumas, rampas = (x[:grupos * factor].reshape(grupos, factor) @ pesos).T
+    anteriores = np.concatenate(([estado['rampa_anterior']], rampas[:-1]))
+    estado['rampa_anterior'] = rampas[-1]
+    return (anteriores + sumas - rampas) / np.float32(factor)
+
+# Tonos de la pista diezmada por bloques, con posiciones en muestras de la
+# pista original. Cada bloque original tiene tam_bloque * factor muestras,
+# para que los bloques de trabajo sigan midiendo unas tam_bloque.
+def iterar_tonos_diezmados(data, sample_rate, umbral=UMBRAL, silencio_segundos=SILENCIO_INTRATONO_SEGUNDOS,
+                           tam_bloque=TAM_BLOQUE, frecuencia_trabajo=FRECUENCIA_TRABAJO):
+    factor = factor_diezmado(sample_rate, frecuencia_trabajo)
+    silencio_intratono = max(1, round(silencio_segundos * sample_rate / factor))
+    # Si la pista ya está a la frecuencia de trabajo no hay nada que diezmar.
+    if factor == 1:
+        yield from iterar_tonos(data, umbral, silencio_intratono, tam_bloque)
+        return
+    paso = tam_bloque * factor
+    estado = estado_diezmado()
+    diezmados = (medir_etapa('diezmado', ('muestras', 'muestras'), diezmar_bloque,
+                             data[i:i + paso], estado, factor)
+                 for i in range(0, len(data), paso))
+    for tonos in iterar_tonos_bloques(diezmados, umbral, silencio_intratono):
+        tonos['inicio'] *= factor
+        tonos['fin'] *= factor
+        yield tonos
+
+###### DETECCIÓN POR ENVOLVENTE ######
+
+# Umbralizar cada muestra convierte cada semiciclo de la portadora en un
+# pulso, y luego hay que volver a unirlos con silencio_intratono, que está en
+# muestras y solo funciona para algunas frecuencias de muestreo y portadoras.
+# Como alternativa, resumimos primero la onda en una envolvente con una
+# ventana de duración fija: dentro de un tono todas las ventanas superan el
+# umbral, así que cada tono aparece ya como un único pulso.
+
+# Amplitud de cada ventana de n muestras: el valor eficaz escalado por raíz
+# de 2, para que una senoide dé su amplitud y sirva el mismo umbral, o el
+# pico (máximo de |x|, calculado en la codificación original), más barato
+# pero mucho más sensible al ruido.
+def envolvente_bloque(bloque, n, metodo='rms'):
+    indices = np.arange(0, len(bloque), n)
+    centro, escala = escala_codificacion(bloque.dtype)
+    if metodo == 'pico':
+        maximos = np.maximum.reduceat(bloque, indices).astype(np.float32)
+        minimos = np.minimum.reduceat(bloque, indices).astype(np.float32)
+        return np.maximum(maximos - centro, centro - minimos) / np.float32(escala)
+    if metodo == 'rms':
+        cuadrados = np.square(a_float32(bloque), dtype=np.float32)
+        cuentas = np.diff(np.append(indices, len(bloque)))
+        # Con varios canales (muestras x canales) cada ventana se reduce por
+        # columnas.
+        if bloque.ndim == 2:
+            cuentas = cuentas[:, np.newaxis]
+        return np.sqrt(2 * np.add.reduceat(cuadrados, indices) / cuentas).astype(np.float32)
+    raise ValueError(f'Método de envolvente desconocido: {metodo}')
+
+# Envolvente de la pista completa, calculada por bloques (múltiplos de la
+# ventana) para no convertir la pista entera a float. Devuelve la envolvente
+# y el número de muestras por ventana.
+def envolvente(data, sample_rate, ventana=VENTANA_ENVOLVENTE, metodo='rms', tam_bloque=TAM_BLOQUE):
+    n = max(1, round(ventana * sample_rate))
+    tam = max(n, tam_bloque // n * n)
+    partes = [envolvente_bloque(data[i:i + tam], n, metodo) for i in range(0, len(data), tam)]
+    if not partes:
+        return np.empty((0,) + data.shape[1:], dtype=np.float32), n
+    return np.concatenate(partes), n
+
+# Detecta los tonos sobre la envolvente. A diferencia de pulsos_a_tonos,
+# aquí un pulso aislado ya es un tono completo, así que se conservan todos y
+# solo se unen los separados por menos de silencio_ventanas ventanas.
+# Devuelve los tonos en muestras, con el mismo convenio que onda_a_pulsos
+# (inicio = última muestra en silencio, fin = última muestra con sonido).
+def envolvente_a_tonos(env, n, umbral=UMBRAL, silencio_ventanas=1):
+    estado = estado_inicial()
+    pulsos = onda_a_pulsos_incremental(env, estado, umbral)
+    return unir_pulsos_envolvente(pulsos, estado, len(env), n, silencio_ventanas)
+
+# Segunda mitad de envolvente_a_tonos, a partir de los pulsos de la
+# envolvente completa y el estado en que ha quedado su detección.
+def unir_pulsos_envolvente(pulsos, estado, longitud, n, silencio_ventanas=1):
+    inicios, finales = pulsos['inicio'], pulsos['fin']
+    # Si la pista termina con sonido, el tono acaba en la última ventana.
+    if estado['inicio_abierto'] is not None:
+        inicios = np.append(inicios, estado['inicio_abierto'])
+        finales = np.append(finales, longitud - 1)
+    if len(inicios) == 0:
+        return np.empty(0, dtype=TIPO_TONO)
+
+    cortes = np.flatnonzero(inicios[1:] - finales[:-1] > silencio_ventanas)
+    primeros = np.concatenate(([0], cortes + 1))
+    ultimos = np.append(cortes, len(inicios) - 1)
+    return tonos_de_columnas((inicios[primeros] + 1) * n - 1, (finales[ultimos] + 1) * n - 1)
+
+# Cadena completa de la onda a los tonos usando la envolvente.
+def onda_a_tonos_envolvente(data, sample_rate, umbral=UMBRAL, ventana=VENTANA_ENVOLVENTE,
+                            silencio=SILENCIO_ENVOLVENTE, metodo='rms', tam_bloque=TAM_BLOQUE):
+    env, n = envolvente(data, sample_rate, ventana, metodo, tam_bloque)
+    silencio_ventanas = max(1, round(silencio * sample_rate / n))
+    tonos_morse = envolvente_a_tonos(env, n, umbral, silencio_ventanas)
+    informar(f'Detectados {len(tonos_morse)} pulsos en {len(env)} ventanas de envolvente')
+    return tonos_morse
+
+###### CLASIFICACIÓN ADAPTATIVA ######
+
+# clasificacion_tonos_y_silencios necesita todos los tonos de antemano para
+# calcular máximos y mínimos, y si el operador cambia de velocidad a mitad
+# de mensaje clasifica mal todo lo que viene después. Como alternativa,
+# clasificamos cada tono según llega con dos centroides (duración del punto
+# y de la raya) que se van actualizando con una media móvil, es decir, un
+# agrupamiento k-medias en una dimensión hecho en línea. Cada elemento se
+# clasifica en tiempo y memoria constantes.
+
+# Número de tonos que se reúnen al principio para estimar el punto inicial,
+# y peso de cada nuevo tono en la actualización de los centroides.
+TONOS_ARRANQUE = 8
+ADAPTACION = 0.2
+
+# Si se conoce la duración del punto (en muestras) se empieza a clasificar
+# desde el primer tono; si no, se estima con los TONOS_ARRANQUE primeros.
+def estado_clasificador(punto=None):
+    return {
+        'punto': punto,
+        'raya': None if punto is None else 3 * punto,
+        'arranque': [],
+        'fin_anterior': None,
+    }
+
+# Estimación inicial del punto: los elementos de una unidad (tonos cortos y
+# pausas entre símbolos) son los que no llegan al doble del más corto.
+def estimar_punto(tonos):
+    duraciones = [fin - inicio for inicio, fin in tonos]
+    duraciones += [tonos[i + 1][0] - tonos[i][1] for i in range(len(tonos) - 1)]
+    referencia = max(1, min(duraciones))
+    unidades = [d for d in duraciones if d < 2 * referencia]
+    return sum(unidades) / len(unidades)
+
+# Clasifica un tono (y la pausa que lo separa del anterior) con los
+# centroides actuales y los actualiza. Devuelve los elementos como tuplas
+# (duracion, clase).
+def clasificar_con_centroides(tono, estado):
+    clasificados = []
+    punto, raya = estado['punto'], estado['raya']
+
+    # Las pausas se miden en puntos: 1 entre símbolos, 3 entre letras y 7
+    # entre palabras, con las fronteras a medio camino.
+    if estado['fin_anterior'] is not None:
+        pausa = tono[0] - estado['fin_anterior']
+        if pausa < 2 * punto:
+            clasificados.append((pausa, PAUSA_CORTA))
+        elif pausa < 5 * punto:
+            clasificados.append((pausa, PAUSA_MEDIA))
+        else:
+            clasificados.append((pausa, PAUSA_LARGA))
+
+    # El tono es corto si está más cerca (en escala logarítmica) del punto
+    # que de la raya. Solo se mueve el centroide asignado, y el otro se
+    # mantiene a una proporción entre 2 y 4 para seguir los cambios de
+    # velocidad aunque durante un tiempo solo lleguen tonos de un tipo.
+    # Un tono mucho más corto que el punto estimado indica que el operador
+    # ha acelerado de golpe, y se toma directamente como nuevo punto.
+    duracion = tono[1] - tono[0]
+    if duracion < 0.6 * punto:
+        punto, raya = duracion, 3 * duracion
+    if duracion * duracion < punto * raya:
+        clasificados.append((duracion, TONO_CORTO))
+        punto += ADAPTACION * (duracion - punto)
+        raya = min(max(raya, 2 * punto), 4 * punto)
+    else:
+        clasificados.append((duracion, TONO_LARGO))
+        raya += ADAPTACION * (duracion - raya)
+        punto = min(max(punto, raya / 4), raya / 2)
+
+    estado['punto'], estado['raya'] = punto, raya
+    estado['fin_anterior'] = tono[1]
+    return clasificados
+
+# Clasifica los tonos reunidos durante el arranque una vez estimado el punto.
+def vaciar_arranque(estado):
+    tonos = estado['arranque']
+    estado['arranque'] = []
+    punto = estimar_punto(tonos)
+    largos = [fin - inicio for inicio, fin in tonos if fin - inicio >= 2 * punto]
+    estado['punto'] = punto
+    estado['raya'] = min(max(sum(largos) / len(largos), 2 * punto), 4 * punto) if largos else 3 * punto
+    clasificados = []
+    for tono in tonos:
+        clasificados += clasificar_con_centroides(tono, estado)
+    return clasificados
+
+# Punto de entrada incremental: recibe los tonos que van llegando (un array
+# de TIPO_TONO, por ejemplo los de un bloque) y devuelve los elementos ya
+# clasificados, en el mismo formato que clasificacion_tonos_y_silencios.
+# Durante el arranque no devuelve nada. Los centroides dependen de cada
+# tono anterior, así que el recorrido es secuencial, pero sobre enteros de
+# Python y con una sola conversión a array por llamada.
+def clasificar_tonos(tonos, estado):
+    clasificados = []
+    for tono in a_tonos(tonos).tolist():
+        if estado['punto'] is None:
+            estado['arranque'].append(tono)
+            if len(estado['arranque']) == TONOS_ARRANQUE:
+                clasificados += vaciar_arranque(estado)
+        else:
+            clasificados += clasificar_con_centroides(tono, estado)
+    return np.fromiter(clasificados, dtype=TIPO_ELEMENTO, count=len(clasificados))
+
+# Lo mismo para un único tono (inicio, fin).
+def clasificar_tono(tono, estado):
+    return clasificar_tonos(np.array([tuple(tono)], dtype=TIPO_TONO), estado)
+
+# Al terminar la pista, clasifica los tonos que sigan en el arranque.
+def finalizar_clasificacion(estado):
+    clasificados = vaciar_arranque(estado) if estado['arranque'] else []
+    return np.fromiter(clasificados, dtype=TIPO_ELEMENTO, count=len(clasificados))
+
+# Equivalente adaptativo de clasificacion_tonos_y_silencios para todos los
+# tonos de una pista, en una sola pasada.
+def clasificacion_adaptativa(tonos_morse):
+    estado = estado_clasificador()
+    return np.concatenate((clasificar_tonos(tonos_morse, estado), finalizar_clasificacion(estado)))
+
+###### USO COMO BIBLIOTECA ######
+
+# Decodifica una pista sin interacción ni gráficas. La fuente puede ser la
+# ruta de un archivo WAV (que se proyecta en memoria) o un array de muestras
+# en cualquiera de las codificaciones de normalizar_codificacion, en cuyo
+# caso hay que indicar su sample_rate. Devuelve un diccionario con el
+# mensaje en morse escrito, su traducción y algunos datos de la pista.
+# Con envolvente='rms' o 'pico' los tonos se detectan sobre la envolvente
+# (ver onda_a_tonos_envolvente) en lugar de muestra a muestra. El texto se
+# obtiene directamente con tonos_a_latino; el morse escrito solo se
+# construye si se pide con morse_escrito=True. Con clasificador='adaptativo'
+# los tonos se clasifican según se detectan con clasificar_tono, que sigue
+# los cambios de velocidad del operador, en lugar de con los máximos y
+# mínimos globales de clasificacion_tonos_y_silencios. Con grafica (ruta
+# .png o .svg) se guarda además la onda con los tonos y pausas detectados.
+# Con frecuencia_trabajo (en Hz) la pista se diezma antes de detectar los
+# tonos (ver iterar_tonos_diezmados) y el silencio intratono se toma de
+# silencio_segundos, de modo que el resultado no depende de la frecuencia
+# de muestreo. silencio_segundos también puede usarse sin diezmar. Con
+# posiciones=True se añade en 'posiciones' dónde empieza y acaba cada
+# carácter del texto, en muestras (ver posiciones_caracteres). motor elige
+# el motor de detección de tonos (por defecto, el de MOTOR).
+def decodificar(fuente, sample_rate=None, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO,
+                tam_bloque=TAM_BLOQUE, envolvente=None, morse_escrito=True, verboso=False,
+                clasificador='global', grafica=None, frecuencia_trabajo=None, silencio_segundos=None,
+                posiciones=False, motor=None):
+    if clasificador not in ('global', 'adaptativo'):
+        raise ValueError(f'Clasificador desconocido: {clasificador}')
+    with verbosidad(verboso), usar_motor(motor or MOTOR):
+        sample_rate, data = cargar_fuente(fuente, sample_rate)
+        tonos_morse = detectar_tonos(data, sample_rate, umbral, silencio_intratono, tam_bloque, envolvente,
+                                     frecuencia_trabajo, silencio_segundos)
+        # Para la gráfica y las posiciones hace falta conservar todos los tonos.
+        if grafica is not None or posiciones:
+            tonos_morse = unir_tonos(tonos_morse)
+        numero_tonos, tonos_y_silencios_clasificados, mensaje, traduccion = tonos_a_mensaje(
+            tonos_morse, clasificador, morse_escrito)
+        if envolvente is None:
+            informar(f'Detectados {numero_tonos} pulsos')
+        if grafica is not None:
+            nombre = str(fuente) if isinstance(fuente, (str, os.PathLike)) else 'array'
+            representacion_grafica(len(data) / sample_rate, data, nombre, grafica, tonos_morse,
+                                   tonos_y_silencios_clasificados)
+
+    resultado = {
+        'morse': mensaje,
+        'texto': traduccion,
+        'tonos': numero_tonos,
+        'sample_rate': sample_rate,
+        'duracion': round(len(data) / sample_rate, 4),
+    }
+    if posiciones:
+        resultado['posiciones'] = posiciones_caracteres(tonos_y_silencios_clasificados, tonos_morse)
+    return resultado
+
+# La fuente puede ser una ruta (se proyecta en memoria) o un array con su
+# sample_rate. Devuelve (sample_rate, data) con un solo canal.
+def cargar_fuente(fuente, sample_rate=None):
+    if isinstance(fuente, (str, os.PathLike)):
+        return medir_etapa('carga_audio', ('bytes', 'muestras'), carga_audio_mmap, fuente,
+                           contar_entrada=os.path.getsize, contar_salida=contar_muestras)
+    if sample_rate is None:
+        raise ValueError('sample_rate es obligatorio si la fuente es un array')
+    return sample_rate, canal_izquierdo(np.asarray(fuente))
+
+# Detector de tonos muestra a muestra (un generador de arrays de tonos, uno
+# por bloque), sobre la pista diezmada (otro generador) o sobre la
+# envolvente (una lista con un solo array). La envolvente ya mide sus
+# ventanas y silencios en segundos y resume la pista en una sola pasada, así
+# que no se diezma. unir_tonos los reúne en un solo array.
+def detectar_tonos(data, sample_rate, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO,
+                   tam_bloque=TAM_BLOQUE, envolvente=None, frecuencia_trabajo=None, silencio_segundos=None):
+    if envolvente is not None:
+        return [medir_etapa('envolvente', ('muestras', 'tonos'), onda_a_tonos_envolvente,
+                            data, sample_rate, umbral, metodo=envolvente, tam_bloque=tam_bloque)]
+    if frecuencia_trabajo is not None:
+        if silencio_segundos is None:
+            silencio_segundos = SILENCIO_INTRATONO_SEGUNDOS
+        return iterar_tonos_diezmados(data, sample_rate, umbral, silencio_segundos, tam_bloque,
+                                      frecuencia_trabajo)
+    if silencio_segundos is not None:
+        silencio_intratono = max(1, round(silencio_segundos * sample_rate))
+    return iterar_tonos(data, umbral, silencio_intratono, tam_bloque)
+
+# Etapas posteriores a la detección: clasifica los tonos y los traduce.
+# tonos_morse es un array de tonos o los bloques de tonos que devuelve
+# detectar_tonos. Devuelve el número de tonos, la clasificación, el morse
+# escrito (None si no se pide) y el texto.
+def tonos_a_mensaje(tonos_morse, clasificador='global', morse_escrito=True):
+    if clasificador == 'adaptativo':
+        # Clasificamos cada bloque de tonos en cuanto sale del detector, sin
+        # guardar todos los tonos. Las etapas de detección se registran por
+        # separado dentro de esta.
+        with etapa('clasificacion_adaptativa', ('tonos', 'elementos')) as registro:
+            estado = estado_clasificador()
+            bloques = [tonos_morse] if isinstance(tonos_morse, np.ndarray) else tonos_morse
+            partes = []
+            numero_tonos = 0
+            for bloque in bloques:
+                numero_tonos += len(bloque)
+                partes.append(clasificar_tonos(bloque, estado))
+            partes.append(finalizar_clasificacion(estado))
+            tonos_y_silencios_clasificados = np.concatenate(partes)
+            registro['entrada'] = numero_tonos
+            registro['salida'] = len(tonos_y_silencios_clasificados)
+    else:
+        tonos_morse = unir_tonos(tonos_morse)
+        numero_tonos = len(tonos_morse)
+        if numero_tonos:
+            tonos_y_silencios_clasificados = medir_etapa(
+                'clasificacion_tonos_y_silencios', ('tonos', 'elementos'),
+                clasificacion_tonos_y_silencios, tonos_morse)
+    if not numero_tonos:
+        raise ValueError('No se han detectado tonos en la pista')
+    mensaje = None
+    if morse_escrito:
+        mensaje = medir_etapa('a_morse_escrito', ('elementos', 'caracteres'), a_morse_escrito,
+                              tonos_y_silencios_clasificados)
+    traduccion = medir_etapa('tonos_a_latino', ('elementos', 'caracteres'), tonos_a_latino,
+                             tonos_y_silencios_clasificados)
+    return numero_tonos, tonos_y_silencios_clasificados, mensaje, traduccion
+
+# Alias en inglés para integraciones externas.
+decode = decodificar
+
+###### DECODIFICACIÓN MULTICANAL ######
+
+# Algunas grabaciones llevan un transmisor distinto en cada canal (4 a 8
+# receptores grabados a la vez). En lugar de decodificar cada canal por
+# separado, con una lectura y una pasada por canal, trabajamos sobre el
+# bloque completo (muestras x canales): el umbral y la detección de flancos
+# se calculan para todos los canales en la misma operación de NumPy y solo
+# la fusión de pulsos en tonos, que maneja unos pocos pulsos por bloque, se
+# hace canal a canal.
+
+# Versión de onda_a_pulsos_incremental para un bloque de varios canales, con
+# un estado por canal. Devuelve una lista con los pulsos de cada canal.
+def onda_a_pulsos_multicanal(bloque, estados, umbral=UMBRAL):
+    if len(bloque) == 0:
+        return [np.empty(0, dtype=TIPO_TONO) for _ in estados]
+
+    actividad = actividad_umbral(bloque, umbral)
+    for estado, activo in zip(estados, actividad[0]):
+        if estado['activo'] is None:
+            estado['activo'] = bool(activo)
+
+    # Anteponemos la fila con la actividad final del bloque anterior y
+    # calculamos los flancos de todos los canales a la vez. Trasponemos a una
+    # fila por canal (contigua en memoria) para que los flancos salgan
+    # ordenados por canal y, dentro de cada canal, por posición; buscarlos
+    # en el array aplanado es bastante más rápido que con np.nonzero en 2-D.
+    previo = np.array([[estado['activo'] for estado in estados]])
+    cambios = np.diff(np.concatenate((previo, actividad)).T.astype(np.int8, order='C'), axis=1)
+    canales_inicio, inicios = np.divmod(np.flatnonzero(cambios == 1), len(bloque))
+    canales_final, finales = np.divmod(np.flatnonzero(cambios == -1), len(bloque))
+    separadores = np.arange(1, len(estados))
+    inicios = np.split(inicios, np.searchsorted(canales_inicio, separadores))
+    finales = np.split(finales, np.searchsorted(canales_final, separadores))
+
+    return [pulsos_de_cambios(i, f, bool(activo), len(bloque), estado)
+            for i, f, activo, estado in zip(inicios, finales, actividad[-1], estados)]
+
+# Número total de pulsos o tonos de una lista con un array por canal.
+def contar_canales(por_canal):
+    return sum(map(len, por_canal))
+
+# Equivalente a onda_a_tonos para cada columna de data. Devuelve una lista
+# con los tonos de cada canal.
+def onda_a_tonos_multicanal(data, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO,
+                            tam_bloque=TAM_BLOQUE):
+    estados = [estado_inicial() for _ in range(data.shape[1])]
+    bloques = [[] for _ in estados]
+    for i in range(0, len(data), tam_bloque):
+        pulsos = medir_etapa('onda_a_pulsos', ('muestras', 'pulsos'), onda_a_pulsos_multicanal,
+                             data[i:i + tam_bloque], estados, umbral,
+                             contar_entrada=np.size, contar_salida=contar_canales)
+        with etapa('pulsos_a_tonos', ('pulsos', 'tonos')) as registro:
+            tonos = [pulsos_a_tonos_incremental(pulsos_canal, estado, silencio_intratono)
+                     for pulsos_canal, estado in zip(pulsos, estados)]
+            registro['entrada'] = contar_canales(pulsos)
+            registro['salida'] = contar_canales(tonos)
+        for bloques_canal, tonos_canal in zip(bloques, tonos):
+            bloques_canal.append(tonos_canal)
+
+    # Cada canal se cierra con el indicador de final, como en iterar_tonos.
+    for bloques_canal, estado in zip(bloques, estados):
+        pulsos = onda_a_pulsos_incremental(INDICADOR, estado, umbral)
+        bloques_canal.append(pulsos_a_tonos_incremental(pulsos, estado, silencio_intratono, True))
+    return [unir_tonos(bloques_canal) for bloques_canal in bloques]
+
+# Equivalente a onda_a_tonos_envolvente para cada columna de data: la
+# envolvente y su umbral también se calculan para todos los canales a la vez.
+def onda_a_tonos_envolvente_multicanal(data, sample_rate, umbral=UMBRAL, ventana=VENTANA_ENVOLVENTE,
+                                       silencio=SILENCIO_ENVOLVENTE, metodo='rms', tam_bloque=TAM_BLOQUE):
+    env, n = envolvente(data, sample_rate, ventana, metodo, tam_bloque)
+    silencio_ventanas = max(1, round(silencio * sample_rate / n))
+    estados = [estado_inicial() for _ in range(data.shape[1])]
+    pulsos = onda_a_pulsos_multicanal(env, estados, umbral)
+    return [unir_pulsos_envolvente(pulsos_canal, estado, len(env), n, silencio_ventanas)
+            for pulsos_canal, estado in zip(pulsos, estados)]
+
+# Como decodificar, pero con todos los canales de la pista. Devuelve una
+# lista con un resultado por canal, con su índice en 'canal'; los canales
+# sin tonos llevan el motivo en 'error' en lugar de interrumpir al resto,
+# como en banco_filtros_morse.
+def decodificar_multicanal(fuente, sample_rate=None, umbral=UMBRAL, silencio_intratono=SILENCIO_INTRATONO,
+                           tam_bloque=TAM_BLOQUE, envolvente=None, morse_escrito=True, verboso=False,
+                           clasificador='global'):
+    if clasificador not in ('global', 'adaptativo'):
+        raise ValueError(f'Clasificador desconocido: {clasificador}')
+    with verbosidad(verboso):
+        # Una sola lectura (proyectada en memoria) con todos los canales.
+        if isinstance(fuente, (str, os.PathLike)):
+            sample_rate, data = medir_etapa('carga_audio', ('bytes', 'muestras'), leer_wav, fuente,
+                                            mmap=True, contar_entrada=os.path.getsize,
+                                            contar_salida=contar_muestras)
+        elif sample_rate is None:
+            raise ValueError('sample_rate es obligatorio si la fuente es un array')
+        else:
+            data = np.asarray(fuente)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        informar(f'{data.shape[1]} CHANNELS DETECTED.')
+
+        if envolvente is None:
+            tonos = onda_a_tonos_multicanal(data, umbral, silencio_intratono, tam_bloque)
+        else:
+            tonos = medir_etapa('envolvente', ('muestras', 'tonos'), onda_a_tonos_envolvente_multicanal,
+                                data, sample_rate, umbral, metodo=envolvente, tam_bloque=tam_bloque,
+                                contar_entrada=np.size, contar_salida=contar_canales)
+
+        resultados = []
+        for canal, tonos_canal in enumerate(tonos):
+            resultado = {'canal': canal}
+            try:
+                numero_tonos, _, mensaje, traduccion = tonos_a_mensaje(tonos_canal, clasificador, morse_escrito)
+                resultado.update(morse=mensaje, texto=traduccion, tonos=numero_tonos)
+                informar(f'Canal {canal}: {numero_tonos} pulsos')
+            except ValueError as error:
+                resultado['error'] = str(error)
+            resultado.update(sample_rate=sample_rate, duracion=round(len(data) / sample_rate, 4))
+            resultados.append(resultado)
+    return resultados
+
+
+###### LÍNEA DE COMANDOS ######
+
+# Modo original: pide la ruta por teclado, decodifica la pista completa en
+# memoria mostrando cada etapa y termina con la gráfica en una ventana.
+def modo_interactivo():
+    ruta_archivo = pedir_ruta()
+    with instrumentacion() as metricas:
+        data, duracion, ruta_archivo = medir_etapa('carga_audio', ('archivos', 'muestras'), carga_audio,
+                                                   ruta_archivo, contar_entrada=contar_uno,
+                                                   contar_salida=contar_muestras_pista)
+        data = medir_etapa('normalizar_codificacion', ('muestras', 'muestras'), normalizar_codificacion, data)
+        pulsos = medir_etapa('onda_a_pulsos', ('muestras', 'pulsos'), onda_a_pulsos, data)
+        tonos_morse = medir_etapa('pulsos_a_tonos', ('pulsos', 'tonos'), pulsos_a_tonos, pulsos)
+        tonos_y_silencios_clasificados = medir_etapa(
+            'clasificacion_tonos_y_silencios', ('tonos', 'elementos'),
+            clasificacion_tonos_y_silencios, tonos_morse)
+        mensaje = medir_etapa('a_morse_escrito', ('elementos', 'caracteres'), a_morse_escrito,
+                              tonos_y_silencios_clasificados)
+        traduccion = medir_etapa('morse_a_latino', ('caracteres', 'caracteres'), morse_a_latino, mensaje)
+    informar()
+    informar(resumen_metricas(metricas))
+    # La gráfica se muestra al final, con los tonos y pausas detectados.
+    representacion_grafica(duracion, data, ruta_archivo, tonos=tonos_morse,
+                           tonos_y_silencios_clasificados=tonos_y_silencios_clasificados)
+
+# Decodifica un archivo de la línea de comandos ('-' es un WAV por stdin)
+# sin interacción ni ventanas. Como en lote_morse, un error se devuelve en
+# el resultado en lugar de interrumpir el resto de archivos.
+def decodificar_entrada(ruta_archivo, parametros, metricas=False):
+    instrumentos = instrumentacion() if metricas else contextlib.nullcontext()
+    with instrumentos as registro:
+        try:
+            if ruta_archivo == '-':
+                sample_rate, data = medir_etapa('carga_audio', ('bytes', 'muestras'), leer_wav_bytes,
+                                                sys.stdin.buffer.read(), contar_entrada=len,
+                                                contar_salida=contar_muestras)
+                resultado = decodificar(data, sample_rate, **parametros)
+            else:
+                resultado = decodificar(ruta_archivo, **parametros)
+        except (OSError, ValueError) as error:
+            resultado = {'error': f'{type(error).__name__}: {error}'}
+    if metricas:
+        resultado['metricas'] = registro['etapas']
+    return dict(resultado, ruta=ruta_archivo)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Traduce pistas de audio en morse a texto. Sin archivos, pide la ruta y muestra la onda.')
+    parser.add_argument('archivos', nargs='*', help="pistas WAV ('-' para leer un WAV por stdin)")
+    parser.add_argument('--json', action='store_true', help='un resultado JSON por línea en lugar del texto')
+    parser.add_argument('--morse', action='store_true', help='escribir también el morse')
+    parser.add_argument('--posiciones', action='store_true',
+                        help='escribir también el inicio y el final de cada carácter, en segundos')
+    parser.add_argument('--umbral', type=float, default=UMBRAL)
+    parser.add_argument('--silencio-intratono', type=int, default=SILENCIO_INTRATONO)
+    parser.add_argument('--silencio-segundos', type=float,
+                        help='silencio intratono en segundos (sustituye a --silencio-intratono)')
+    parser.add_argument('--frecuencia-trabajo', type=float, metavar='HZ',
+                        help='diezmar la pista a esta frecuencia antes de detectar los tonos')
+    parser.add_argument('--envolvente', choices=('rms', 'pico'),
+                        help='detectar los tonos sobre la envolvente en lugar de muestra a muestra')
+    parser.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global')
+    parser.add_argument('--tam-bloque', type=int, default=TAM_BLOQUE)
+    parser.add_argument('--motor', choices=MOTORES, default=MOTOR,
+                        help='motor de la detección de tonos (numba es opcional y compila en la primera llamada)')
+    parser.add_argument('--graficas', metavar='DIRECTORIO',
+                        help='guardar en este directorio un PNG por archivo (importa matplotlib)')
+    parser.add_argument('--metricas', action='store_true', help='tiempos y memoria por etapa (en stderr)')
+    parser.add_argument('-v', '--verboso', action='store_true', help='detalles de cada etapa (en stderr)')
+    args = parser.parse_args(argv)
+
+    if not args.archivos:
+        modo_interactivo()
+        return 0
+
+    parametros = {'umbral': args.umbral, 'silencio_intratono': args.silencio_intratono,
+                  'silencio_segundos': args.silencio_segundos, 'frecuencia_trabajo': args.frecuencia_trabajo,
+                  'envolvente': args.envolvente, 'clasificador': args.clasificador,
+                  'tam_bloque': args.tam_bloque, 'morse_escrito': args.morse, 'verboso': args.verboso,
+                  'posiciones': args.posiciones, 'motor': args.motor}
+    if args.graficas is not None:
+        os.makedirs(args.graficas, exist_ok=True)
+    errores = 0
+    for ruta_archivo in args.archivos:
+        if args.graficas is not None:
+            nombre = 'stdin' if ruta_archivo == '-' else ruta_archivo.replace(os.sep, '_').strip('_.')
+            parametros['grafica'] = os.path.join(args.graficas, nombre + '.png')
+        # Los mensajes de las etapas van a stderr para no mezclarse con la
+        # transcripción.
+        with contextlib.redirect_stdout(sys.stderr):
+            resultado = decodificar_entrada(ruta_archivo, parametros, args.metricas)
+        errores += 'error' in resultado
+        if 'posiciones' in resultado:
+            resultado['posiciones'] = resultado['posiciones'].tolist()
+        if args.json:
+            print(json.dumps(resultado, ensure_ascii=False), flush=True)
+            continue
+        if 'error' in resultado:
+            print(f"{ruta_archivo}: {resultado['error']}", file=sys.stderr)
+            continue
+        if args.metricas:
+            print(resumen_metricas({'etapas': resultado['metricas']}), file=sys.stderr)
+        prefijo = f'{ruta_archivo}\t' if len(args.archivos) > 1 else ''
+        if args.morse:
+            print(prefijo + resultado['morse'])
+        print(prefijo + resultado['texto'].rstrip(), flush=True)
+        if args.posiciones:
+            # Una línea por carácter (sin los espacios): inicio, final y carácter.
+            for caracter, (inicio, fin) in zip(resultado['texto'], resultado['posiciones']):
+                if caracter != ' ':
+                    print(f"{prefijo}{inicio / resultado['sample_rate']:.3f}\t"
+                          f"{fin / resultado['sample_rate']:.3f}\t{caracter}")
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de búsqueda sobre archivos de grabaciones ya decodificadas.
+
+Guarda en una base SQLite el texto de cada archivo y dónde empieza y acaba
+cada uno de sus caracteres (ver dm.posiciones_caracteres), con un índice de
+trigramas (FTS5) sobre los textos. Buscar un indicativo o cualquier
+fragmento en miles de archivos cuesta milisegundos y devuelve el archivo y
+el segundo en que aparece, sin volver a decodificar el audio.
+
+Uso: python indice_morse.py indexar DIRECTORIO [--indice morse.db] [-j PROCESOS]
+     python indice_morse.py buscar EA1ABC [--indice morse.db] [--limite 100] [--json]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import cache_morse as cm
+import decodificador_morse_v2 as dm
+import lote_morse as lm
+
+# Base de datos por defecto, en el directorio actual.
+INDICE = 'morse.db'
+
+# Resultados que devuelve una búsqueda como mucho.
+LIMITE = 100
+
+# Caracteres de texto que se muestran a cada lado de cada coincidencia.
+CONTEXTO = 20
+
+###### BASE DE DATOS ######
+
+# Cada archivo guarda su tamaño y fecha de modificación, para indexar de
+# nuevo solo los que cambian, y las posiciones de sus caracteres como un
+# array de TIPO_TONO en bytes (el mismo formato que los tonos de la caché).
+# El texto va en una tabla FTS5 con el tokenizador de trigramas, que sirve
+# para buscar cualquier fragmento de tres o más caracteres con LIKE sin
+# recorrer todos los textos. Si SQLite no tiene FTS5 el texto va en una
+# tabla normal y las búsquedas la recorren entera.
+def abrir_indice(ruta_indice=INDICE):
+    conexion = sqlite3.connect(ruta_indice)
+    conexion.execute('''CREATE TABLE IF NOT EXISTS archivos (
+                            id INTEGER PRIMARY KEY,
+                            ruta TEXT UNIQUE NOT NULL,
+                            tamano INTEGER NOT NULL,
+                            modificado REAL NOT NULL,
+                            sample_rate INTEGER NOT NULL,
+                            posiciones BLOB NOT NULL)''')
+    try:
+        conexion.execute("CREATE VIRTUAL TABLE IF NOT EXISTS textos USING fts5(texto, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        conexion.execute('CREATE TABLE IF NOT EXISTS textos (texto TEXT NOT NULL)')
+    return conexion
+
+# Tamaño y fecha de modificación de un archivo, para saber si ha cambiado.
+def huella(ruta_archivo):
+    informacion = os.stat(ruta_archivo)
+    return informacion.st_size, informacion.st_mtime
+
+# Sustituye la entrada de un archivo (su id es también el rowid de su texto).
+def guardar(conexion, ruta_archivo, resultado, tamano, modificado):
+    borrar(conexion, ruta_archivo)
+    posiciones = resultado['posiciones'].astype(cm.TIPO_TONO_ARCHIVO).tobytes()
+    cursor = conexion.execute('INSERT INTO archivos (ruta, tamano, modificado, sample_rate, posiciones) '
+                              'VALUES (?, ?, ?, ?, ?)',
+                              (ruta_archivo, tamano, modificado, resultado['sample_rate'], posiciones))
+    conexion.execute('INSERT INTO textos (rowid, texto) VALUES (?, ?)', (cursor.lastrowid, resultado['texto']))
+
+def borrar(conexion, ruta_archivo):
+    fila = conexion.execute('SELECT id FROM archivos WHERE ruta = ?', (ruta_archivo,)).fetchone()
+    if fila is not None:
+        conexion.execute('DELETE FROM textos WHERE rowid = ?', fila)
+        conexion.execute('DELETE FROM archivos WHERE id = ?', fila)
+
+###### INDEXADO ######
+
+# Decodifica e indexa los archivos que no están en el índice o han cambiado
+# desde que se indexaron, repartidos entre varios procesos como en
+# lote_morse. Un archivo que falla se anota en el progreso y se deja fuera
+# del índice (y se vuelve a intentar la próxima vez). Devuelve el número de
+# archivos indexados y de errores.
+def indexar(archivos, ruta_indice=INDICE, procesos=None, parametros=None, progreso=sys.stderr):
+    parametros = dict(parametros or {}, posiciones=True, morse_escrito=False)
+    conexion = abrir_indice(ruta_indice)
+    conocidos = {ruta: (tamano, modificado) for ruta, tamano, modificado
+                 in conexion.execute('SELECT ruta, tamano, modificado FROM archivos')}
+    pendientes = {}
+    for ruta_archivo in archivos:
+        ruta_archivo = os.path.abspath(ruta_archivo)
+        if conocidos.get(ruta_archivo) != huella(ruta_archivo):
+            pendientes[ruta_archivo] = huella(ruta_archivo)
+
+    indexados = errores = 0
+    with conexion, ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = {pool.submit(lm.decodificar_archivo, ruta, parametros): ruta for ruta in pendientes}
+        for hechos, futuro in enumerate(as_completed(futuros), start=1):
+            ruta_archivo = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as error:
+                resultado = {'error': f'{type(error).__name__}: {error}'}
+            if 'error' in resultado:
+                errores += 1
+                estado = f"ERROR {resultado['error']}"
+            else:
+                guardar(conexion, ruta_archivo, resultado, *pendientes[ruta_archivo])
+                indexados += 1
+                estado = 'OK'
+            if progreso is not None:
+                print(f'[{hechos}/{len(pendientes)}] {ruta_archivo} {estado}', file=progreso)
+    conexion.close()
+    return indexados, errores
+
+###### BÚSQUEDA ######
+
+# Busca un fragmento de texto (sin distinguir mayúsculas) en todos los
+# archivos del índice. Devuelve una lista con un resultado por aparición,
+# con la ruta, el inicio y el final en segundos y el texto alrededor, en
+# orden de archivo y de posición, con como mucho limite resultados.
+def buscar(consulta, ruta_indice=INDICE, limite=LIMITE, contexto=CONTEXTO):
+    consulta = consulta.upper()
+    # Los comodines de LIKE no están en el alfabeto morse, así que no
+    # pueden aparecer en ningún texto. Con ESCAPE para escaparlos SQLite
+    # deja de usar el índice de trigramas y recorre todos los textos.
+    if not consulta or '%' in consulta or '_' in consulta:
+        return []
+    conexion = abrir_indice(ruta_indice)
+    filas = conexion.execute('SELECT rowid, texto FROM textos WHERE texto LIKE ? ORDER BY rowid',
+                             ('%' + consulta + '%',))
+    resultados = []
+    for identificador, texto in filas:
+        ruta_archivo, sample_rate, posiciones = conexion.execute(
+            'SELECT ruta, sample_rate, posiciones FROM archivos WHERE id = ?', (identificador,)).fetchone()
+        posiciones = np.frombuffer(posiciones, dtype=cm.TIPO_TONO_ARCHIVO)
+        # LIKE no distingue mayúsculas en letras acentuadas como É; las
+        # apariciones se buscan otra vez en el texto, que ya está en mayúsculas.
+        inicio = texto.find(consulta)
+        while inicio >= 0 and len(resultados) < limite:
+            fin = inicio + len(consulta) - 1
+            resultados.append({
+                'ruta': ruta_archivo,
+                'inicio': round(float(posiciones['inicio'][inicio]) / sample_rate, 3),
+                'fin': round(float(posiciones['fin'][fin]) / sample_rate, 3),
+                'contexto': texto[max(0, inicio - contexto):fin + 1 + contexto],
+            })
+            inicio = texto.find(consulta, inicio + 1)
+        if len(resultados) >= limite:
+            break
+    conexion.close()
+    return resultados
+
+# Segundos como h:mm:ss.s, para localizar la aparición en un reproductor.
+def formato_tiempo(segundos):
+    minutos, segundos = divmod(segundos, 60)
+    horas, minutos = divmod(int(minutos), 60)
+    return f'{horas}:{minutos:02d}:{segundos:04.1f}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Índice de búsqueda sobre grabaciones en morse decodificadas.')
+    parser.add_argument('--indice', default=INDICE, help='base de datos SQLite del índice')
+    ordenes = parser.add_subparsers(dest='orden', required=True)
+
+    indexado = ordenes.add_parser('indexar', help='decodificar e indexar los archivos nuevos o modificados')
+    indexado.add_argument('directorio')
+    indexado.add_argument('--patron', default='*.wav')
+    indexado.add_argument('-j', '--procesos', type=int, default=os.cpu_count())
+    indexado.add_argument('--umbral', type=float, default=dm.UMBRAL)
+    indexado.add_argument('--frecuencia-trabajo', type=float, metavar='HZ',
+                          help='diezmar las pistas a esta frecuencia antes de detectar los tonos')
+    indexado.add_argument('--envolvente', choices=('rms', 'pico'))
+    indexado.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global')
+    indexado.add_argument('-q', '--silencioso', action='store_true', help='no mostrar el progreso')
+
+    busqueda = ordenes.add_parser('buscar', help='buscar un fragmento de texto en todos los archivos')
+    busqueda.add_argument('consulta')
+    busqueda.add_argument('--limite', type=int, default=LIMITE)
+    busqueda.add_argument('--json', action='store_true', help='un resultado JSON por línea')
+    args = parser.parse_args(argv)
+
+    if args.orden == 'indexar':
+        parametros = {'umbral': args.umbral, 'frecuencia_trabajo': args.frecuencia_trabajo,
+                      'envolvente': args.envolvente, 'clasificador': args.clasificador}
+        indexados, errores = indexar(lm.buscar_archivos(args.directorio, args.patron), args.indice,
+                                     args.procesos, parametros, None if args.silencioso else sys.stderr)
+        print(f'{indexados} archivos indexados, {errores} errores', file=sys.stderr)
+        return 1 if errores else 0
+
+    for resultado in buscar(args.consulta, args.indice, args.limite):
+        if args.json:
+            print(json.dumps(resultado, ensure_ascii=False))
+        else:
+            print(f"{resultado['ruta']}\t{formato_tiempo(resultado['inicio'])}\t{resultado['contexto']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
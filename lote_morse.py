@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Decodificación por lotes de directorios completos de pistas en morse.
+
+Reparte los archivos entre varios procesos y escribe un resultado por línea
+en formato JSONL. Un archivo que falla se anota con su error y no detiene
+el resto del lote.
+
+Uso: python lote_morse.py DIRECTORIO [-o salida.jsonl] [-j PROCESOS]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import cache_morse as cm
+import decodificador_morse_v2 as dm
+
+###### BÚSQUEDA DE ARCHIVOS ######
+
+def buscar_archivos(directorio, patron='*.wav'):
+    return sorted(str(ruta) for ruta in Path(directorio).rglob(patron) if ruta.is_file())
+
+###### TRABAJO DE CADA PROCESO ######
+
+# Cada archivo se decodifica en un proceso del pool. Cualquier excepción se
+# captura y se devuelve como parte del resultado para aislar los fallos.
+# Con metricas=True se añaden las métricas por etapa de dm.instrumentacion
+# y con graficas (un directorio) se guarda allí la onda de cada archivo con
+# los tonos y pausas detectados, para revisar el lote sin abrir el audio.
+# Con cache (un directorio) se usa cm.decodificar_con_cache; el tamaño
+# máximo de la caché puede ir en parametros como tamano_maximo. Con
+# multicanal=True en parametros se decodifican todos los canales del archivo
+# con dm.decodificar_multicanal y el resultado lleva la lista en 'canales'
+# (sin caché ni gráficas, que son de un solo canal).
+def decodificar_archivo(ruta_archivo, parametros, metricas=False, graficas=None, cache=None):
+    inicio = time.perf_counter()
+    parametros = dict(parametros)
+    multicanal = parametros.pop('multicanal', False)
+    if multicanal:
+        graficas = cache = None
+        parametros.pop('tamano_maximo', None)
+    if graficas is not None:
+        nombre = ruta_archivo.replace(os.sep, '_').strip('_.')
+        parametros = dict(parametros, grafica=os.path.join(graficas, nombre + '.png'))
+    instrumentacion = dm.instrumentacion() if metricas else contextlib.nullcontext()
+    with instrumentacion as registro:
+        try:
+            if multicanal:
+                resultado = {'canales': dm.decodificar_multicanal(ruta_archivo, **parametros)}
+            elif cache is None:
+                resultado = dm.decodificar(ruta_archivo, **parametros)
+            else:
+                resultado = cm.decodificar_con_cache(ruta_archivo, directorio=cache, **parametros)
+        except Exception as error:
+            resultado = {'error': f'{type(error).__name__}: {error}'}
+    if metricas:
+        resultado['metricas'] = registro['etapas']
+    resultado['ruta'] = ruta_archivo
+    resultado['segundos'] = round(time.perf_counter() - inicio, 4)
+    return resultado
+
+###### LOTE ######
+
+# Decodifica todos los archivos y escribe cada resultado en cuanto está
+# disponible (en orden de finalización). Devuelve el número de errores.
+def decodificar_lote(archivos, salida, procesos=None, parametros=None, progreso=sys.stderr, metricas=False,
+                     graficas=None, cache=None):
+    parametros = parametros or {}
+    total = len(archivos)
+    errores = 0
+    if graficas is not None:
+        os.makedirs(graficas, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = {pool.submit(decodificar_archivo, ruta, parametros, metricas, graficas, cache): ruta
+                   for ruta in archivos}
+        for hechos, futuro in enumerate(as_completed(futuros), start=1):
+            ruta_archivo = futuros[futuro]
+            # Si el proceso muere (por ejemplo, sin memoria) el futuro lanza
+            # la excepción aquí; la anotamos como error del archivo.
+            try:
+                resultado = futuro.result()
+            except Exception as error:
+                resultado = {'ruta': ruta_archivo, 'error': f'{type(error).__name__}: {error}'}
+
+            if 'error' in resultado:
+                errores += 1
+                estado = f"ERROR {resultado['error']}"
+            else:
+                estado = f"OK {resultado['segundos']}s"
+            salida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            salida.flush()
+            if progreso is not None:
+                print(f'[{hechos}/{total}] {ruta_archivo} {estado}', file=progreso)
+    return errores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decodifica en paralelo todas las pistas de un directorio.')
+    parser.add_argument('directorio')
+    parser.add_argument('-o', '--salida', default='-', help='archivo JSONL de salida (- para stdout)')
+    parser.add_argument('-j', '--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--patron', default='*.wav')
+    parser.add_argument('--umbral', type=float, default=dm.UMBRAL)
+    parser.add_argument('--silencio-intratono', type=int, default=dm.SILENCIO_INTRATONO)
+    parser.add_argument('--frecuencia-trabajo', type=float, metavar='HZ',
+                        help='diezmar las pistas a esta frecuencia antes de detectar los tonos')
+    parser.add_argument('--silencio-segundos', type=float,
+                        help='silencio intratono en segundos (por defecto '
+                             f'{dm.SILENCIO_INTRATONO_SEGUNDOS} al diezmar; sustituye a --silencio-intratono)')
+    parser.add_argument('--envolvente', choices=('rms', 'pico'),
+                        help='detectar los tonos sobre la envolvente en lugar de muestra a muestra')
+    parser.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global',
+                        help='clasificación de tonos y pausas (adaptativo sigue los cambios de velocidad)')
+    parser.add_argument('--multicanal', action='store_true',
+                        help='decodificar cada canal de los archivos por separado, en una sola pasada')
+    parser.add_argument('--metricas', action='store_true',
+                        help='añadir a cada resultado el tiempo, elementos y memoria de cada etapa')
+    parser.add_argument('--graficas', metavar='DIRECTORIO',
+                        help='guardar en este directorio un PNG por archivo con los tonos detectados')
+    parser.add_argument('--cache', nargs='?', const=cm.DIRECTORIO_CACHE, metavar='DIRECTORIO',
+                        help='reutilizar tonos y resultados de ejecuciones anteriores '
+                             f'(por defecto en {cm.DIRECTORIO_CACHE})')
+    parser.add_argument('--cache-maximo', type=float, default=cm.TAMANO_MAXIMO / 2**20,
+                        help='tamaño máximo de la caché en MiB')
+    parser.add_argument('-q', '--silencioso', action='store_true', help='no mostrar el progreso')
+    args = parser.parse_args(argv)
+
+    archivos = buscar_archivos(args.directorio, args.patron)
+    parametros = {'umbral': args.umbral, 'silencio_intratono': args.silencio_intratono,
+                  'envolvente': args.envolvente, 'clasificador': args.clasificador,
+                  'multicanal': args.multicanal}
+    if args.frecuencia_trabajo is not None or args.silencio_segundos is not None:
+        if args.multicanal:
+            parser.error('--multicanal no admite --frecuencia-trabajo ni --silencio-segundos')
+        parametros.update(frecuencia_trabajo=args.frecuencia_trabajo, silencio_segundos=args.silencio_segundos)
+    if args.cache is not None:
+        parametros['tamano_maximo'] = int(args.cache_maximo * 2**20)
+    progreso = None if args.silencioso else sys.stderr
+
+    if args.salida == '-':
+        errores = decodificar_lote(archivos, sys.stdout, args.procesos, parametros, progreso, args.metricas,
+                                   args.graficas, args.cache)
+    else:
+        with open(args.salida, 'w', encoding='utf-8') as salida:
+            errores = decodificar_lote(archivos, salida, args.procesos, parametros, progreso, args.metricas,
+                                       args.graficas, args.cache)
+    print(f'{len(archivos) - errores} archivos decodificados, {errores} errores', file=sys.stderr)
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Decodificación de una sola grabación larga repartida entre varios núcleos.
+
+La pista se parte en segmentos por silencios largos (un tono nunca cruza un
+corte, así que cada segmento puede recorrerse por separado) y cada proceso
+detecta los tonos de su segmento, con un pequeño margen de solape para que
+los tonos junto a un corte se detecten igual que en la pista completa. La
+clasificación, que necesita la duración del punto de toda la pista, se hace
+después sobre la lista de tonos completa: es la parte barata y así el
+resultado es el mismo que decodificando la pista de principio a fin en un
+solo proceso.
+
+Uso: python paralelo_morse.py archivo.wav [-j PROCESOS] [--segmentos N] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+
+# Los cortes se buscan en una ventana de este radio (en segundos) alrededor
+# de cada punto de corte nominal.
+RADIO_BUSQUEDA = 5
+
+# Silencio mínimo (en segundos) para cortar en él: muy por encima de los
+# huecos que se unen dentro de un tono (unos pocos ms) y del orden de una
+# pausa entre letras a 25 wpm. Se corta en el silencio más largo de la
+# ventana, que normalmente es una pausa entre palabras.
+SILENCIO_CORTE = 0.15
+
+# Pistas o segmentos más cortos que esto (en segundos) no se parten.
+SEGMENTO_MINIMO = 30
+
+# Cada proceso recorre además este margen (en segundos) a cada lado de su
+# segmento. Con ruido, los picos sueltos dentro de un silencio pueden
+# formar pulsos que se unen a través del corte; con el margen, cada tono se
+# detecta con el mismo contexto que en la pista completa y se queda en el
+# segmento en el que empieza.
+MARGEN = 1
+
+###### PUNTOS DE CORTE ######
+
+# Los cortes deben caer en múltiplos de las muestras que el detector agrupa
+# (el factor de diezmado o la ventana de la envolvente) para que cada
+# segmento vea exactamente los mismos grupos que la pista completa.
+def alineacion(sample_rate, envolvente=None, frecuencia_trabajo=None):
+    if envolvente is not None:
+        return max(1, round(dm.VENTANA_ENVOLVENTE * sample_rate))
+    if frecuencia_trabajo is not None:
+        return dm.factor_diezmado(sample_rate, frecuencia_trabajo)
+    return 1
+
+# Busca el silencio más largo en torno a centro y devuelve la muestra de en
+# medio, alineada. El silencio se mide sobre la envolvente RMS, que no se
+# deja engañar por los cruces por cero de la portadora ni por picos de
+# ruido sueltos. Devuelve None si no hay ningún silencio suficiente.
+def buscar_corte(data, sample_rate, centro, umbral=dm.UMBRAL, radio=RADIO_BUSQUEDA, paso=1):
+    inicio = max(0, int(centro - radio * sample_rate))
+    fin = min(len(data), int(centro + radio * sample_rate))
+    env, n = dm.envolvente(data[inicio:fin], sample_rate)
+    if len(env) == 0:
+        return None
+    # Tramos de silencio como en onda_a_pulsos: los cambios de la actividad
+    # con un sonido ficticio a cada lado.
+    cambios = np.diff(np.concatenate(([1], (env > umbral).astype(np.int8), [1])))
+    comienzos = np.flatnonzero(cambios == -1)
+    finales = np.flatnonzero(cambios == 1)
+    if len(comienzos) == 0:
+        return None
+    longitudes = finales - comienzos
+    mayor = int(np.argmax(longitudes))
+    if longitudes[mayor] * n < SILENCIO_CORTE * sample_rate:
+        return None
+    medio = inicio + (comienzos[mayor] + finales[mayor]) * n // 2
+    return medio // paso * paso
+
+# Puntos de corte (incluidos 0 y el final) para repartir la pista en unos
+# segmentos de la misma longitud. Los cortes sin silencio suficiente cerca
+# se omiten y sus segmentos vecinos quedan unidos.
+def puntos_de_corte(data, sample_rate, segmentos, umbral=dm.UMBRAL, paso=1):
+    segmentos = max(1, min(segmentos, int(len(data) / sample_rate // SEGMENTO_MINIMO)))
+    cortes = [0]
+    for k in range(1, segmentos):
+        corte = buscar_corte(data, sample_rate, k * len(data) // segmentos, umbral, paso=paso)
+        if corte is not None and corte > cortes[-1]:
+            cortes.append(corte)
+    cortes.append(len(data))
+    return cortes
+
+def contar_segmentos(cortes):
+    return len(cortes) - 1
+
+###### TRABAJO DE CADA PROCESO ######
+
+# Detecta los tonos de un segmento, con su margen a cada lado, y devuelve
+# los que empiezan dentro del segmento, en posiciones de la pista completa.
+# Cada proceso proyecta el archivo en memoria por su cuenta, así que solo
+# lee del disco su parte.
+def tonos_segmento(ruta_archivo, inicio, fin, parametros, paso=1):
+    sample_rate, data = dm.carga_audio_mmap(ruta_archivo)
+    margen = int(MARGEN * sample_rate) // paso * paso
+    desde = max(0, inicio - margen)
+    hasta = min(len(data), fin + margen)
+    with dm.verbosidad(False):
+        tonos_morse = dm.unir_tonos(dm.detectar_tonos(data[desde:hasta], sample_rate, **parametros))
+    tonos_morse['inicio'] += desde
+    tonos_morse['fin'] += desde
+    dentro = (tonos_morse['inicio'] >= inicio) & (tonos_morse['inicio'] < fin)
+    return tonos_morse[dentro]
+
+###### DECODIFICACIÓN EN PARALELO ######
+
+# Misma interfaz y resultado que dm.decodificar (solo para rutas), con el
+# número de segmentos usados en 'segmentos'. Por defecto se hace un
+# segmento por proceso.
+def decodificar_paralelo(ruta_archivo, procesos=None, segmentos=None, umbral=dm.UMBRAL,
+                         silencio_intratono=dm.SILENCIO_INTRATONO, tam_bloque=dm.TAM_BLOQUE, envolvente=None,
+                         morse_escrito=True, verboso=False, clasificador='global', frecuencia_trabajo=None,
+                         silencio_segundos=None):
+    if clasificador not in ('global', 'adaptativo'):
+        raise ValueError(f'Clasificador desconocido: {clasificador}')
+    procesos = procesos or os.cpu_count()
+    with dm.verbosidad(verboso):
+        sample_rate, data = dm.carga_audio_mmap(ruta_archivo)
+        paso = alineacion(sample_rate, envolvente, frecuencia_trabajo)
+        cortes = dm.medir_etapa('puntos_de_corte', ('muestras', 'segmentos'), puntos_de_corte, data,
+                                sample_rate, segmentos or procesos, umbral, paso,
+                                contar_salida=contar_segmentos)
+        dm.informar(f'{len(cortes) - 1} segmentos en {procesos} procesos')
+
+        parametros = {'umbral': umbral, 'silencio_intratono': silencio_intratono, 'tam_bloque': tam_bloque,
+                      'envolvente': envolvente, 'frecuencia_trabajo': frecuencia_trabajo,
+                      'silencio_segundos': silencio_segundos}
+        with dm.etapa('tonos_en_paralelo', ('muestras', 'tonos')) as registro:
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                futuros = [pool.submit(tonos_segmento, ruta_archivo, inicio, fin, parametros, paso)
+                           for inicio, fin in zip(cortes[:-1], cortes[1:])]
+                # Los segmentos se unen en orden, no según van terminando.
+                tonos_morse = dm.unir_tonos([futuro.result() for futuro in futuros])
+            registro['entrada'] = len(data)
+            registro['salida'] = len(tonos_morse)
+
+        numero_tonos, _, mensaje, traduccion = dm.tonos_a_mensaje(tonos_morse, clasificador, morse_escrito)
+        dm.informar(f'Detectados {numero_tonos} pulsos')
+
+    return {
+        'morse': mensaje,
+        'texto': traduccion,
+        'tonos': numero_tonos,
+        'sample_rate': sample_rate,
+        'duracion': round(len(data) / sample_rate, 4),
+        'segmentos': len(cortes) - 1,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decodifica una grabación larga repartiéndola entre varios núcleos.')
+    parser.add_argument('archivo')
+    parser.add_argument('-j', '--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--segmentos', type=int, help='número de segmentos (por defecto, uno por proceso)')
+    parser.add_argument('--envolvente', choices=('rms', 'pico'),
+                        help='detectar los tonos sobre la envolvente en lugar de muestra a muestra')
+    parser.add_argument('--frecuencia-trabajo', type=float, metavar='HZ',
+                        help='diezmar la pista a esta frecuencia antes de detectar los tonos')
+    parser.add_argument('--clasificador', choices=('global', 'adaptativo'), default='global')
+    parser.add_argument('--secuencial', action='store_true',
+                        help='decodificar también en un solo proceso y comparar tiempos y resultado')
+    parser.add_argument('--json', action='store_true', help='resultado completo en JSON')
+    args = parser.parse_args(argv)
+
+    parametros = {'envolvente': args.envolvente, 'frecuencia_trabajo': args.frecuencia_trabajo,
+                  'clasificador': args.clasificador}
+    inicio = time.perf_counter()
+    resultado = decodificar_paralelo(args.archivo, args.procesos, args.segmentos, **parametros)
+    resultado['segundos'] = round(time.perf_counter() - inicio, 4)
+    if args.secuencial:
+        inicio = time.perf_counter()
+        secuencial = dm.decodificar(args.archivo, **parametros)
+        resultado['segundos_secuencial'] = round(time.perf_counter() - inicio, 4)
+        resultado['igual_que_secuencial'] = secuencial['texto'] == resultado['texto']
+
+    if args.json:
+        print(json.dumps(resultado, ensure_ascii=False))
+    else:
+        print(resultado['texto'])
+    informe = f"{resultado['segmentos']} segmentos, {resultado['segundos']} s"
+    if args.secuencial:
+        informe += (f" (secuencial {resultado['segundos_secuencial']} s, "
+                    f"{resultado['segundos_secuencial'] / resultado['segundos']:.2f}x, "
+                    f"{'mismo' if resultado['igual_que_secuencial'] else 'distinto'} resultado)")
+    print(informe, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Decodificación de WAV que se siguen grabando (como tail -f).
+
+Los grabadores añaden audio al mismo WAV durante horas. En lugar de esperar
+a que se cierre y leerlo entero, se sigue el archivo: cada vez que crece se
+leen solo los frames nuevos, desde el byte en que se quedó la lectura
+anterior, y se decodifican con el estado incremental de tiempo_real_morse
+(pulsos, tonos y clasificador adaptativo). Los caracteres se añaden a un
+archivo de texto según se confirman.
+
+Cada cierto tiempo se guarda un punto de control con ese byte, el estado y
+la longitud del texto ya escrito. Si el proceso se cae o se reinicia,
+continúa desde el último punto de control (recortando lo que se escribió
+después) en lugar de volver a decodificar horas de audio.
+
+Uso: python seguimiento_morse.py grabacion.wav [-o grabacion.wav.txt] [--inactividad 60]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import cache_morse as cm
+import decodificador_morse_v2 as dm
+import tiempo_real_morse as tr
+
+# Segundos entre comprobaciones del tamaño del archivo cuando no ha crecido.
+INTERVALO = 0.5
+
+# Segundos de audio entre puntos de control mientras se recupera el retraso
+# (al alcanzar el final del archivo se guarda siempre uno). Es lo que
+# habría que volver a decodificar tras una caída.
+SEGUNDOS_PUNTO_CONTROL = 60
+
+# Extensiones por defecto del texto y del punto de control, junto al WAV.
+EXTENSION_TEXTO = '.txt'
+EXTENSION_CONTROL = '.control.json'
+
+###### PUNTO DE CONTROL ######
+
+# El punto de control es un JSON con la cabecera del WAV (para reconocer
+# que sigue siendo el mismo archivo), el byte siguiente al último frame
+# decodificado, los bytes ya escritos en el texto y el estado de
+# tiempo_real_morse, que solo contiene enteros, decimales, listas y None.
+def leer_control(ruta_control):
+    try:
+        with open(ruta_control, encoding='utf-8') as archivo:
+            control = json.load(archivo)
+    except FileNotFoundError:
+        return None
+    # JSON devuelve los pares como listas; el detector de pulsos los
+    # necesita como tuplas para convertirlos en arrays de tonos.
+    pulsos = control['estado']['pulsos']
+    for clave in ('pulso_previo', 'nuevo_tono'):
+        if pulsos[clave] is not None:
+            pulsos[clave] = tuple(pulsos[clave])
+    return control
+
+def guardar_control(ruta_control, control):
+    cm.escribir_atomico(os.path.abspath(ruta_control), json.dumps(control).encode())
+
+def misma_cabecera(control, cabecera):
+    return (control['sample_rate'], control['tipo'], control['canales'], control['inicio']) == \
+        (cabecera['sample_rate'], cabecera['tipo'].str, cabecera['canales'], cabecera['inicio'])
+
+###### SEGUIMIENTO ######
+
+# Espera a que el WAV tenga una cabecera completa (el grabador puede no
+# haberla escrito aún) y la devuelve, o None si se agota la inactividad.
+# Si la lectura de la cabecera falla sin llegar al final del archivo, no
+# es que falte por escribir sino que no es un WAV admitido.
+def esperar_cabecera(archivo, intervalo=INTERVALO, inactividad=None):
+    espera = 0
+    while True:
+        archivo.seek(0)
+        cabecera = dm.leer_cabecera_wav(archivo)
+        if cabecera is not None:
+            return cabecera
+        if archivo.tell() < os.fstat(archivo.fileno()).st_size:
+            raise ValueError(f'{archivo.name} no es un WAV en un formato admitido')
+        if inactividad is not None and espera >= inactividad:
+            return None
+        time.sleep(intervalo)
+        espera += intervalo
+
+# Sigue ruta_archivo hasta que pasen inactividad segundos sin que crezca
+# (o indefinidamente si es None), añadiendo los caracteres a ruta_texto y a
+# eco. El tamaño de datos de la cabecera no se usa: mientras se graba suele
+# ser 0 o un valor antiguo, así que los frames disponibles se calculan con
+# el tamaño real del archivo (por eso no se admiten bloques RIFF después de
+# los datos). Con desde_cero=True se ignora el punto de control. La letra
+# que se esté formando al terminar queda en el estado, porque el archivo
+# puede seguir creciendo; con finalizar=True (el grabador ya lo ha cerrado)
+# se emite, como al acabar la fuente en tiempo_real_morse. Devuelve el
+# número de caracteres añadidos.
+def seguir(ruta_archivo, ruta_texto=None, ruta_control=None, intervalo=INTERVALO, inactividad=None,
+           wpm=tr.WPM_INICIAL, desde_cero=False, finalizar=False, eco=sys.stdout):
+    ruta_texto = ruta_texto or ruta_archivo + EXTENSION_TEXTO
+    ruta_control = ruta_control or ruta_archivo + EXTENSION_CONTROL
+    with open(ruta_archivo, 'rb') as archivo:
+        cabecera = esperar_cabecera(archivo, intervalo, inactividad)
+        if cabecera is None:
+            return 0
+        tam_frame = cabecera['tipo'].itemsize * cabecera['canales']
+
+        # Solo se continúa si el archivo es el mismo y no ha encogido; si
+        # no, se empieza desde el principio de los datos.
+        control = None if desde_cero else leer_control(ruta_control)
+        if control is not None and not (misma_cabecera(control, cabecera)
+                                        and os.fstat(archivo.fileno()).st_size >= control['posicion']):
+            dm.informar(f'{ruta_control} no corresponde a {ruta_archivo}: se empieza desde el principio')
+            control = None
+        if control is None:
+            # Sin presupuesto de latencia: cada letra se confirma con la
+            # pausa natural de 2 puntos.
+            control = {'sample_rate': cabecera['sample_rate'], 'tipo': cabecera['tipo'].str,
+                       'canales': cabecera['canales'], 'inicio': cabecera['inicio'],
+                       'posicion': cabecera['inicio'], 'bytes_texto': 0,
+                       'estado': tr.estado_tiempo_real(cabecera['sample_rate'], wpm, float('inf'))}
+        estado = control['estado']
+        anadidos = espera = 0
+        ultimo_control = control['posicion']
+        bytes_punto_control = SEGUNDOS_PUNTO_CONTROL * cabecera['sample_rate'] * tam_frame
+        texto = open(ruta_texto, 'a+b')
+
+        def anadir(caracteres):
+            texto.write(caracteres.encode('utf-8'))
+            if eco is not None:
+                eco.write(caracteres)
+                eco.flush()
+
+        # El texto llega al disco antes que el punto de control que lo
+        # cuenta: tras una caída el texto nunca es más corto de lo anotado.
+        def punto_control():
+            texto.flush()
+            os.fsync(texto.fileno())
+            control['bytes_texto'] = texto.tell()
+            guardar_control(ruta_control, control)
+
+        # Lo que se escribió después del último punto de control se vuelve a
+        # decodificar, así que se recorta para no duplicarlo. truncate no
+        # mueve la posición: sin volver al final, tell() seguiría contando
+        # el texto recortado.
+        with texto:
+            texto.truncate(control['bytes_texto'])
+            texto.seek(0, os.SEEK_END)
+            while True:
+                frames = (os.fstat(archivo.fileno()).st_size - control['posicion']) // tam_frame
+                if frames == 0:
+                    if control['posicion'] != ultimo_control:
+                        punto_control()
+                        ultimo_control = control['posicion']
+                    if inactividad is not None and espera >= inactividad:
+                        break
+                    time.sleep(intervalo)
+                    espera += intervalo
+                    continue
+                espera = 0
+
+                archivo.seek(control['posicion'])
+                crudo = archivo.read(min(frames, dm.TAM_BLOQUE) * tam_frame)
+                bloque = np.frombuffer(crudo, dtype=cabecera['tipo'])
+                if cabecera['canales'] > 1:
+                    bloque = bloque.reshape(-1, cabecera['canales'])[:, 0]
+                caracteres = ''.join(caracter for caracter, _ in tr.procesar_bloque(bloque, estado))
+                anadir(caracteres)
+                anadidos += len(caracteres)
+                control['posicion'] += len(crudo)
+                if control['posicion'] - ultimo_control >= bytes_punto_control:
+                    punto_control()
+                    ultimo_control = control['posicion']
+
+            if finalizar and estado['letra'] > 1:
+                anadir(tr.caracter(estado['letra']))
+                anadidos += 1
+                estado['letra'] = 1
+            punto_control()
+    return anadidos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decodifica un WAV en morse mientras se sigue grabando.')
+    parser.add_argument('archivo')
+    parser.add_argument('-o', '--salida', help=f'texto al que se añaden los caracteres (por defecto, '
+                                                f'el WAV con {EXTENSION_TEXTO})')
+    parser.add_argument('--control', help=f'punto de control (por defecto, el WAV con {EXTENSION_CONTROL})')
+    parser.add_argument('--intervalo', type=float, default=INTERVALO,
+                        help='segundos entre comprobaciones del tamaño del archivo')
+    parser.add_argument('--inactividad', type=float,
+                        help='terminar tras estos segundos sin que el archivo crezca (por defecto, nunca)')
+    parser.add_argument('--wpm', type=float, default=tr.WPM_INICIAL, help='velocidad inicial supuesta')
+    parser.add_argument('--desde-cero', action='store_true', help='ignorar el punto de control')
+    parser.add_argument('--finalizar', action='store_true',
+                        help='el archivo ya está cerrado: emitir también la letra pendiente al terminar')
+    parser.add_argument('-q', '--silencioso', action='store_true', help='no escribir el texto en stdout')
+    args = parser.parse_args(argv)
+
+    try:
+        seguir(args.archivo, args.salida, args.control, args.intervalo, args.inactividad, args.wpm,
+               args.desde_cero, args.finalizar, None if args.silencioso else sys.stdout)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        # El último punto de control sigue siendo válido: al volver a
+        # lanzarlo se continúa desde ahí.
+        return 130
+    if not args.silencioso:
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+Servicio local de decodificación: un servidor HTTP con asyncio que mantiene
+un pool de procesos ya arrancado, de modo que cada petición no paga el
+arranque del intérprete ni la importación de numpy y scipy.
+
+    POST /decodificar            cuerpo: el WAV a decodificar
+    POST /decodificar?ruta=...   decodifica un archivo local, sin cuerpo
+    GET  /salud                  estado del servicio en JSON
+    GET  /metricas               métricas en formato de texto de Prometheus
+
+Los parámetros de la decodificación van en la query (umbral, envolvente,
+clasificador, frecuencia_trabajo...). La respuesta es un flujo JSONL: un
+aviso al entrar en cola y al empezar, transcripciones parciales cada
+SEGUNDOS_PARCIAL segundos de audio y el resultado final. Si ya hay
+demasiados trabajos pendientes la petición se rechaza con 503 y
+Retry-After, sin leer el cuerpo, para que los clientes esperen en lugar de
+acumular audio en memoria.
+
+Uso: python servicio_morse.py [--puerto 8765 | --socket /tmp/morse.sock] [-j PROCESOS]
+"""
+import argparse
+import asyncio
+import collections
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+
+PUERTO = 8765
+
+# Trabajos que pueden esperar en cola además de los que ya están en un
+# proceso. Por encima se responde 503.
+COLA_MAXIMA = 16
+
+# Tamaño máximo del WAV subido, en bytes.
+TAMANO_MAXIMO_SUBIDA = 512 * 2**20
+
+# Segundos de audio entre dos transcripciones parciales.
+SEGUNDOS_PARCIAL = 10
+
+# Latencias que se guardan para calcular los percentiles de /salud.
+LATENCIAS_GUARDADAS = 1000
+
+# Bytes que se leen del cuerpo a la vez.
+TAM_LECTURA = 2**16
+
+# Parámetros admitidos en la query y su conversión.
+PARAMETROS = {
+    'umbral': float,
+    'silencio_intratono': int,
+    'silencio_segundos': float,
+    'frecuencia_trabajo': float,
+    'envolvente': str,
+    'clasificador': str,
+}
+
+###### TRABAJO DE CADA PROCESO ######
+
+# Cola (de multiprocessing) por la que los procesos envían los avisos de
+# cada trabajo. Se fija al arrancar cada proceso del pool.
+COLA_AVISOS = None
+
+def iniciar_trabajador(cola):
+    global COLA_AVISOS
+    COLA_AVISOS = cola
+
+# Decodifica como dm.decodificar, enviando por el camino transcripciones
+# parciales. Las parciales usan el clasificador adaptativo, que no necesita
+# todos los tonos; el resultado final usa el clasificador pedido.
+def decodificar_con_parciales(ruta_archivo, parametros, avisar, cada=SEGUNDOS_PARCIAL):
+    parametros = dict(parametros)
+    clasificador = parametros.pop('clasificador', 'global')
+    if clasificador not in ('global', 'adaptativo'):
+        raise ValueError(f'Clasificador desconocido: {clasificador}')
+    sample_rate, data = dm.cargar_fuente(ruta_archivo)
+    estado = dm.estado_clasificador()
+    tonos_morse = []
+    tonos_y_silencios_clasificados = []
+    siguiente = cada * sample_rate
+    for tonos in dm.detectar_tonos(data, sample_rate, **parametros):
+        tonos_morse.append(tonos)
+        # El detector entrega los tonos por bloques: partimos cada bloque
+        # detrás del primer tono que pasa de siguiente, para avisar en ese
+        # tono como si llegaran de uno en uno.
+        while len(tonos):
+            corte = int(np.searchsorted(tonos['fin'], siguiente))
+            tonos_y_silencios_clasificados.append(dm.clasificar_tonos(tonos[:corte + 1], estado))
+            if corte >= len(tonos):
+                break
+            fin = int(tonos['fin'][corte])
+            tonos = tonos[corte + 1:]
+            # La última letra sigue abierta (puede faltarle algún tono), así
+            # que el parcial llega hasta la última pausa entre letras o
+            # palabras y el resto espera al siguiente parcial o al final.
+            clasificados = np.concatenate(tonos_y_silencios_clasificados)
+            cierres = np.flatnonzero(clasificados['clase'] >= dm.PAUSA_MEDIA)
+            if len(cierres):
+                avisar({'parcial': dm.tonos_a_latino(clasificados[:cierres[-1]]),
+                        'segundos': round(fin / sample_rate, 2)})
+                siguiente = fin + cada * sample_rate
+
+    numero_tonos, _, mensaje, traduccion = dm.tonos_a_mensaje(tonos_morse, clasificador)
+    return {
+        'morse': mensaje,
+        'texto': traduccion,
+        'tonos': numero_tonos,
+        'sample_rate': sample_rate,
+        'duracion': round(len(data) / sample_rate, 4),
+    }
+
+# Lo que ejecuta el pool. Devuelve el resultado y las métricas por etapa
+# del trabajo, que el servicio acumula para /metricas.
+def trabajo(identificador, ruta_archivo, parametros):
+    def avisar(mensaje):
+        COLA_AVISOS.put((identificador, mensaje))
+
+    avisar({'estado': 'decodificando'})
+    with dm.verbosidad(False), dm.instrumentacion() as metricas:
+        resultado = decodificar_con_parciales(ruta_archivo, parametros, avisar)
+    return resultado, metricas['etapas']
+
+###### ESTADO DEL SERVICIO ######
+
+def estado_servicio(procesos=None, cola_maxima=COLA_MAXIMA):
+    procesos = procesos or os.cpu_count()
+    cola = multiprocessing.Queue()
+    return {
+        'pool': ProcessPoolExecutor(procesos, initializer=iniciar_trabajador, initargs=(cola,)),
+        'cola_avisos': cola,
+        'procesos': procesos,
+        'limite': procesos + cola_maxima,
+        'pendientes': 0,
+        'trabajos': {},
+        'siguiente_id': 0,
+        'inicio': time.time(),
+        'contadores': collections.Counter(),
+        'latencias': collections.deque(maxlen=LATENCIAS_GUARDADAS),
+        'esperas': collections.deque(maxlen=LATENCIAS_GUARDADAS),
+        'etapas': {},
+    }
+
+# Un hilo lee la cola de avisos de los procesos y los pasa al bucle de
+# asyncio, a la cola del trabajo correspondiente.
+def repartir_avisos(servicio, bucle):
+    while (aviso := servicio['cola_avisos'].get()) is not None:
+        bucle.call_soon_threadsafe(entregar_aviso, servicio, *aviso)
+
+# El aviso de que el trabajo ha empezado marca el final de su espera en
+# cola.
+def entregar_aviso(servicio, identificador, mensaje):
+    trabajo_en_curso = servicio['trabajos'].get(identificador)
+    if trabajo_en_curso is None:
+        return
+    if mensaje.get('estado') == 'decodificando':
+        servicio['esperas'].append(time.perf_counter() - trabajo_en_curso['llegada'])
+    trabajo_en_curso['avisos'].put_nowait(mensaje)
+
+# Suma las métricas por etapa de un trabajo a las del servicio.
+def acumular_etapas(servicio, etapas):
+    for nombre, registro in etapas.items():
+        total = servicio['etapas'].setdefault(nombre, dict(registro, llamadas=0, segundos=0.0,
+                                                           entrada=0, salida=0))
+        for clave in ('llamadas', 'segundos', 'entrada', 'salida'):
+            total[clave] += registro[clave]
+        for clave in ('bytes_reservados', 'pico_rss_bytes'):
+            if registro[clave] is not None:
+                total[clave] = max(total[clave] or 0, registro[clave])
+
+def percentiles(valores):
+    if not valores:
+        return {}
+    p50, p95, p99 = np.percentile(np.array(valores), (50, 95, 99))
+    return {'p50': round(p50, 4), 'p95': round(p95, 4), 'p99': round(p99, 4)}
+
+def salud(servicio):
+    contadores = servicio['contadores']
+    return {
+        'estado': 'ok',
+        'segundos_activo': round(time.time() - servicio['inicio'], 1),
+        'procesos': servicio['procesos'],
+        'pendientes': servicio['pendientes'],
+        'limite': servicio['limite'],
+        'peticiones': contadores['peticiones'],
+        'completadas': contadores['completadas'],
+        'errores': contadores['errores'],
+        'rechazadas': contadores['rechazadas'],
+        'latencia': percentiles(servicio['latencias']),
+        'espera_en_cola': percentiles(servicio['esperas']),
+    }
+
+# Métricas propias del servicio más las de las etapas de todos los trabajos.
+def metricas(servicio, prefijo='morse'):
+    estado = salud(servicio)
+    lineas = []
+    for nombre, tipo, ayuda, valor in (
+            ('peticiones_total', 'counter', 'Peticiones de decodificación recibidas', estado['peticiones']),
+            ('completadas_total', 'counter', 'Decodificaciones terminadas', estado['completadas']),
+            ('errores_total', 'counter', 'Decodificaciones con error', estado['errores']),
+            ('rechazadas_total', 'counter', 'Peticiones rechazadas por cola llena', estado['rechazadas']),
+            ('pendientes', 'gauge', 'Trabajos en cola o en proceso', estado['pendientes'])):
+        lineas += [f'# HELP {prefijo}_servicio_{nombre} {ayuda}', f'# TYPE {prefijo}_servicio_{nombre} {tipo}',
+                   f'{prefijo}_servicio_{nombre} {valor}']
+    for nombre, ayuda in (('latencia', 'Segundos desde que llega la petición hasta el resultado'),
+                          ('espera_en_cola', 'Segundos desde que llega la petición hasta que empieza')):
+        serie = f'{prefijo}_servicio_{nombre}_segundos'
+        lineas += [f'# HELP {serie} {ayuda}', f'# TYPE {serie} summary']
+        for cuantil, valor in estado[nombre].items():
+            lineas.append(f'{serie}{{quantile="0.{cuantil[1:]}"}} {valor}')
+    return '\n'.join(lineas) + '\n' + dm.metricas_a_prometheus({'etapas': servicio['etapas']}, prefijo)
+
+###### HTTP ######
+
+RAZONES = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+# Devuelve el método, la ruta, los parámetros de la consulta y las
+# cabeceras, None si el cliente cierra sin enviar nada, o ValueError si la
+# línea de petición está mal formada.
+async def leer_peticion(lector):
+    linea = await lector.readline()
+    if not linea:
+        return None
+    partes = linea.decode('latin-1').split(' ', 2)
+    if len(partes) != 3:
+        raise ValueError(f'Línea de petición mal formada: {linea[:100]!r}')
+    metodo, destino, _ = partes
+    cabeceras = {}
+    while (linea := await lector.readline()) not in (b'\r\n', b'\n', b''):
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        cabeceras[nombre.strip().lower()] = valor.strip()
+    url = urllib.parse.urlsplit(destino)
+    return metodo, url.path, dict(urllib.parse.parse_qsl(url.query)), cabeceras
+
+def responder(escritor, codigo, cuerpo, tipo='application/json', extra=''):
+    if not isinstance(cuerpo, bytes):
+        cuerpo = (cuerpo if isinstance(cuerpo, str) else json.dumps(cuerpo, ensure_ascii=False)).encode()
+    escritor.write(f'HTTP/1.1 {codigo} {RAZONES[codigo]}\r\nContent-Type: {tipo}; charset=utf-8\r\n'
+                   f'Content-Length: {len(cuerpo)}\r\nConnection: close\r\n{extra}\r\n'.encode() + cuerpo)
+
+# Cada evento del flujo es una línea JSON en un trozo de la codificación
+# chunked.
+def enviar_evento(escritor, evento):
+    linea = (json.dumps(evento, ensure_ascii=False) + '\n').encode()
+    escritor.write(f'{len(linea):x}\r\n'.encode() + linea + b'\r\n')
+
+def leer_parametros(consulta):
+    parametros = {}
+    for nombre, valor in consulta.items():
+        if nombre in PARAMETROS:
+            parametros[nombre] = PARAMETROS[nombre](valor)
+    if parametros.get('envolvente') not in (None, 'rms', 'pico'):
+        raise ValueError(f"Método de envolvente desconocido: {parametros['envolvente']}")
+    if parametros.get('clasificador', 'global') not in ('global', 'adaptativo'):
+        raise ValueError(f"Clasificador desconocido: {parametros['clasificador']}")
+    return parametros
+
+# Guarda el cuerpo de la petición en un archivo temporal, por trozos, para
+# que el proceso lo proyecte en memoria como cualquier otro WAV.
+async def guardar_cuerpo(lector, longitud):
+    descriptor, ruta_archivo = tempfile.mkstemp(suffix='.wav')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        while longitud > 0:
+            trozo = await lector.read(min(TAM_LECTURA, longitud))
+            if not trozo:
+                break
+            archivo.write(trozo)
+            longitud -= len(trozo)
+    return ruta_archivo
+
+async def atender(lector, escritor, servicio):
+    try:
+        try:
+            peticion = await leer_peticion(lector)
+        except ValueError as error:
+            responder(escritor, 400, {'error': str(error)})
+            await escritor.drain()
+            return
+        if peticion is None:
+            return
+        metodo, ruta, consulta, cabeceras = peticion
+        if ruta == '/salud':
+            responder(escritor, 200, salud(servicio))
+        elif ruta == '/metricas':
+            responder(escritor, 200, metricas(servicio), tipo='text/plain; version=0.0.4')
+        elif ruta != '/decodificar':
+            responder(escritor, 404, {'error': f'Ruta desconocida: {ruta}'})
+        elif metodo != 'POST':
+            responder(escritor, 405, {'error': 'Usa POST'})
+        else:
+            await decodificar_peticion(lector, escritor, servicio, consulta, cabeceras)
+        await escritor.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        escritor.close()
+
+async def decodificar_peticion(lector, escritor, servicio, consulta, cabeceras):
+    llegada = time.perf_counter()
+    servicio['contadores']['peticiones'] += 1
+    try:
+        parametros = leer_parametros(consulta)
+    except ValueError as error:
+        responder(escritor, 400, {'error': str(error)})
+        return
+    try:
+        longitud = int(cabeceras.get('content-length', 0))
+        if longitud < 0:
+            raise ValueError
+    except ValueError:
+        responder(escritor, 400, {'error': f"Content-Length no válido: {cabeceras['content-length']}"})
+        return
+    if 'ruta' not in consulta and not longitud:
+        responder(escritor, 400, {'error': 'Falta el WAV en el cuerpo o el parámetro ruta'})
+        return
+    if longitud > TAMANO_MAXIMO_SUBIDA:
+        responder(escritor, 413, {'error': f'El máximo es {TAMANO_MAXIMO_SUBIDA} bytes'})
+        return
+    # Contrapresión: con la cola llena no se lee el cuerpo y el cliente
+    # debe reintentar más tarde.
+    if servicio['pendientes'] >= servicio['limite']:
+        servicio['contadores']['rechazadas'] += 1
+        responder(escritor, 503, {'error': 'Cola llena', 'pendientes': servicio['pendientes']},
+                  extra='Retry-After: 1\r\n')
+        return
+
+    servicio['pendientes'] += 1
+    identificador = servicio['siguiente_id']
+    servicio['siguiente_id'] += 1
+    avisos = asyncio.Queue()
+    servicio['trabajos'][identificador] = {'avisos': avisos, 'llegada': llegada}
+    temporal = None
+    try:
+        if 'ruta' in consulta:
+            ruta_archivo = consulta['ruta']
+        else:
+            ruta_archivo = temporal = await guardar_cuerpo(lector, longitud)
+        futuro = asyncio.wrap_future(servicio['pool'].submit(trabajo, identificador, ruta_archivo, parametros))
+    except BaseException:
+        servicio['pendientes'] -= 1
+        del servicio['trabajos'][identificador]
+        if temporal is not None:
+            os.remove(temporal)
+        raise
+    futuro.add_done_callback(functools.partial(terminar_trabajo, servicio, identificador, llegada, temporal))
+
+    escritor.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n'
+                   b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+    enviar_evento(escritor, {'estado': 'en_cola', 'id': identificador, 'pendientes': servicio['pendientes']})
+    await escritor.drain()
+
+    # Reenviamos los avisos según llegan hasta que el trabajo termina.
+    while not futuro.done():
+        siguiente = asyncio.ensure_future(avisos.get())
+        await asyncio.wait((siguiente, futuro), return_when=asyncio.FIRST_COMPLETED)
+        if not siguiente.done():
+            siguiente.cancel()
+            break
+        enviar_evento(escritor, siguiente.result())
+        await escritor.drain()
+    while not avisos.empty():
+        enviar_evento(escritor, avisos.get_nowait())
+
+    try:
+        resultado, _ = futuro.result()
+        enviar_evento(escritor, {'resultado': resultado})
+    except Exception as error:
+        enviar_evento(escritor, {'error': f'{type(error).__name__}: {error}'})
+    escritor.write(b'0\r\n\r\n')
+
+# Al terminar un trabajo (aunque el cliente se haya desconectado) se libera
+# su hueco en la cola y se anotan sus métricas.
+def terminar_trabajo(servicio, identificador, llegada, temporal, futuro):
+    servicio['pendientes'] -= 1
+    servicio['trabajos'].pop(identificador, None)
+    if temporal is not None:
+        os.remove(temporal)
+    servicio['latencias'].append(time.perf_counter() - llegada)
+    try:
+        _, etapas = futuro.result()
+    except Exception:
+        servicio['contadores']['errores'] += 1
+        return
+    servicio['contadores']['completadas'] += 1
+    acumular_etapas(servicio, etapas)
+
+###### ARRANQUE ######
+
+async def servir(servicio, host='127.0.0.1', puerto=PUERTO, ruta_socket=None):
+    bucle = asyncio.get_running_loop()
+    hilo = threading.Thread(target=repartir_avisos, args=(servicio, bucle), daemon=True)
+    hilo.start()
+
+    def conexion(lector, escritor):
+        return atender(lector, escritor, servicio)
+
+    if ruta_socket is None:
+        servidor = await asyncio.start_server(conexion, host, puerto)
+        direccion = f'http://{host}:{puerto}'
+    else:
+        servidor = await asyncio.start_unix_server(conexion, ruta_socket)
+        direccion = f'unix:{ruta_socket}'
+    print(f'Escuchando en {direccion} con {servicio["procesos"]} procesos', file=sys.stderr)
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        servicio['cola_avisos'].put(None)
+        servicio['pool'].shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servicio HTTP local de decodificación de morse.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--socket', help='escuchar en este socket Unix en lugar de TCP')
+    parser.add_argument('-j', '--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--cola', type=int, default=COLA_MAXIMA,
+                        help='trabajos que pueden esperar además de los que están en proceso')
+    args = parser.parse_args(argv)
+
+    servicio = estado_servicio(args.procesos, args.cola)
+    try:
+        asyncio.run(servir(servicio, args.host, args.puerto, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Síntesis de pistas en morse a partir de texto, el camino inverso de
+morse_to_char. Sirve para generar pistas de prueba de cualquier duración con
+una transcripción conocida.
+
+La manipulación se construye como una cadena de unidades de punto (1 =
+sonido, 0 = silencio) y la señal se genera por bloques, de modo que una
+pista de varias horas se escribe a disco sin tenerla entera en memoria.
+
+Uso: python sintetizador_morse.py "CQ DE EA1ABC" salida.wav [--wpm 20] [--snr 10]
+"""
+import argparse
+import struct
+import sys
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+
+char_to_morse = {caracter: codigo for codigo, caracter in dm.morse_to_char.items()}
+
+# Amplitud de la portadora respecto al fondo de escala.
+AMPLITUD = 0.8
+
+# Silencio al principio y al final de la pista, en segundos.
+SILENCIO_BORDES = 0.1
+
+# Muestras que se generan a la vez.
+TAM_BLOQUE = 2**20
+
+###### MANIPULACIÓN ######
+
+# Cada símbolo es su sonido seguido de una unidad de silencio; al final de
+# una letra se añaden 2 unidades más (3 en total) y entre palabras otras 4
+# (7 en total). Los caracteres sin código morse se omiten.
+SIMBOLOS = {'.': '10', '-': '1110'}
+
+def unidades_letra(caracter):
+    return ''.join(SIMBOLOS[s] for s in char_to_morse[caracter])
+
+# Devuelve la manipulación (array de 0 y 1, uno por unidad) y el texto que
+# realmente contiene. Con un número máximo de unidades, el texto se repite
+# tantas veces completas como quepan y se termina con las letras sueltas
+# que aún entren.
+def manipulacion(texto, maximo_unidades=None):
+    textos = [''.join(c for c in p if c in char_to_morse) for p in texto.upper().split()]
+    textos = [p for p in textos if p]
+    if not textos:
+        raise ValueError('El texto no contiene caracteres con código morse')
+    palabras = [[unidades_letra(c) for c in p] for p in textos]
+    ciclo = '000000'.join('00'.join(letras) for letras in palabras) + '000000'
+
+    if maximo_unidades is None:
+        unidades, texto_real = [ciclo[:-6]], textos
+    else:
+        veces = max(0, (maximo_unidades + 6) // len(ciclo))
+        unidades, texto_real = [ciclo * veces], textos * veces
+        ocupadas = veces * len(ciclo)
+        for letras, texto_palabra in zip(palabras, textos):
+            cabe = 0
+            for letra in letras:
+                separacion = '00' if cabe else ''
+                if ocupadas + len(separacion) + len(letra) > maximo_unidades:
+                    break
+                unidades.append(separacion + letra)
+                ocupadas += len(separacion) + len(letra)
+                cabe += 1
+            if cabe:
+                texto_real.append(texto_palabra[:cabe])
+            if cabe < len(letras):
+                break
+            unidades.append('000000')
+            ocupadas += 6
+
+    unidades = ''.join(unidades).encode('ascii')
+    return np.frombuffer(unidades, dtype=np.uint8) - ord('0'), ' '.join(texto_real)
+
+###### SEÑAL ######
+
+# Convierte muestras en [-1, 1] a la codificación pedida, con los mismos
+# rangos que interpreta normalizar_codificacion.
+def codificar(x, dtype):
+    dtype = np.dtype(dtype)
+    if dtype == np.uint8:
+        return np.round(x * 127 + 128).astype(np.uint8)
+    if dtype == np.int16:
+        return np.round(x * 32767).astype(np.int16)
+    if dtype == np.int32:
+        return np.round(x * 2147483647).astype(np.int32)
+    if dtype == np.float32:
+        return x.astype(np.float32)
+    raise ValueError(f'Codificación no admitida: {dtype}')
+
+# Devuelve el texto que contiene la pista y un generador de bloques de
+# muestras ya codificadas. Si se indica una duración (en segundos), el texto
+# se repite, separado por pausas entre palabras, hasta llenarla con palabras
+# completas. Con snr (en dB respecto a la potencia de la portadora) se añade
+# ruido blanco gaussiano.
+def sintetizar_bloques(texto, wpm=20, frecuencia=700, sample_rate=8000, dtype=np.int16,
+                       snr=None, duracion=None, semilla=0, tam_bloque=TAM_BLOQUE):
+    muestras_unidad = 1.2 / wpm * sample_rate
+    bordes = int(SILENCIO_BORDES * sample_rate)
+    if duracion is None:
+        unidades, texto_real = manipulacion(texto)
+        total = int(len(unidades) * muestras_unidad) + 2 * bordes
+    else:
+        total = int(duracion * sample_rate)
+        unidades, texto_real = manipulacion(texto, int((total - 2 * bordes) / muestras_unidad))
+    # Silencio final: la manipulación acaba en cuanto se agotan las unidades.
+    unidades = np.concatenate([unidades, np.zeros(1, dtype=np.uint8)])
+    return texto_real, generar_bloques(unidades, muestras_unidad, bordes, total, frecuencia,
+                                       sample_rate, dtype, snr, semilla, tam_bloque)
+
+def generar_bloques(unidades, muestras_unidad, bordes, total, frecuencia, sample_rate,
+                    dtype, snr, semilla, tam_bloque):
+    rng = np.random.default_rng(semilla)
+    sigma = None if snr is None else AMPLITUD / np.sqrt(2) / 10 ** (snr / 20)
+    for i in range(0, total, tam_bloque):
+        n = np.arange(i, min(total, i + tam_bloque))
+        indice = np.clip(((n - bordes) / muestras_unidad).astype(np.int64), 0, len(unidades) - 1)
+        activo = np.where(n >= bordes, unidades[indice], 0)
+        x = AMPLITUD * activo * np.sin(2 * np.pi * frecuencia / sample_rate * n)
+        if sigma is not None:
+            x += rng.normal(0, sigma, len(x))
+        yield codificar(np.clip(x, -1, 1), dtype)
+
+# Pista completa en memoria. Devuelve el texto que contiene y las muestras.
+def sintetizar(texto, **parametros):
+    texto_real, bloques = sintetizar_bloques(texto, **parametros)
+    return texto_real, np.concatenate(list(bloques))
+
+###### ESCRITURA WAV ######
+
+# Cabecera de un WAV mono: formato 1 (PCM entero) o 3 (coma flotante).
+def cabecera_wav(sample_rate, dtype, muestras):
+    dtype = np.dtype(dtype)
+    formato = 3 if dtype.kind == 'f' else 1
+    bytes_datos = muestras * dtype.itemsize
+    return (b'RIFF' + struct.pack('<I', 36 + bytes_datos) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, formato, 1, sample_rate,
+                                    sample_rate * dtype.itemsize, dtype.itemsize, 8 * dtype.itemsize)
+            + b'data' + struct.pack('<I', bytes_datos))
+
+# Escribe la pista en un WAV bloque a bloque. Devuelve el texto que contiene
+# y el número de muestras.
+def escribir_wav(ruta_archivo, texto, sample_rate=8000, dtype=np.int16, **parametros):
+    muestras = 0
+    texto_real, bloques = sintetizar_bloques(texto, sample_rate=sample_rate, dtype=dtype, **parametros)
+    with open(ruta_archivo, 'wb') as archivo:
+        archivo.write(cabecera_wav(sample_rate, dtype, 0))
+        for bloque in bloques:
+            archivo.write(bloque.astype(bloque.dtype.newbyteorder('<'), copy=False).tobytes())
+            muestras += len(bloque)
+        # Con el total ya conocido, reescribimos la cabecera.
+        archivo.seek(0)
+        archivo.write(cabecera_wav(sample_rate, dtype, muestras))
+    return texto_real, muestras
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera una pista WAV en morse a partir de un texto.')
+    parser.add_argument('texto')
+    parser.add_argument('salida')
+    parser.add_argument('--wpm', type=float, default=20)
+    parser.add_argument('--frecuencia', type=float, default=700, help='portadora en Hz')
+    parser.add_argument('-r', '--sample-rate', type=int, default=8000)
+    parser.add_argument('--dtype', choices=('uint8', 'int16', 'int32', 'float32'), default='int16')
+    parser.add_argument('--snr', type=float, help='relación señal/ruido en dB (sin ruido si se omite)')
+    parser.add_argument('--duracion', type=float, help='repetir el texto hasta cubrir estos segundos')
+    args = parser.parse_args(argv)
+
+    _, muestras = escribir_wav(args.salida, args.texto, args.sample_rate, args.dtype, wpm=args.wpm,
+                               frecuencia=args.frecuencia, snr=args.snr, duracion=args.duracion)
+    print(f'{args.salida}: {muestras / args.sample_rate:.1f} s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
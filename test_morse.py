@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de lectura de WAV en codificaciones que no lee directamente
+leer_cabecera_wav y pasan por scipy.
+
+Uso: python -m pytest test_morse.py
+"""
+import functools
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+import decodificador_morse_v2 as dm
+import sintetizador_morse as sm
+
+TEXTO = 'CQ DE EA1ABC'
+
+# Cabecera RIFF de un WAV PCM con el tamaño de datos indicado. Con orden
+# '>' es una cabecera RIFX, la variante big-endian.
+def cabecera_wav(bits, datos, sample_rate=8000, canales=1, orden='<'):
+    bloque = bits // 8 * canales
+    formato = (np.array([1, canales], dtype=orden + 'u2').tobytes()
+               + np.array([sample_rate, sample_rate * bloque], dtype=orden + 'u4').tobytes()
+               + np.array([bloque, bits], dtype=orden + 'u2').tobytes())
+    return ((b'RIFF' if orden == '<' else b'RIFX') + np.array([36 + datos], dtype=orden + 'u4').tobytes()
+            + b'WAVE' + b'fmt ' + np.array([16], dtype=orden + 'u4').tobytes() + formato
+            + b'data' + np.array([datos], dtype=orden + 'u4').tobytes())
+
+# PCM de 24 bits: cada muestra de 16 bits en los 3 bytes bajos de un entero
+# de 32 bits desplazado 8 bits.
+def escribir_wav_24(ruta_archivo, texto=TEXTO, sample_rate=8000):
+    _, data = sm.sintetizar(texto, sample_rate=sample_rate, dtype=np.int16)
+    muestras = (data.astype('<i4') << 8).view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    with open(ruta_archivo, 'wb') as archivo:
+        archivo.write(cabecera_wav(24, len(muestras), sample_rate) + muestras)
+
+
+def test_wav_24_bits(tmp_path):
+    ruta_archivo = str(tmp_path / 'pista_24.wav')
+    escribir_wav_24(ruta_archivo)
+    sample_rate, data = dm.carga_audio_mmap(ruta_archivo)
+    assert sample_rate == 8000 and data.dtype == np.int32
+    assert dm.decodificar(ruta_archivo, verboso=False)['texto'] == TEXTO + ' '
+
+
+# Los WAV RIFX pasan por scipy, que devuelve las muestras big-endian; deben
+# decodificarse igual con los dos motores y con la envolvente.
+@pytest.mark.parametrize('parametros', [{}, {'motor': 'numba'}, {'envolvente': 'rms'}, {'envolvente': 'pico'}])
+def test_wav_big_endian(tmp_path, parametros):
+    _, data = sm.sintetizar(TEXTO, sample_rate=8000, dtype=np.int16)
+    muestras = data.astype('>i2').tobytes()
+    ruta_archivo = str(tmp_path / 'pista_rifx.wav')
+    with open(ruta_archivo, 'wb') as archivo:
+        archivo.write(cabecera_wav(16, len(muestras), orden='>') + muestras)
+    assert dm.carga_audio_mmap(ruta_archivo)[1].dtype == np.dtype('>i2')
+    assert dm.decodificar(ruta_archivo, verboso=False, **parametros)['texto'] == TEXTO + ' '
+    assert dm.decodificar(data.astype('>i2'), 8000, verboso=False, **parametros)['texto'] == TEXTO + ' '
+
+
+# Las transcripciones parciales del servicio solo llevan letras cerradas:
+# cada una (sin el espacio final que añade dm.tonos_a_latino) es el
+# principio del texto final.
+def test_parciales_sin_letra_abierta(tmp_path):
+    import servicio_morse as sv
+    texto = 'CQ DE EA1ABC 73 K'
+    _, data = sm.sintetizar(texto, sample_rate=8000, dtype=np.int16)
+    ruta_archivo = str(tmp_path / 'pista.wav')
+    with open(ruta_archivo, 'wb') as archivo:
+        archivo.write(cabecera_wav(16, data.nbytes) + data.astype('<i2').tobytes())
+    avisos = []
+    resultado = sv.decodificar_con_parciales(ruta_archivo, {'clasificador': 'adaptativo'}, avisos.append, cada=0.5)
+    assert resultado['texto'] == texto + ' '
+    assert avisos and all(resultado['texto'].startswith(aviso['parcial'].rstrip()) for aviso in avisos)
+
+
+# decodificar_banco admite rutas como str o como pathlib.Path.
+def test_banco_con_path(tmp_path):
+    import banco_filtros_morse as bf
+    _, data = sm.sintetizar(TEXTO, sample_rate=8000, dtype=np.int16)
+    ruta_archivo = tmp_path / 'pista.wav'
+    ruta_archivo.write_bytes(cabecera_wav(16, data.nbytes) + data.astype('<i2').tobytes())
+    canales = bf.decodificar_banco(ruta_archivo)
+    assert canales == bf.decodificar_banco(str(ruta_archivo))
+    assert [canal['texto'] for canal in canales] == [TEXTO + ' ']
+
+
+# Un WAV que se sigue grabando: se decodifica una parte, una caída deja
+# texto sin punto de control, se reinicia sin audio nuevo y luego con el
+# resto. El texto final es el de decodificar el archivo entero de una vez.
+def test_seguimiento_reanuda_tras_caida(tmp_path):
+    import seguimiento_morse as sg
+    _, data = sm.sintetizar(TEXTO + ' 73 K', sample_rate=8000, dtype=np.int16)
+    muestras = data.astype('<i2').tobytes()
+    corte = len(muestras) // 2 & ~1
+    ruta_archivo = str(tmp_path / 'grabacion.wav')
+    seguir = functools.partial(sg.seguir, ruta_archivo, intervalo=0.01, inactividad=0, eco=None)
+    with open(ruta_archivo, 'wb') as archivo:
+        # Mientras se graba, el tamaño de datos de la cabecera aún es 0.
+        archivo.write(cabecera_wav(16, 0) + muestras[:corte])
+    seguir()
+    with open(ruta_archivo + sg.EXTENSION_TEXTO, 'a') as texto:
+        texto.write('XYZ')
+    seguir()
+    # Al cerrar, el grabador escribe en la cabecera el tamaño real.
+    with open(ruta_archivo, 'r+b') as archivo:
+        archivo.write(cabecera_wav(16, len(muestras)))
+        archivo.seek(0, 2)
+        archivo.write(muestras[corte:])
+    seguir(finalizar=True)
+    with open(ruta_archivo + sg.EXTENSION_TEXTO, 'rb') as texto:
+        transcripcion = texto.read().decode('utf-8')
+    assert transcripcion.strip() == dm.decodificar(ruta_archivo, verboso=False)['texto'].strip()
+
+
+# decodificar_con_cache acepta los mismos parámetros que dm.decodificar,
+# también el motor y las posiciones, y da el mismo resultado. Las posiciones
+# se calculan de los tonos guardados, no del resultado.
+@pytest.mark.parametrize('parametros, aciertos', [({'motor': 'numba'}, ['fallo', 'resultado']),
+                                                  ({'posiciones': True}, ['fallo', 'tonos'])])
+def test_cache_motor_y_posiciones(tmp_path, parametros, aciertos):
+    import cache_morse as cm
+    _, data = sm.sintetizar(TEXTO, sample_rate=8000, dtype=np.int16)
+    directorio = str(tmp_path / 'cache')
+    esperado = dm.decodificar(data, 8000, verboso=False, **parametros)
+    for acierto in aciertos:
+        resultado = cm.decodificar_con_cache(data, 8000, directorio=directorio, **parametros)
+        assert resultado.pop('cache') == acierto
+        assert resultado.keys() == esperado.keys() and resultado['texto'] == esperado['texto']
+        if 'posiciones' in parametros:
+            assert np.array_equal(resultado['posiciones'], esperado['posiciones'])
+
+
+# La caché guarda los tonos y el resultado por separado: cambiar solo el
+# clasificador reutiliza los tonos y cambiar la detección vuelve a recorrer
+# el audio, siempre con el mismo resultado que dm.decodificar. Al recortar
+# se conservan las entradas usadas más recientemente.
+def test_cache_claves_y_recorte(tmp_path):
+    import cache_morse as cm
+    _, data = sm.sintetizar(TEXTO, sample_rate=8000, dtype=np.int16, snr=20)
+    directorio = str(tmp_path / 'cache')
+    for parametros, acierto in [({}, 'fallo'), ({}, 'resultado'), ({'clasificador': 'adaptativo'}, 'tonos'),
+                                ({'umbral': 0.3}, 'fallo'), ({'umbral': 0.3, 'clasificador': 'adaptativo'}, 'tonos')]:
+        resultado = cm.decodificar_con_cache(data, 8000, directorio=directorio, **parametros)
+        assert resultado.pop('cache') == acierto
+        assert resultado == dm.decodificar(data, 8000, verboso=False, **parametros)
+
+    for ruta, _, _ in cm.entradas(directorio):
+        os.utime(ruta, (1000, 1000))
+    assert cm.decodificar_con_cache(data, 8000, directorio=directorio)['cache'] == 'resultado'
+    usada = [(ruta, tamano) for ruta, tamano, modificado in cm.entradas(directorio) if modificado > 1000]
+    assert len(usada) == 1
+    assert cm.recortar(directorio, usada[0][1]) == 5
+    assert [ruta for ruta, _, _ in cm.entradas(directorio)] == [usada[0][0]]
+
+
+# Repartida entre varios procesos, una pista larga y ruidosa da el mismo
+# resultado que decodificada de principio a fin en uno solo.
+@pytest.mark.parametrize('parametros', [{}, {'envolvente': 'rms'}, {'frecuencia_trabajo': 4000,
+                                                                    'silencio_segundos': 0.002}])
+def test_paralelo_igual_que_secuencial(tmp_path, parametros):
+    import paralelo_morse as pm
+    ruta_archivo = str(tmp_path / 'larga.wav')
+    sm.escribir_wav(ruta_archivo, TEXTO, duracion=70, snr=20)
+    resultado = pm.decodificar_paralelo(ruta_archivo, procesos=2, segmentos=2, **parametros)
+    assert resultado.pop('segmentos') == 2
+    assert resultado == dm.decodificar(ruta_archivo, verboso=False, **parametros)
+
+
+# Cada candidato sin histéresis del barrido detecta los mismos tonos que
+# decodificar con ese umbral y ese silencio por separado, también cuando
+# los pulsos se reparten entre bloques pequeños.
+@pytest.mark.parametrize('tam_bloque', [dm.TAM_BLOQUE, 1000])
+def test_barrido_igual_que_por_separado(tam_bloque):
+    import barrido_morse as bm
+    _, data = sm.sintetizar(TEXTO, sample_rate=8000, dtype=np.int16, snr=15)
+    tonos = bm.tonos_candidatos(data, 8000, tam_bloque=tam_bloque)
+    for umbral, silencio in itertools.product(bm.UMBRALES, bm.SILENCIOS):
+        por_separado = dm.unir_tonos(dm.detectar_tonos(data, 8000, umbral, silencio_segundos=silencio))
+        assert np.array_equal(tonos[umbral, 1, silencio], por_separado)
+
+    resultado = bm.decodificar_barrido(data, 8000, histeresis=(1,))
+    resultado.pop('candidatos')
+    elegidos = {clave: resultado.pop(clave) for clave in ('umbral', 'histeresis', 'silencio_segundos', 'puntuacion')}
+    assert resultado == dm.decodificar(data, 8000, umbral=elegidos['umbral'],
+                                       silencio_segundos=elegidos['silencio_segundos'])
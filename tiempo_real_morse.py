@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Decodificación en tiempo real de audio PCM en crudo (por ejemplo, la salida
+de un receptor de radio) leído de stdin o de un socket local.
+
+Cada letra se emite en cuanto se confirma la pausa entre letras, sin esperar
+al final del mensaje. Para cada carácter se mide el retardo entre el final
+de su último tono y el momento en que se emite.
+
+Uso:
+    arecord -f S16_LE -r 8000 -t raw | python tiempo_real_morse.py -r 8000
+    python tiempo_real_morse.py -r 8000 --socket 127.0.0.1:7355
+"""
+import argparse
+import socket
+import sys
+import time
+
+import numpy as np
+
+import decodificador_morse_v2 as dm
+
+# Codificaciones PCM admitidas (little endian).
+FORMATOS = {
+    'u8': np.dtype(np.uint8),
+    's16le': np.dtype('<i2'),
+    's32le': np.dtype('<i4'),
+    'f32le': np.dtype('<f4'),
+}
+
+# Velocidad inicial supuesta antes de haber oído ningún tono.
+WPM_INICIAL = 20
+
+# Presupuesto de latencia por defecto, en segundos.
+LATENCIA_MAXIMA = 0.25
+
+###### ESTADO DEL DECODIFICADOR ######
+
+# Además del estado de pulsos y tonos de decodificador_morse_v2, guardamos
+# el del clasificador adaptativo (que lleva la estimación de la duración del
+# punto, en muestras), el código entero de la letra que se está formando
+# (ver TABLA_MORSE; 1 = letra vacía) y el final del último tono.
+def estado_tiempo_real(sample_rate, wpm=WPM_INICIAL, latencia_maxima=LATENCIA_MAXIMA):
+    return {
+        'pulsos': dm.estado_inicial(),
+        'clasificador': dm.estado_clasificador(1.2 / wpm * sample_rate),
+        'sample_rate': sample_rate,
+        'latencia_maxima': latencia_maxima * sample_rate,
+        'letra': 1,
+        'ultimo_fin': None,
+        'fin_palabra': True,
+    }
+
+# Muestras de silencio que confirman una pausa entre letras. Lo natural son
+# 2 puntos (a medio camino entre la pausa intra-letra de 1 punto y la
+# inter-letra de 3), pero si el presupuesto de latencia es menor lo
+# adelantamos, sin bajar de 1.25 puntos para no partir las letras.
+def silencio_fin_letra(estado):
+    punto = estado['clasificador']['punto']
+    return max(min(2 * punto, estado['latencia_maxima']), 1.25 * punto)
+
+###### PROCESADO INCREMENTAL ######
+
+# Incorpora un tono cerrado: el clasificador adaptativo lo etiqueta como
+# corto o largo y actualiza su estimación del punto. Como el punto inicial
+# viene de las wpm supuestas, no hay fase de arranque y cada tono se
+# clasifica en el momento. Las pausas las confirma emitir_por_silencio.
+def anadir_tono(tono, estado):
+    clase = dm.clasificar_tono(tono, estado['clasificador'])['clase'][-1]
+    estado['letra'] = (estado['letra'] << 1) | int(clase == dm.TONO_LARGO)
+    estado['ultimo_fin'] = tono[1]
+    estado['fin_palabra'] = False
+
+# Carácter correspondiente a un código de letra ('#' si no existe).
+def caracter(codigo):
+    if codigo < len(dm.TABLA_MORSE):
+        return str(dm.TABLA_MORSE[codigo])
+    return '#'
+
+# Emite la letra pendiente y, si el silencio llega a pausa entre palabras,
+# un espacio. Devuelve una lista de (carácter, retardo en muestras).
+def emitir_por_silencio(silencio, estado):
+    emitidos = []
+    retardo = estado['pulsos']['posicion'] - estado['ultimo_fin']
+    if estado['letra'] > 1 and silencio >= silencio_fin_letra(estado):
+        emitidos.append((caracter(estado['letra']), retardo))
+        estado['letra'] = 1
+    if not estado['fin_palabra'] and silencio >= 5 * estado['clasificador']['punto']:
+        emitidos.append((' ', retardo))
+        estado['fin_palabra'] = True
+    return emitidos
+
+def procesar_bloque(bloque, estado):
+    pulsos = dm.onda_a_pulsos_incremental(bloque, estado['pulsos'])
+    tonos = np.concatenate((dm.pulsos_a_tonos_incremental(pulsos, estado['pulsos']),
+                            dm.cerrar_tono_por_silencio(estado['pulsos'])))
+
+    emitidos = []
+    for tono in tonos.tolist():
+        # Si el bloque era largo, la pausa anterior al tono puede no haberse
+        # confirmado todavía.
+        if estado['ultimo_fin'] is not None:
+            emitidos += emitir_por_silencio(tono[0] - estado['ultimo_fin'], estado)
+        anadir_tono(tono, estado)
+
+    # Si no hay ningún tono sonando, miramos cuánto silencio llevamos.
+    pulsos = estado['pulsos']
+    sonando = pulsos['inicio_abierto'] is not None or pulsos['nuevo_tono'] is not None
+    if estado['ultimo_fin'] is not None and not sonando:
+        emitidos += emitir_por_silencio(pulsos['posicion'] - 1 - estado['ultimo_fin'], estado)
+    return emitidos
+
+###### LECTURA DE LA FUENTE ######
+
+# Devuelve una función que lee hasta n bytes de la fuente (b'' al terminar).
+def abrir_fuente(destino_socket=None):
+    if destino_socket is None:
+        return sys.stdin.buffer.read1
+
+    # Con host:puerto escuchamos por TCP; si no, es la ruta de un socket Unix.
+    if ':' in destino_socket:
+        host, puerto = destino_socket.rsplit(':', 1)
+        servidor = socket.create_server((host, int(puerto)))
+    else:
+        servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        servidor.bind(destino_socket)
+        servidor.listen(1)
+    print(f'Esperando conexión en {destino_socket}', file=sys.stderr)
+    conexion, _ = servidor.accept()
+    servidor.close()
+    return conexion.recv
+
+# Bucle principal: lee bloques pequeños, los decodifica y escribe cada
+# carácter en cuanto se confirma. Devuelve la lista de retardos (segundos).
+def decodificar_en_vivo(leer, sample_rate, formato='s16le', canales=1,
+                        wpm=WPM_INICIAL, latencia_maxima=LATENCIA_MAXIMA,
+                        salida=sys.stdout, informe=None):
+    tipo = FORMATOS[formato]
+    tam_frame = tipo.itemsize * canales
+    # El tamaño del bloque también añade latencia: como mucho 10 ms o un
+    # cuarto del presupuesto.
+    tam_bloque = max(1, int(sample_rate * min(0.01, latencia_maxima / 4)))
+
+    estado = estado_tiempo_real(sample_rate, wpm, latencia_maxima)
+    retardos = []
+    resto = b''
+    while True:
+        crudo = leer(tam_bloque * tam_frame)
+        if not crudo:
+            break
+        recibido = time.perf_counter()
+
+        # Los bytes que no completan un frame se guardan para la siguiente
+        # lectura.
+        crudo = resto + crudo
+        util = len(crudo) - len(crudo) % tam_frame
+        crudo, resto = crudo[:util], crudo[util:]
+        bloque = np.frombuffer(crudo, dtype=tipo)
+        if canales > 1:
+            bloque = bloque.reshape(-1, canales)[:, 0]
+
+        for emitido, retardo in procesar_bloque(bloque, estado):
+            salida.write(emitido)
+            salida.flush()
+            # Los espacios necesitan por definición 5 puntos de silencio y no
+            # cuentan para el presupuesto de latencia.
+            if emitido == ' ':
+                continue
+            # Retardo de audio (espera de confirmación y tamaño del bloque)
+            # más el tiempo de proceso desde que llegó el bloque.
+            retardo = retardo / sample_rate + (time.perf_counter() - recibido)
+            retardos.append(retardo)
+            if informe is not None:
+                aviso = ' EXCEDE PRESUPUESTO' if retardo > latencia_maxima else ''
+                print(f'{emitido!r} retardo {1000 * retardo:.1f} ms{aviso}', file=informe)
+
+    # Al terminar la fuente, la letra pendiente queda confirmada.
+    if estado['letra'] > 1:
+        salida.write(caracter(estado['letra']))
+    salida.write('\n')
+    salida.flush()
+    return retardos
+
+def resumen_retardos(retardos, latencia_maxima):
+    if not retardos:
+        return 'Sin caracteres emitidos'
+    ms = 1000 * np.array(retardos)
+    excedidos = int(np.sum(ms > 1000 * latencia_maxima))
+    return (f'Retardo por carácter: mediana {np.median(ms):.1f} ms, '
+            f'p95 {np.percentile(ms, 95):.1f} ms, máximo {ms.max():.1f} ms, '
+            f'{excedidos}/{len(ms)} por encima de {1000 * latencia_maxima:.0f} ms')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decodifica morse en tiempo real desde PCM en crudo.')
+    parser.add_argument('-r', '--sample-rate', type=int, required=True)
+    parser.add_argument('-f', '--formato', choices=FORMATOS, default='s16le')
+    parser.add_argument('-c', '--canales', type=int, default=1)
+    parser.add_argument('--socket', help='host:puerto (TCP) o ruta de socket Unix; por defecto stdin')
+    parser.add_argument('--wpm', type=float, default=WPM_INICIAL, help='velocidad inicial supuesta')
+    parser.add_argument('--latencia', type=float, default=LATENCIA_MAXIMA,
+                        help='presupuesto de latencia por carácter, en segundos')
+    parser.add_argument('--informe', action='store_true', help='mostrar el retardo de cada carácter en stderr')
+    args = parser.parse_args(argv)
+
+    leer = abrir_fuente(args.socket)
+    retardos = decodificar_en_vivo(leer, args.sample_rate, args.formato, args.canales,
+                                   args.wpm, args.latencia,
+                                   informe=sys.stderr if args.informe else None)
+    print(resumen_retardos(retardos, args.latencia), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()